@@ -0,0 +1 @@
+# Benchmarks for the image, tabular and audio hot paths, see benchmarks/run.py
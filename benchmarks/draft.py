@@ -0,0 +1,79 @@
+# Error-vs-speedup report of reduced-resolution JPEG decoding (core.canopy.DRAFT_SCALES).
+# Every image is decoded and thresholded at each draft scale (best of --repeats runs); the report gives
+# the canopy coverage, its relative error against the full resolution decode and the speedup.
+#
+# Usage:
+#   python -m benchmarks.draft
+#   python -m benchmarks.draft "timelapse/*.jpg" -o draft.json
+import argparse
+import glob
+import json
+import sys
+import time
+
+from benchmarks.run import DEFAULT_IMAGES, _metadata
+
+
+def _measure(path, draft_scale, repeats):
+    from core.canopy import SCALING_FACTOR, count_green_pixels_in_file
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        pixel_area = count_green_pixels_in_file(path, draft_scale=draft_scale)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, pixel_area / SCALING_FACTOR
+
+
+def compare_image(path, repeats=5):
+    from core.canopy import DRAFT_SCALES
+    rows = []
+    full_seconds, full_area = _measure(path, 1, repeats)
+    for draft_scale in DRAFT_SCALES:
+        seconds, area = (full_seconds, full_area) if draft_scale == 1 else _measure(path, draft_scale, repeats)
+        rows.append({
+            'image': path,
+            'draft_scale': draft_scale,
+            'seconds': seconds,
+            'speedup': full_seconds / seconds,
+            'area_cm2': area,
+            'error_pct': 100 * (area - full_area) / full_area if full_area else 0.0,
+        })
+    return rows
+
+
+def _print_table(rows):
+    print("| image | scale | time (ms) | speedup | canopy (cm²) | error |")
+    print("|---|---|---|---|---|---|")
+    for row in rows:
+        print(f"| {row['image']} | 1/{row['draft_scale']} | {1000 * row['seconds']:.1f} | {row['speedup']:.1f}x "
+              f"| {row['area_cm2']:.2f} | {row['error_pct']:+.2f}% |")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the error and speedup of draft JPEG decoding.")
+    parser.add_argument("images", nargs="*", default=DEFAULT_IMAGES,
+                        help="JPEG files or glob patterns (default: images/Day*.jpg)")
+    parser.add_argument("-o", "--output", default=None, help="also write the results as JSON")
+    parser.add_argument("--repeats", type=int, default=5, help="runs per image and scale, the best is kept")
+    args = parser.parse_args(argv)
+
+    paths = sorted(path for pattern in args.images for path in glob.glob(pattern))
+    if not paths:
+        parser.error("no images found")
+
+    from core.canopy import count_green_pixels_tiled
+    import numpy as np
+    count_green_pixels_tiled(np.zeros((1, 1, 3), dtype=np.uint8))  # JIT compilation isn't measured
+
+    rows = [row for path in paths for row in compare_image(path, args.repeats)]
+    _print_table(rows)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'metadata': _metadata(), 'results': rows}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
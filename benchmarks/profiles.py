@@ -0,0 +1,114 @@
+# Accuracy-vs-speed comparison of the "fast" and "full" audio analysis profiles (core.audio.PROFILES).
+# Every track is decoded and analyzed with both profiles (best of --repeats runs, after a warm-up so
+# numba compilation isn't counted); the report gives the speedup and how far the fast profile's
+# tempo, beat interval and band statistics are from the full profile's.
+#
+# Usage:
+#   python -m benchmarks.profiles
+#   python -m benchmarks.profiles ~/music/*.mp3 -o profiles.json
+#   python -m benchmarks.profiles --synthetic 5
+import argparse
+import glob
+import json
+import os
+import sys
+import tempfile
+import time
+from argparse import Namespace
+
+import numpy as np
+
+from benchmarks.run import _audio_files, _metadata
+
+DEFAULT_AUDIO = sorted(glob.glob(os.path.join('data', 'music_file', '*.mp3')) + glob.glob(os.path.join('data', '*.mp3')))
+
+STATS = ['spectral_mean', 'spectral_std', 'low_freq_mean', 'low_freq_std', 'mid_freq_mean', 'mid_freq_std',
+         'high_freq_mean', 'high_freq_std']
+
+
+def _analyze(path, profile, repeats):
+    import librosa
+    from core.audio import PROFILES
+    from core.feature_store import extract_features
+    sr = PROFILES[profile]['sr']
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        y, _ = librosa.load(path, sr=sr)
+        features = extract_features(y, sr, profile=profile)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, features
+
+
+def _beat_interval(features):
+    intervals = np.diff(features['beat_times'])
+    return float(intervals.mean()) if len(intervals) else float('nan')
+
+
+# Compare both profiles on one track
+def compare_track(path, repeats=3):
+    full_seconds, full = _analyze(path, 'full', repeats)
+    fast_seconds, fast = _analyze(path, 'fast', repeats)
+    ratio = fast['tempo'] / full['tempo'] if full['tempo'] else float('nan')
+    return {
+        'track': os.path.basename(path),
+        'duration_s': full['duration'],
+        'full_s': full_seconds,
+        'fast_s': fast_seconds,
+        'speedup': full_seconds / fast_seconds,
+        'tempo_full': full['tempo'],
+        'tempo_fast': fast['tempo'],
+        'tempo_error_pct': 100 * abs(ratio - 1),
+        # Half or double tempo: a different metrical level rather than a wrong estimate
+        'tempo_octave_error': bool(min(abs(ratio - 0.5), abs(ratio - 2)) < 0.04),
+        'beat_interval_error_s': abs(_beat_interval(fast) - _beat_interval(full)),
+        'stat_errors_db': {stat: abs(fast[stat] - full[stat]) for stat in STATS},
+    }
+
+
+def _print_table(rows):
+    print("| track | duration (s) | full (s) | fast (s) | speedup | tempo full/fast (bpm) | beat interval error (s) "
+          "| max band stat error (dB) |")
+    print("|---|---|---|---|---|---|---|---|")
+    for row in rows:
+        print(f"| {row['track']} | {row['duration_s']:.0f} | {row['full_s']:.2f} | {row['fast_s']:.2f} "
+              f"| {row['speedup']:.1f}x | {row['tempo_full']:.1f} / {row['tempo_fast']:.1f} "
+              f"| {row['beat_interval_error_s']:.3f} | {max(row['stat_errors_db'].values()):.2f} |")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the fast and full audio analysis profiles.")
+    parser.add_argument("audio", nargs="*", default=DEFAULT_AUDIO,
+                        help="audio files (default: the bundled Plantasia tracks)")
+    parser.add_argument("-o", "--output", default=None, help="also write the results as JSON")
+    parser.add_argument("--repeats", type=int, default=3, help="runs per track and profile, the best is kept")
+    parser.add_argument("--synthetic", type=int, default=0, metavar="MINUTES",
+                        help="also compare the synthetic track of benchmarks.run (tones, beats and noise)")
+    args = parser.parse_args(argv)
+
+    paths = [path for path in args.audio if os.path.getsize(path) > 0]
+    if not paths and not args.synthetic:
+        parser.error("no (non-empty) audio files, put the Plantasia MP3s in data/music_file, pass files "
+                     "or use --synthetic")
+
+    from core.warmup import warm_librosa
+    warm_librosa()
+
+    rows = []
+    with tempfile.TemporaryDirectory(prefix='plantamusica-profiles-') as workdir:
+        if args.synthetic:
+            paths = _audio_files(Namespace(audio=paths, workdir=workdir, scale=args.synthetic))
+        for path in paths:
+            rows.append(compare_track(path, args.repeats))
+            print(f"Compared {path}", file=sys.stderr)
+    _print_table(rows)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'metadata': _metadata(), 'results': rows}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,443 @@
+# Reproducible benchmarks of the image, tabular and audio hot paths, outside of Streamlit.
+# Every benchmark runs in its own process so its peak RSS is measured in isolation.
+#
+# Usage:
+#   python -m benchmarks.run -o bench.json
+#   python -m benchmarks.run --filter image --repeats 20 --scale 4
+#   python -m benchmarks.run -o new.json --compare bench.json
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+import warnings
+from queue import Empty
+
+import numpy as np
+
+DEFAULT_IMAGES = sorted(glob.glob(os.path.join('images', 'Day*.jpg')))
+DEFAULT_TABLES = [os.path.join('data', 'day_full_df.csv'), os.path.join('data', 'music_for_plants_df.csv')]
+DEFAULT_AUDIO = sorted(glob.glob(os.path.join('data', '*.mp3')) + glob.glob(os.path.join('data', 'music_file', '*.mp3')))
+
+BENCHMARKS = {}
+
+
+# Register a benchmark. The decorated function does the setup for the given options and returns
+# (run, items, unit): `run` is timed, `items` is how many units of work one call processes.
+def benchmark(name):
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+# Images
+
+def _read_images(options):
+    return [open(path, 'rb').read() for path in options.images]
+
+
+@benchmark('image/process_image')
+def bench_process_image(options):
+    from PIL import Image
+    from io import BytesIO
+    from core.canopy import compute_mask, get_area_in_pixels
+    images = _read_images(options)
+
+    # The original page path: decode, RGB array, HSV copy, full mask, count
+    def run():
+        for image_bytes in images:
+            image_array = np.array(Image.open(BytesIO(image_bytes)).convert('RGB'))
+            get_area_in_pixels(compute_mask(image_array))
+    return run, len(images), 'images'
+
+
+def _decoded_images(options):
+    from PIL import Image
+    return [np.asarray(Image.open(path).convert('RGB')) for path in options.images]
+
+
+@benchmark('image/threshold_opencv')
+def bench_threshold_opencv(options):
+    from core.canopy import LOWER_GREEN, UPPER_GREEN, compute_mask, get_area_in_pixels
+    arrays = _decoded_images(options)
+    megapixels = sum(array.shape[0] * array.shape[1] for array in arrays) / 1e6
+
+    # Thresholding only (decoding excluded): HSV copy, full mask, boolean temporary and count
+    def run():
+        for array in arrays:
+            get_area_in_pixels(compute_mask(array, LOWER_GREEN, UPPER_GREEN))
+    return run, megapixels, 'megapixels'
+
+
+@benchmark('image/threshold_fused')
+def bench_threshold_fused(options):
+    from core.canopy import LOWER_GREEN, UPPER_GREEN
+    from core.hsv import count_in_range
+    arrays = _decoded_images(options)
+    megapixels = sum(array.shape[0] * array.shape[1] for array in arrays) / 1e6
+    count_in_range(arrays[0], LOWER_GREEN, UPPER_GREEN)  # JIT compilation isn't part of the measurement
+
+    # Single pass, no intermediate arrays
+    def run():
+        for array in arrays:
+            count_in_range(array, LOWER_GREEN, UPPER_GREEN)
+    return run, megapixels, 'megapixels'
+
+
+@benchmark('image/threshold_fused_mask')
+def bench_threshold_fused_mask(options):
+    from core.canopy import LOWER_GREEN, UPPER_GREEN
+    from core.hsv import count_in_range
+    arrays = _decoded_images(options)
+    megapixels = sum(array.shape[0] * array.shape[1] for array in arrays) / 1e6
+    masks = [np.empty(array.shape[:2], dtype=np.uint8) for array in arrays]
+    count_in_range(arrays[0], LOWER_GREEN, UPPER_GREEN, masks[0])
+
+    # Single pass that also writes the mask, as needed for display
+    def run():
+        for array, mask in zip(arrays, masks):
+            count_in_range(array, LOWER_GREEN, UPPER_GREEN, mask)
+    return run, megapixels, 'megapixels'
+
+
+@benchmark('image/analyze_cached')
+def bench_analyze_cached(options):
+    from core.canopy import MaskCache, analyze_image_bytes
+    images = _read_images(options)
+    cache = MaskCache()
+    for image_bytes in images:
+        analyze_image_bytes(image_bytes, cache)
+
+    def run():
+        for image_bytes in images:
+            analyze_image_bytes(image_bytes, cache)
+    return run, len(images), 'images'
+
+
+@benchmark('image/tiled_scaled')
+def bench_tiled_scaled(options):
+    from PIL import Image
+    from core.canopy import count_green_pixels_in_file
+    # A synthetic mosaic of the first image repeated scale x scale times, stored as raw .npy
+    image_array = np.array(Image.open(options.images[0]).convert('RGB'))
+    path = os.path.join(options.workdir, f'mosaic_{options.scale}.npy')
+    if not os.path.exists(path):
+        np.save(path, np.tile(image_array, (options.scale, options.scale, 1)))
+    megapixels = image_array.shape[0] * image_array.shape[1] * options.scale ** 2 / 1e6
+
+    def run():
+        count_green_pixels_in_file(path)
+    return run, megapixels, 'megapixels'
+
+
+# Tables
+
+def _scaled_table(path, scale):
+    import pandas as pd
+    df = pd.read_csv(path)
+    if scale <= 1:
+        return df
+    # Resample the rows with a little noise so the scaled-up table is not just duplicates
+    rng = np.random.default_rng(0)
+    rows = df.sample(len(df) * scale * 100, replace=True, random_state=0).reset_index(drop=True)
+    numeric = rows.select_dtypes('number')
+    rows[numeric.columns] = numeric + rng.normal(scale=0.01, size=numeric.shape) * numeric.std().to_numpy()
+    return rows
+
+
+@benchmark('table/polyfit_r2')
+def bench_polyfit_r2(options):
+    from sklearn.metrics import r2_score
+    tables = [_scaled_table(path, options.scale) for path in options.tables]
+    x_column, y_column = 'Air Temp Mean (°C)', 'Canopy Coverage (cm²)'
+    warnings.filterwarnings('ignore', message='Polyfit may be poorly conditioned')
+
+    # The Data Analysis page path for one X/Y pair and every slider degree
+    def run():
+        for df in tables:
+            for degree in range(1, 11):
+                polynomial = np.poly1d(np.polyfit(df[x_column], df[y_column], degree))
+                r2_score(df[y_column], polynomial(df[x_column]))
+    return run, 10 * len(tables), 'fits'
+
+
+@benchmark('table/fit_matrix')
+def bench_fit_matrix(options):
+    from core.fitting import fit_matrix, numeric_columns
+    tables = [_scaled_table(path, options.scale) for path in options.tables]
+    fits = sum(numeric_columns(df).shape[1] ** 2 * 10 for df in tables)
+
+    def run():
+        for df in tables:
+            fit_matrix(df)
+    return run, fits, 'fits'
+
+
+@benchmark('table/model_selection')
+def bench_model_selection(options):
+    from core.model_selection import BOOTSTRAP_REPLICATES, CV_FOLDS, CV_REPEATS, model_selection
+    tables = [_scaled_table(path, options.scale) for path in options.tables]
+    x_column, y_column = 'Air Temp Mean (°C)', 'Canopy Coverage (cm²)'
+
+    # Cross-validation and bootstrap of degrees 1-10 for the default pair, in this process
+    def run():
+        for df in tables:
+            model_selection(df[x_column], df[y_column], workers=1)
+    return run, len(tables) * 10 * (BOOTSTRAP_REPLICATES + CV_FOLDS * CV_REPEATS), 'fits'
+
+
+def _daily_features(options, n_features):
+    # A year of daily readings per scale step with 10% of the values missing
+    rng = np.random.default_rng(0)
+    values = rng.normal(size=(365 * options.scale, n_features)).cumsum(axis=0)
+    values[rng.random(values.shape) < 0.1] = np.nan
+    return values
+
+
+@benchmark('table/lagged_correlation')
+def bench_lagged_correlation(options):
+    from core.correlation import lagged_correlation
+    values = _daily_features(options, 100)
+    lags = range(-15, 16)
+
+    def run():
+        lagged_correlation(values, values, lags)
+    return run, values.shape[1] ** 2 * len(lags), 'correlations'
+
+
+@benchmark('table/correlation_pairs')
+def bench_correlation_pairs(options):
+    import pandas as pd
+    columns = [pd.Series(column) for column in _daily_features(options, 100)[:, :10].T]
+    lags = range(-15, 16)
+
+    # One pandas call per pair and lag, as when plotting the pairs one at a time
+    def run():
+        for x in columns:
+            for y in columns:
+                for lag in lags:
+                    x.corr(y.shift(-lag))
+    return run, len(columns) ** 2 * len(lags), 'correlations'
+
+
+# Audio
+
+def _audio_files(options):
+    import soundfile as sf
+    paths = [path for path in options.audio if os.path.getsize(path) > 0]
+    # A synthetic track (tones, beats and noise) so the benchmark also runs without the MP3s
+    synthetic = os.path.join(options.workdir, f'synthetic_{options.scale}.wav')
+    if not os.path.exists(synthetic):
+        sr = 44100
+        t = np.arange(int(sr * 60 * options.scale)) / sr
+        rng = np.random.default_rng(0)
+        y = 0.3 * np.sin(2 * np.pi * 220 * t) + 0.1 * np.sin(2 * np.pi * 2500 * t)
+        y += 0.5 * (np.mod(t, 0.5) < 0.02) + 0.02 * rng.standard_normal(len(t))
+        sf.write(synthetic, y.astype(np.float32), sr)
+    return paths + [synthetic]
+
+
+@benchmark('audio/load_beat_stft')
+def bench_load_beat_stft(options):
+    import librosa
+    paths = _audio_files(options)
+    seconds = sum(librosa.get_duration(path=path) for path in paths)
+
+    # The Music Analysis page path: decode, beat tracking and the dB spectrogram
+    def run():
+        for path in paths:
+            y, sr = librosa.load(path)
+            librosa.beat.beat_track(y=y, sr=sr)
+            librosa.amplitude_to_db(np.abs(librosa.stft(y)), ref=np.max)
+    return run, seconds, 'audio seconds'
+
+
+@benchmark('audio/streaming_stats')
+def bench_streaming_stats(options):
+    import librosa
+    from core.audio import file_blocks, stream_spectral_statistics
+    paths = _audio_files(options)
+    seconds = sum(librosa.get_duration(path=path) for path in paths)
+
+    def run():
+        for path in paths:
+            stream_spectral_statistics(lambda: file_blocks(path))
+    return run, seconds, 'audio seconds'
+
+
+def _bench_profile(options, profile):
+    import librosa
+    from core.audio import PROFILES
+    from core.feature_store import extract_features
+    paths = _audio_files(options)
+    seconds = sum(librosa.get_duration(path=path) for path in paths)
+    sr = PROFILES[profile]['sr']
+
+    # Decode at the profile's sample rate and extract everything the Music Analysis page shows
+    def run():
+        for path in paths:
+            y, _ = librosa.load(path, sr=sr)
+            extract_features(y, sr, profile=profile)
+    return run, seconds, 'audio seconds'
+
+
+@benchmark('audio/profile_full')
+def bench_profile_full(options):
+    return _bench_profile(options, 'full')
+
+
+@benchmark('audio/profile_fast')
+def bench_profile_fast(options):
+    return _bench_profile(options, 'fast')
+
+
+def _percentile_summary(latencies):
+    latencies = np.array(latencies) * 1000
+    return {
+        'min': float(latencies.min()),
+        'mean': float(latencies.mean()),
+        'p50': float(np.percentile(latencies, 50)),
+        'p90': float(np.percentile(latencies, 90)),
+        'p99': float(np.percentile(latencies, 99)),
+        'max': float(latencies.max()),
+    }
+
+
+# Run one benchmark (inside the child process) and put its result on the queue
+def _run_one(name, options, queue):
+    try:
+        run, items, unit = BENCHMARKS[name](options)
+        for _ in range(options.warmup):
+            run()
+        latencies = []
+        for _ in range(options.repeats):
+            start = time.perf_counter()
+            run()
+            latencies.append(time.perf_counter() - start)
+        latency = _percentile_summary(latencies)
+        queue.put({
+            'name': name,
+            'repeats': options.repeats,
+            'latency_ms': latency,
+            'throughput': {'value': items / (latency['p50'] / 1000), 'unit': f'{unit}/s'},
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        })
+    except Exception:
+        queue.put({'name': name, 'error': traceback.format_exc()})
+
+
+def run_benchmarks(names, options):
+    context = multiprocessing.get_context('spawn')  # fresh interpreter, so the RSS is the benchmark's own
+    results = []
+    for name in names:
+        queue = context.Queue()
+        process = context.Process(target=_run_one, args=(name, options, queue))
+        process.start()
+        result = _wait_for_result(name, process, queue)
+        process.join()
+        results.append(result)
+        _print_result(result)
+    return results
+
+
+# Result of a benchmark process, or an error entry when it dies without one (OOM kill, crash in native code)
+def _wait_for_result(name, process, queue, poll_interval=1.0):
+    while True:
+        try:
+            return queue.get(timeout=poll_interval)
+        except Empty:
+            if not process.is_alive():
+                break
+    # The result may have been put just before the process exited
+    try:
+        return queue.get(timeout=poll_interval)
+    except Empty:
+        return {'name': name, 'error': f"benchmark process exited with code {process.exitcode} without a result"}
+
+
+def _print_result(result):
+    if 'error' in result:
+        print(f"{result['name']:28s} FAILED\n{result['error']}", file=sys.stderr)
+        return
+    latency, throughput = result['latency_ms'], result['throughput']
+    print(f"{result['name']:28s} p50 {latency['p50']:9.1f} ms  p90 {latency['p90']:9.1f} ms  "
+          f"{throughput['value']:10.1f} {throughput['unit']:18s} peak RSS {result['peak_rss_mb']:7.0f} MB",
+          file=sys.stderr)
+
+
+# Print the p50 latency and peak RSS ratios against an earlier results file
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {result['name']: result for result in json.load(f)['results'] if 'error' not in result}
+    print(f"\nCompared with {baseline_path} (new / old):", file=sys.stderr)
+    for result in results:
+        old = baseline.get(result['name'])
+        if old is None or 'error' in result:
+            continue
+        latency = result['latency_ms']['p50'] / old['latency_ms']['p50']
+        rss = result['peak_rss_mb'] / old['peak_rss_mb']
+        print(f"{result['name']:28s} p50 x{latency:5.2f}  peak RSS x{rss:5.2f}", file=sys.stderr)
+
+
+def _metadata():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'git_commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the image, tabular and audio hot paths.")
+    parser.add_argument("-o", "--output", help="write the results as JSON to this file")
+    parser.add_argument("--filter", default="", help="only run benchmarks whose name contains this text")
+    parser.add_argument("--repeats", type=int, default=10, help="timed runs per benchmark")
+    parser.add_argument("--warmup", type=int, default=1, help="untimed runs per benchmark")
+    parser.add_argument("--scale", type=int, default=1,
+                        help="scale factor of the synthetic inputs (mosaic tiles per side, table size, track minutes)")
+    parser.add_argument("--images", nargs="+", default=DEFAULT_IMAGES, help="images to benchmark")
+    parser.add_argument("--tables", nargs="+", default=DEFAULT_TABLES, help="CSV tables to benchmark")
+    parser.add_argument("--audio", nargs="*", default=DEFAULT_AUDIO, help="audio files to benchmark")
+    parser.add_argument("--compare", metavar="BASELINE", help="earlier results file to compare against")
+    parser.add_argument("--list", action="store_true", help="list the benchmarks and exit")
+    options = parser.parse_args(argv)
+
+    names = [name for name in BENCHMARKS if options.filter in name]
+    if options.list:
+        print("\n".join(names))
+        return 0
+
+    with tempfile.TemporaryDirectory(prefix='plantamusica-bench-') as workdir:
+        options.workdir = workdir
+        results = run_benchmarks(names, options)
+
+    report = {'metadata': _metadata(), 'options': {'repeats': options.repeats, 'scale': options.scale},
+              'results': results}
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    if options.compare:
+        compare(results, options.compare)
+    return 1 if any('error' in result for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+# Cold start profile of the multipage app: for every page a fresh interpreter runs the page script
+# once (headless, through streamlit.testing) and we report the time to first render together with
+# the slowest imports from `python -X importtime`.
+#
+# Usage:
+#   python -m benchmarks.startup
+#   python -m benchmarks.startup -o startup.json --top 15 plantamusica.py
+import argparse
+import glob
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+DEFAULT_SCRIPTS = ['plantamusica.py'] + sorted(glob.glob('pages/*.py'))
+
+IMPORT_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)$')
+
+
+# Child process: render one page script and print the elapsed time as JSON
+def _render(script, timeout):
+    start = time.perf_counter()
+    from streamlit.testing.v1 import AppTest
+    app = AppTest.from_file(os.path.abspath(script), default_timeout=timeout).run()
+    print(json.dumps({
+        'time_to_first_render_s': time.perf_counter() - start,
+        'exceptions': [exception.message for exception in app.exception],
+    }))
+
+
+# Top level imports (those done directly by the page or its shared modules) by cumulative time
+def _slowest_imports(stderr, top):
+    imports = []
+    for line in stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match and len(match.group(3)) == 1:
+            imports.append({'module': match.group(4), 'cumulative_s': int(match.group(2)) / 1e6})
+    return sorted(imports, key=lambda entry: entry['cumulative_s'], reverse=True)[:top]
+
+
+def profile_script(script, top=10, timeout=300):
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-m', 'benchmarks.startup', '--child', script,
+                              '--timeout', str(timeout)], capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    lines = process.stdout.strip().splitlines()
+    if process.returncode == 0 and lines:
+        result = json.loads(lines[-1])
+    else:
+        errors = [line for line in process.stderr.splitlines() if not line.startswith('import time:')]
+        result = {'error': '\n'.join(errors[-20:])}
+    result.update({'script': script, 'process_wall_s': wall, 'slowest_imports': _slowest_imports(process.stderr, top)})
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the cold start time of the app pages.")
+    parser.add_argument("scripts", nargs="*", default=DEFAULT_SCRIPTS, help="page scripts to measure")
+    parser.add_argument("-o", "--output", help="write the results as JSON to this file")
+    parser.add_argument("--top", type=int, default=10, help="number of slowest imports to report")
+    parser.add_argument("--timeout", type=float, default=300, help="seconds allowed for one page run")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        _render(args.child, args.timeout)
+        return 0
+
+    results = []
+    for script in args.scripts:
+        result = profile_script(script, args.top, args.timeout)
+        results.append(result)
+        if 'error' in result:
+            print(f"{script:40s} FAILED\n{result['error']}", file=sys.stderr)
+            continue
+        slowest = ", ".join(f"{entry['module']} {entry['cumulative_s']:.2f}s" for entry in result['slowest_imports'][:3])
+        print(f"{script:40s} first render {result['time_to_first_render_s']:6.2f}s  (slowest imports: {slowest})",
+              file=sys.stderr)
+
+    report = {'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    return 1 if any('error' in result for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1 @@
+# Shared processing code used by the Streamlit pages and the command line tools
@@ -0,0 +1,109 @@
+# Process-wide store of decoded arrays (the bundled audio tracks) shared by all sessions.
+# Each asset is decoded once into an .npy file and memory-mapped read-only, so every session (and
+# every server process using the same directory) reads the same pages instead of holding its own copy.
+# Images are not stored here: the canopy page keys its masks and previews by image content
+# (MaskCache in core/canopy.py), so it never needs the decoded RGB array of an image again.
+#
+# Every get() maps the file anew and tracks that mapping (the mmap object, which any array or buffer
+# derived from the result keeps alive) with a weak reference. Assets no caller references any more
+# are deleted least recently used first once the total size exceeds max_bytes.
+import hashlib
+import os
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict, deque
+
+import numpy as np
+
+ASSETS_DIR = os.environ.get("PLANTAMUSICA_ASSET_DIR", os.path.join(tempfile.gettempdir(), "plantamusica-assets"))
+
+
+# Key of a file's decoded content: changes with the file and with the decoding parameters
+def asset_key(path, *params):
+    stat = os.stat(path)
+    digest = hashlib.sha256(repr((os.path.abspath(path), stat.st_mtime_ns, stat.st_size, params)).encode())
+    return digest.hexdigest()
+
+
+class _Asset:
+    __slots__ = ("nbytes", "references")
+
+    def __init__(self, nbytes):
+        self.nbytes = nbytes
+        self.references = 0
+
+
+class AssetStore:
+    def __init__(self, max_bytes=512 * 1024 * 1024, directory=ASSETS_DIR):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self._assets = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._released = deque()
+        os.makedirs(directory, exist_ok=True)
+
+    def __len__(self):
+        return len(self._assets)
+
+    # Read-only array of the asset, decoded with decode() into the shared file when it isn't there yet
+    def get(self, key, decode):
+        array = self._map(key, decode)
+        mapping = array.base
+        with self._lock:
+            asset = self._assets.get(key)
+            if asset is None:
+                asset = self._assets[key] = _Asset(array.nbytes)
+                self._size += array.nbytes
+            else:
+                self._assets.move_to_end(key)
+            asset.references += 1
+            weakref.finalize(mapping, self._released.append, asset)
+            self._evict()
+        return array.view(np.ndarray)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".npy")
+
+    # This caller's own mapping of the shared file, decoding the asset first if it isn't on disk
+    def _map(self, key, decode):
+        path = self._path(key)
+        try:
+            return np.load(path, mmap_mode='r')
+        except (OSError, ValueError):
+            pass
+        array = np.ascontiguousarray(decode())
+        # Write to a private temporary file first so other processes never map a partial array
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp.npy")
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, array)
+        os.replace(tmp_path, path)
+        return np.load(path, mmap_mode='r')
+
+    # Delete unreferenced assets, least recently used first, until we fit in the budget. Mappings
+    # released since the last call are counted first: the finalizers only queue them, since they
+    # run during garbage collection, possibly on a thread that already holds the lock.
+    def _evict(self):
+        while self._released:
+            self._released.popleft().references -= 1
+        for key in list(self._assets):
+            if self._size <= self.max_bytes:
+                break
+            asset = self._assets[key]
+            if asset.references:
+                continue
+            del self._assets[key]
+            self._size -= asset.nbytes
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+
+# Decoded mono float32 samples of an audio file resampled to sr, returns (y, sr) like librosa.load
+def load_audio(store, path, sr=22050):
+    def decode():
+        import librosa
+        return librosa.load(path, sr=sr)[0]
+    return store.get(asset_key(path, 'mono', sr), decode), sr
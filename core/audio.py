@@ -0,0 +1,278 @@
+# Music analysis: spectral statistics over the full spectrogram or streamed block by block
+import hashlib
+import os
+import tempfile
+import threading
+from collections import Counter
+from io import BytesIO
+
+import librosa
+import numpy as np
+
+SAMPLE_RATE = 22050  # librosa's default load rate
+N_FFT = 2048
+HOP_LENGTH = 512
+TOP_DB = 80.0
+
+# Low Range Frequency (20 - 250 Hz), Mid Range Frequency (251 - 2,500 Hz), High Range Frequency (2,001 - 10,000 Hz)
+FREQUENCY_BANDS = {
+    "low": (20, 250),
+    "mid": (250, 2000),
+    "high": (2000, 10000),
+}
+
+
+# Analysis profiles. "full" reproduces the original page output. "fast" decodes at half the rate with
+# twice the hop duration (46 ms) and takes the tempo from an onset envelope derived from the same STFT
+# instead of a separate mel spectrogram; at 11025 Hz the high band is cut at 5.5 kHz.
+# See benchmarks/profiles.py for the accuracy-vs-speed comparison.
+PROFILES = {
+    "full": {"sr": SAMPLE_RATE, "n_fft": N_FFT, "hop_length": HOP_LENGTH, "onset_tempo": False},
+    "fast": {"sr": 11025, "n_fft": 1024, "hop_length": 512, "onset_tempo": True},
+}
+DEFAULT_PROFILE = "full"
+
+
+def _band_masks(sr, n_fft):
+    freqs = librosa.fft_frequencies(sr=sr, n_fft=n_fft)
+    return {name: (freqs >= low) & (freqs <= high) for name, (low, high) in FREQUENCY_BANDS.items()}
+
+
+# Statistics of a dB spectrogram: overall mean/std and per band mean/std
+def spectral_statistics(S_dB, sr, n_fft=N_FFT):
+    stats = {"spectral_mean": float(np.mean(S_dB)), "spectral_std": float(np.std(S_dB))}
+    for name, band in _band_masks(sr, n_fft).items():
+        stats[f"{name}_freq_mean"] = float(np.mean(S_dB[band, :], axis=0).mean())
+        stats[f"{name}_freq_std"] = float(np.std(S_dB[band, :], axis=0).mean())
+    return stats
+
+
+# Yield consecutive blocks of an in-memory signal
+def array_blocks(y, block_size=SAMPLE_RATE * 30):
+    for start in range(0, len(y), block_size):
+        yield y[start:start + block_size]
+
+
+_spill_lock = threading.Lock()
+_spill_users = Counter()
+
+
+# Decode encoded audio (e.g. the bytes of an upload) to mono float32 at sr, like librosa.load.
+# libsndfile 1.1+ decodes MP3 straight from memory; with older versions the bytes are spilled to a
+# temporary file named after their hash (so identical uploads share it), deleted once no decode uses it.
+def load_audio_bytes(audio_bytes, sr=SAMPLE_RATE):
+    try:
+        return librosa.load(BytesIO(audio_bytes), sr=sr)
+    except RuntimeError:
+        pass
+    digest = hashlib.sha256(audio_bytes).hexdigest()
+    path = os.path.join(tempfile.gettempdir(), f"plantamusica-{digest}.audio")
+    with _spill_lock:
+        if not _spill_users[digest]:
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(audio_bytes)
+            os.replace(tmp_path, path)
+        _spill_users[digest] += 1
+    try:
+        return librosa.load(path, sr=sr)
+    finally:
+        with _spill_lock:
+            _spill_users[digest] -= 1
+            if not _spill_users[digest]:
+                del _spill_users[digest]
+                os.remove(path)
+
+
+# Duration in seconds from the header of an audio file (path or file object), None when libsndfile
+# can't read it
+def audio_duration(source):
+    import soundfile as sf
+    try:
+        return sf.info(source).duration
+    except (sf.LibsndfileError, RuntimeError):
+        return None
+    finally:
+        if hasattr(source, "seek"):
+            source.seek(0)
+
+
+# Yield mono blocks of an audio file resampled to sr, without decoding the whole file at once.
+# Files libsndfile can't read are decoded in one go by librosa and then split into blocks.
+def file_blocks(source, sr=SAMPLE_RATE, block_seconds=30):
+    import soundfile as sf
+    import soxr
+
+    if hasattr(source, "seek"):
+        source.seek(0)
+    try:
+        audio_file = sf.SoundFile(source)
+    except (sf.LibsndfileError, RuntimeError):
+        if hasattr(source, "seek"):
+            source.seek(0)
+        y, _ = librosa.load(source, sr=sr)
+        yield from array_blocks(y, int(sr * block_seconds))
+        return
+
+    with audio_file:
+        resampler = None
+        if audio_file.samplerate != sr:
+            resampler = soxr.ResampleStream(audio_file.samplerate, sr, 1, dtype='float32', quality='HQ')
+        block_frames = int(audio_file.samplerate * block_seconds)
+        while True:
+            block = audio_file.read(block_frames, dtype='float32', always_2d=True)
+            last = len(block) < block_frames
+            block = block.mean(axis=1, dtype=np.float32)  # Down-mix to mono like librosa.load
+            if resampler is not None:
+                block = resampler.resample_chunk(block, last=last)
+            if len(block):
+                yield block
+            if last:
+                break
+
+
+# Yield |STFT| blocks identical to the columns of np.abs(librosa.stft(y)) (centered, zero padded)
+def _stft_blocks(blocks, n_fft, hop_length):
+    pad = np.zeros(n_fft // 2, dtype=np.float32)
+    buffer = pad
+    for block in blocks:
+        buffer = np.concatenate([buffer, np.asarray(block, dtype=np.float32)])
+        if len(buffer) >= n_fft:
+            S = np.abs(librosa.stft(buffer, n_fft=n_fft, hop_length=hop_length, center=False))
+            buffer = buffer[S.shape[1] * hop_length:]
+            yield S
+    buffer = np.concatenate([buffer, pad])
+    if len(buffer) >= n_fft:
+        yield np.abs(librosa.stft(buffer, n_fft=n_fft, hop_length=hop_length, center=False))
+
+
+# Combine two (count, mean, M2) running moments (Chan et al. parallel variance)
+def _merge_moments(a, b):
+    count = a[0] + b[0]
+    if count == 0:
+        return a
+    delta = b[1] - a[1]
+    mean = a[1] + delta * b[0] / count
+    return count, mean, a[2] + b[2] + delta * delta * a[0] * b[0] / count
+
+
+# Running dB spectrogram statistics: the same numbers as spectral_statistics over all the blocks added
+class _SpectralMoments:
+    def __init__(self, sr, n_fft):
+        self.bands = _band_masks(sr, n_fft)
+        self.moments = (0, 0.0, 0.0)
+        self.band_sums = dict.fromkeys(self.bands, 0.0)
+        self.band_std_sums = dict.fromkeys(self.bands, 0.0)
+        self.n_frames = 0
+
+    def add(self, S_dB):
+        block_mean = S_dB.mean(dtype=np.float64)
+        block_m2 = float(np.square(S_dB - block_mean, dtype=np.float64).sum())
+        self.moments = _merge_moments(self.moments, (S_dB.size, block_mean, block_m2))
+        for name, band in self.bands.items():
+            band_dB = S_dB[band, :]
+            self.band_sums[name] += float(band_dB.sum(dtype=np.float64))
+            self.band_std_sums[name] += float(np.std(band_dB, axis=0).sum(dtype=np.float64))
+        self.n_frames += S_dB.shape[1]
+
+    def statistics(self):
+        if self.n_frames == 0:
+            raise ValueError("The audio is too short to analyze")
+        count, mean, m2 = self.moments
+        stats = {"spectral_mean": float(mean), "spectral_std": float(np.sqrt(m2 / count))}
+        for name, band in self.bands.items():
+            stats[f"{name}_freq_mean"] = self.band_sums[name] / (int(band.sum()) * self.n_frames)
+            stats[f"{name}_freq_std"] = self.band_std_sums[name] / self.n_frames
+        return stats
+
+
+# Onset strength envelope built from consecutive dB spectrogram blocks, the same as
+# librosa.onset.onset_strength(S=S_dB, aggregate=aggregate) over the whole spectrogram
+class _OnsetStrength:
+    def __init__(self, hop_length, aggregate):
+        self.hop_length = hop_length
+        self.aggregate = aggregate
+        self._last = None  # last column of the previous block, the first difference of a block needs it
+        self._blocks = []
+        self.n_frames = 0
+
+    def add(self, S_dB):
+        S = S_dB if self._last is None else np.concatenate([self._last, S_dB], axis=1)
+        if S.shape[1] > 1:
+            self._blocks.append(self.aggregate(np.maximum(0.0, S[:, 1:] - S[:, :-1]), axis=0))
+        self._last = S_dB[:, -1:]
+        self.n_frames += S_dB.shape[1]
+
+    def envelope(self):
+        # librosa shifts by the lag plus half a frame of its default n_fft, also when given a spectrogram
+        pad = np.zeros(1 + N_FFT // (2 * self.hop_length), dtype=np.float32)
+        return np.concatenate([pad] + self._blocks)[:self.n_frames]
+
+
+# Spectral statistics and optionally the onset strength envelope of a signal streamed block by block,
+# only ever holding one block of the spectrogram. `open_blocks` is called twice and must return a fresh
+# iterator of signal blocks each time (e.g. lambda: file_blocks(path)): the first pass finds the
+# reference maxima the dB scales are relative to, the second pass accumulates.
+#
+# onset='mel' gives the envelope librosa.beat.beat_track(y=y) tracks the tempo on (median over a mel
+# spectrogram of the same STFT), onset='stft' the mean over the dB spectrogram like the "fast" profile.
+# consume(block, n_samples) is called with every signal block of the second pass.
+# Returns (statistics, onset envelope or None, number of samples).
+def stream_analysis(open_blocks, sr=SAMPLE_RATE, n_fft=N_FFT, hop_length=HOP_LENGTH, top_db=TOP_DB,
+                    onset=None, consume=None):
+    mel_basis = librosa.filters.mel(sr=sr, n_fft=n_fft) if onset == 'mel' else None
+    n_samples, ref, mel_ref = 0, 0.0, 0.0
+
+    def counted(blocks):
+        nonlocal n_samples
+        for block in blocks:
+            n_samples += len(block)
+            yield block
+
+    for S in _stft_blocks(counted(open_blocks()), n_fft, hop_length):
+        ref = max(ref, float(S.max()))
+        if mel_basis is not None:
+            mel_ref = max(mel_ref, float((mel_basis @ np.square(S)).max()))
+    floor = librosa.amplitude_to_db(np.array([ref], dtype=np.float32), ref=ref, top_db=None)[0] - top_db
+    mel_floor = librosa.power_to_db(np.array([mel_ref], dtype=np.float32), top_db=None)[0] - top_db
+
+    def consumed(blocks):
+        for block in blocks:
+            consume(block, n_samples)
+            yield block
+
+    blocks = open_blocks() if consume is None else consumed(open_blocks())
+    moments = _SpectralMoments(sr, n_fft)
+    onsets = _OnsetStrength(hop_length, np.median if onset == 'mel' else np.mean) if onset else None
+    for S in _stft_blocks(blocks, n_fft, hop_length):
+        S_dB = np.maximum(librosa.amplitude_to_db(S, ref=ref, top_db=None), floor)
+        moments.add(S_dB)
+        if onset == 'mel':
+            onsets.add(np.maximum(librosa.power_to_db(mel_basis @ np.square(S), top_db=None), mel_floor))
+        elif onset == 'stft':
+            onsets.add(S_dB)
+    return moments.statistics(), onsets.envelope() if onsets else None, n_samples
+
+
+# librosa.feature.tempo(onset_envelope=...) with the tempogram averaged over chunks of onset frames
+# instead of built whole, which takes 384 floats per frame (over 1GB for a 30 minute track)
+def stream_tempo(onset_envelope, sr=SAMPLE_RATE, hop_length=HOP_LENGTH, ac_size=8.0, chunk_frames=4096):
+    win_length = librosa.time_to_frames(ac_size, sr=sr, hop_length=hop_length).item()
+    n_frames = len(onset_envelope)
+    padded = np.pad(onset_envelope, win_length // 2, mode="linear_ramp", end_values=0)
+    window = librosa.filters.get_window("hann", win_length, fftbins=True)[:, None]
+    tempogram_sum = np.zeros(win_length)
+    for start in range(0, n_frames, chunk_frames):
+        stop = min(start + chunk_frames, n_frames)
+        frames = librosa.util.frame(padded[start:stop + win_length - 1], frame_length=win_length, hop_length=1)
+        tempogram = librosa.util.normalize(librosa.autocorrelate(frames * window, axis=0), norm=np.inf, axis=0)
+        tempogram_sum += tempogram.sum(axis=1)
+    return librosa.feature.tempo(tg=(tempogram_sum / n_frames)[:, None], sr=sr, hop_length=hop_length,
+                                 aggregate=None)
+
+
+# Same numbers as spectral_statistics(amplitude_to_db(|stft(y)|, ref=np.max)) without holding the
+# spectrogram, see stream_analysis
+def stream_spectral_statistics(open_blocks, sr=SAMPLE_RATE, n_fft=N_FFT, hop_length=HOP_LENGTH,
+                               top_db=TOP_DB):
+    return stream_analysis(open_blocks, sr, n_fft, hop_length, top_db)[0]
@@ -0,0 +1,176 @@
+# Headless batch canopy coverage for whole timelapse folders
+#
+# Usage:
+#   python -m core.batch images/ -o canopy.csv
+#   python -m core.batch "timelapse/**/*.jpg" -o canopy.parquet --workers 8
+import argparse
+import csv
+import glob
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+import cv2
+from PIL import Image
+
+from core.canopy import LOWER_GREEN, UPPER_GREEN, SCALING_FACTOR, TILE_PIXELS, DRAFT_SCALES, \
+    count_green_pixels_in_file, parse_day
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".tif", ".tiff", ".npy")
+
+# Same column names as the results table on the Estimate Canopy Coverage page and data/day_full_df.csv
+COLUMNS = ["Image Name", "Day", "Canopy Coverage (cm²)"]
+
+
+# Expand directories and glob patterns into a sorted list of image paths
+def collect_images(sources):
+    paths = []
+    for source in sources:
+        if os.path.isdir(source):
+            for root, _, files in os.walk(source):
+                paths.extend(os.path.join(root, name) for name in files
+                             if name.lower().endswith(IMAGE_EXTENSIONS))
+        else:
+            paths.extend(path for path in glob.glob(source, recursive=True)
+                         if path.lower().endswith(IMAGE_EXTENSIONS))
+    return sorted(set(paths))
+
+
+def _init_worker(max_image_pixels=Image.MAX_IMAGE_PIXELS):
+    # One OpenCV thread per process, the pool already provides the parallelism
+    cv2.setNumThreads(1)
+    Image.MAX_IMAGE_PIXELS = max_image_pixels
+
+
+# Threshold one image tile by tile and return its result row (or the error message) - runs inside the pool
+def measure_image(path, lower=LOWER_GREEN, upper=UPPER_GREEN, scaling_factor=SCALING_FACTOR,
+                  tile_pixels=TILE_PIXELS, draft_scale=1):
+    name = os.path.basename(path)
+    try:
+        pixel_area = count_green_pixels_in_file(path, lower, upper, tile_pixels, draft_scale)
+    except (OSError, ValueError) as e:
+        return name, None, str(e)
+    return name, pixel_area / scaling_factor, None
+
+
+def _measure(task):
+    index, args = task
+    return (index,) + measure_image(*args)
+
+
+# Fan the images out over a process pool and yield (index in paths, image name, area in cm², error)
+# as they finish, so one slow image doesn't hold back the others
+def iter_canopy_areas(paths, workers=None, lower=LOWER_GREEN, upper=UPPER_GREEN,
+                      scaling_factor=SCALING_FACTOR, tile_pixels=TILE_PIXELS, chunksize=4, draft_scale=1):
+    tasks = [(index, (path, lower, upper, scaling_factor, tile_pixels, draft_scale))
+             for index, path in enumerate(paths)]
+    if workers == 1:
+        for task in tasks:
+            yield _measure(task)
+        return
+    with Pool(processes=workers, initializer=_init_worker, initargs=(Image.MAX_IMAGE_PIXELS,)) as pool:
+        yield from pool.imap_unordered(_measure, tasks, chunksize=chunksize)
+
+
+class _CsvSink:
+    def __init__(self, path):
+        self._file = open(path, "w", newline="", encoding="utf-8") if path != "-" else sys.stdout
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(COLUMNS)
+
+    def write(self, row):
+        self._writer.writerow(["" if value is None else value for value in row])
+
+    def close(self):
+        if self._file is not sys.stdout:
+            self._file.close()
+
+
+class _ParquetSink:
+    def __init__(self, path, row_group_size=1024):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("Writing Parquet needs pyarrow, install it with `pip install pyarrow`")
+        self._pa = pa
+        self._schema = pa.schema([(COLUMNS[0], pa.string()), (COLUMNS[1], pa.int64()),
+                                  (COLUMNS[2], pa.float64())])
+        self._writer = pq.ParquetWriter(path, self._schema)
+        self._rows = []
+        self._row_group_size = row_group_size
+
+    def write(self, row):
+        self._rows.append(row)
+        if len(self._rows) >= self._row_group_size:
+            self._flush()
+
+    def _flush(self):
+        if self._rows:
+            columns = [list(column) for column in zip(*self._rows)]
+            self._writer.write_table(self._pa.table(columns, schema=self._schema))
+            self._rows = []
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+
+
+# Process all images and stream the rows into a CSV or Parquet file in the order the images finish,
+# returns (written, failed)
+def run_batch(paths, output, workers=None, lower=LOWER_GREEN, upper=UPPER_GREEN,
+              scaling_factor=SCALING_FACTOR, tile_pixels=TILE_PIXELS, draft_scale=1):
+    sink = _ParquetSink(output) if output.endswith(".parquet") else _CsvSink(output)
+    written = failed = 0
+    try:
+        for _, name, area, error in iter_canopy_areas(paths, workers, lower, upper, scaling_factor, tile_pixels,
+                                                   draft_scale=draft_scale):
+            if error is not None:
+                failed += 1
+                print(f"Skipping {name}: {error}", file=sys.stderr)
+                continue
+            sink.write((name, parse_day(name), area))
+            written += 1
+    finally:
+        sink.close()
+    return written, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Estimate canopy coverage for a folder of plant images.")
+    parser.add_argument("sources", nargs="+", help="image directories, files or glob patterns")
+    parser.add_argument("-o", "--output", default="-",
+                        help="output .csv or .parquet file (default: CSV on stdout)")
+    parser.add_argument("-w", "--workers", type=int, default=None,
+                        help="number of worker processes (default: one per CPU)")
+    parser.add_argument("--lower", type=int, nargs=3, default=LOWER_GREEN, metavar=("H", "S", "V"),
+                        help="lower HSV bound of the green range")
+    parser.add_argument("--upper", type=int, nargs=3, default=UPPER_GREEN, metavar=("H", "S", "V"),
+                        help="upper HSV bound of the green range")
+    parser.add_argument("--scaling-factor", type=float, default=SCALING_FACTOR,
+                        help="pixels per cm² obtained from calibration")
+    parser.add_argument("--tile-pixels", type=int, default=TILE_PIXELS,
+                        help="pixels thresholded at a time, bounds the memory used per worker")
+    parser.add_argument("--draft-scale", type=int, choices=DRAFT_SCALES, default=1,
+                        help="decode JPEGs at 1/N size, areas are scaled back (see benchmarks/draft.py for the error)")
+    args = parser.parse_args(argv)
+
+    # Local timelapse folders and drone mosaics are trusted input, lift PIL's decompression bomb limit
+    Image.MAX_IMAGE_PIXELS = None
+
+    paths = collect_images(args.sources)
+    if not paths:
+        parser.error("no images found")
+
+    start = time.perf_counter()
+    written, failed = run_batch(paths, args.output, args.workers, tuple(args.lower), tuple(args.upper),
+                                args.scaling_factor, args.tile_pixels, args.draft_scale)
+    elapsed = time.perf_counter() - start
+    print(f"Processed {written} images ({failed} failed) in {elapsed:.1f}s "
+          f"({written / elapsed:.1f} images/s)", file=sys.stderr)
+    return 1 if failed and not written else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
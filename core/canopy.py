@@ -0,0 +1,313 @@
+# Canopy coverage estimation: HSV thresholding, pixel counting and result caching.
+# OpenCV and numba are imported on first use, so pages whose images all hit the mask cache never load them.
+import hashlib
+import itertools
+import os
+import re
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from core.metrics import stage
+
+# Define the range for green color in HSV
+LOWER_GREEN = (35, 50, 50)
+UPPER_GREEN = (85, 255, 255)
+
+SCALING_FACTOR = 4096  # obtained from calibration
+
+DAY_PATTERN = re.compile(r"day[_\- ]?(\d+)", re.IGNORECASE)
+
+
+# Read the day number out of names such as Day20.jpg, or None when there is none
+def parse_day(image_name):
+    match = DAY_PATTERN.search(image_name)
+    return int(match.group(1)) if match else None
+
+
+# Create the green mask for an RGB image array
+def compute_mask(image_array, lower=LOWER_GREEN, upper=UPPER_GREEN):
+    import cv2
+    hsv_image = cv2.cvtColor(image_array, cv2.COLOR_RGB2HSV)
+    return cv2.inRange(hsv_image, np.array(lower), np.array(upper))
+
+
+# Function to calculate Canopy Coverage in pixels
+def get_area_in_pixels(mask):
+    # Calculate the Canopy Coverage pixels directly from the mask
+    return int(np.count_nonzero(mask == 255))
+
+
+# Pixels thresholded at a time by the tiled pipeline (~6MB of RGB), bounds the transient memory
+TILE_PIXELS = 2 * 1024 * 1024
+
+
+# Rows per strip so that a strip holds about TILE_PIXELS pixels
+def strip_rows(width, tile_pixels=TILE_PIXELS):
+    return max(1, tile_pixels // max(1, width))
+
+
+def _is_rgb8(array):
+    return array.ndim == 3 and array.shape[2] in (3, 4) and array.dtype == np.uint8
+
+
+# Memory-map an uncompressed RGB TIFF, or None when tifffile isn't installed or the data can't be mapped
+def _tiff_memmap(path):
+    try:
+        import tifffile
+        array = tifffile.memmap(path, mode='r')
+    except (ImportError, ValueError):
+        return None
+    return array[..., :3] if _is_rgb8(array) else None
+
+
+# JPEG decode scales supported by PIL's draft mode (DCT scaling), 1 is a full resolution decode
+DRAFT_SCALES = (1, 2, 4, 8)
+
+
+# Decode an image (path or file object) to an (H, W, 3) uint8 array. With draft_scale > 1, JPEGs are
+# decoded directly at 1/draft_scale of their size (other formats are decoded at full size). Returns
+# the array and the number of full resolution pixels per decoded pixel, to scale areas back.
+def decode_rgb(source, draft_scale=1):
+    with Image.open(source) as image:
+        width, height = image.size
+        if draft_scale > 1:
+            image.draft('RGB', (-(-width // draft_scale), -(-height // draft_scale)))
+        image_array = np.asarray(image if image.mode == 'RGB' else image.convert('RGB'))
+    return image_array, width * height / (image_array.shape[0] * image_array.shape[1])
+
+
+# Open an image as an (H, W, 3) uint8 array. Raw .npy arrays and uncompressed TIFFs (through the
+# optional tifffile package) are memory-mapped so only the strips being processed are paged in,
+# other formats are decoded into memory.
+def open_rgb_array(path):
+    name = str(path).lower()
+    if name.endswith('.npy'):
+        array = np.load(path, mmap_mode='r')
+        if not _is_rgb8(array):
+            raise ValueError(f"{path} is not an (H, W, 3) uint8 RGB array")
+        return array[..., :3]
+    if name.endswith(('.tif', '.tiff')):
+        array = _tiff_memmap(path)
+        if array is not None:
+            return array
+    with Image.open(path) as image:
+        return np.asarray(image if image.mode == 'RGB' else image.convert('RGB'))
+
+
+# Decoded strips/tiles of a compressed RGB TIFF, one at a time, or None when tifffile isn't
+# installed or can't decode this file segment by segment
+def _tiff_segments(path, buffersize):
+    try:
+        import tifffile
+    except ImportError:
+        return None
+    tiff = tifffile.TiffFile(path)
+    page = tiff.pages[0]
+    if page.dtype != np.uint8 or len(page.shape) != 3 or page.shape[2] not in (3, 4) \
+            or page.photometric != tifffile.PHOTOMETRIC.RGB or page.planarconfig != tifffile.PLANARCONFIG.CONTIG:
+        tiff.close()
+        return None
+    segments = page.segments(buffersize=buffersize)
+    try:
+        first = next(segments)
+    except ValueError:  # e.g. a codec that needs the imagecodecs package
+        tiff.close()
+        return None
+
+    def tiles():
+        height, width = page.shape[:2]
+        with tiff:
+            for segment, index, _ in itertools.chain([first], segments):
+                if segment is None:
+                    continue
+                top, left = index[2], index[3]
+                # Edge tiles are padded up to the full tile size
+                yield segment[0, :height - top, :width - left, :3]
+    return tiles()
+
+
+# Yield RGB tiles covering a whole image file while holding at most one tile (plus the memory map)
+# at a time where the format allows it: .npy and uncompressed TIFFs are memory-mapped, compressed
+# TIFFs are decoded strip by strip (with tifffile). JPEG, PNG and any other format are fully decoded
+# first and then split into strips, so their decoded RGB frame is in memory whatever tile_pixels is;
+# only the per-strip HSV work is bounded.
+def iter_image_tiles(path, tile_pixels=TILE_PIXELS):
+    if str(path).lower().endswith(('.tif', '.tiff')) and _tiff_memmap(path) is None:
+        segments = _tiff_segments(path, buffersize=tile_pixels * 3)
+        if segments is not None:
+            yield from segments
+            return
+    image_array = open_rgb_array(path)
+    rows = strip_rows(image_array.shape[1], tile_pixels)
+    for top in range(0, image_array.shape[0], rows):
+        yield image_array[top:top + rows]
+
+
+# "fused" counts with the single-pass numba kernel of core/hsv.py (identical results), "opencv" with
+# cv2.cvtColor + cv2.inRange. The fused kernel needs no HSV copy or mask, the OpenCV path is tiled.
+HSV_KERNEL = os.environ.get("PLANTAMUSICA_HSV_KERNEL", "fused")
+
+
+# The fused kernel's count function, or None when it is disabled or numba isn't installed
+def _fused_kernel():
+    if HSV_KERNEL != "fused":
+        return None
+    try:
+        from core.hsv import count_in_range
+    except ImportError:
+        return None
+    return count_in_range
+
+
+def _count_tile(tile, lower, upper):
+    import cv2
+    tile_mask = cv2.inRange(cv2.cvtColor(np.ascontiguousarray(tile), cv2.COLOR_RGB2HSV), lower, upper)
+    return cv2.countNonZero(tile_mask), tile_mask
+
+
+# Count green pixels strip by strip (strips of about tile_pixels pixels), with the fused kernel or with
+# OpenCV, so a memory-mapped image is paged in one strip at a time and the OpenCV HSV copy and mask never
+# exist for the full frame. HSV thresholding is per pixel, so the count is identical to the full-frame
+# computation. Pass mask_out (an (H, W) uint8 array) to also collect the mask for display.
+def count_green_pixels_tiled(image_array, lower=LOWER_GREEN, upper=UPPER_GREEN, tile_pixels=TILE_PIXELS,
+                             mask_out=None):
+    fused = _fused_kernel()
+    if fused is None:
+        lower, upper = np.array(lower), np.array(upper)
+    rows = strip_rows(image_array.shape[1], tile_pixels)
+    pixel_count = 0
+    for top in range(0, image_array.shape[0], rows):
+        strip = image_array[top:top + rows]
+        if fused is not None:
+            pixel_count += fused(strip, lower, upper, None if mask_out is None else mask_out[top:top + rows])
+            continue
+        strip_count, strip_mask = _count_tile(strip, lower, upper)
+        pixel_count += strip_count
+        if mask_out is not None:
+            mask_out[top:top + rows] = strip_mask
+    return pixel_count
+
+
+# Green pixel count of an image file with memory bounded by the tile size (see iter_image_tiles).
+# With draft_scale > 1 JPEGs are decoded at reduced size and the count is scaled to full resolution.
+def count_green_pixels_in_file(path, lower=LOWER_GREEN, upper=UPPER_GREEN, tile_pixels=TILE_PIXELS,
+                               draft_scale=1):
+    if draft_scale > 1 and not str(path).lower().endswith(('.npy', '.tif', '.tiff')):
+        image_array, area_ratio = decode_rgb(path, draft_scale)
+        return count_green_pixels_tiled(image_array, lower, upper, tile_pixels) * area_ratio
+    return sum(count_green_pixels_tiled(tile, lower, upper, tile_pixels) for tile in iter_image_tiles(path, tile_pixels))
+
+
+# Hash the raw (encoded) image bytes together with everything that changes the result
+def cache_key(image_bytes, lower=LOWER_GREEN, upper=UPPER_GREEN, scaling_factor=SCALING_FACTOR, draft_scale=1):
+    digest = hashlib.sha256(image_bytes)
+    params = (tuple(lower), tuple(upper), scaling_factor)
+    # Full resolution keys are unchanged, so existing on-disk caches stay valid
+    digest.update(repr(params if draft_scale == 1 else params + (draft_scale,)).encode())
+    return digest.hexdigest()
+
+
+# LRU cache of computed masks and pixel counts, optionally backed by a directory on disk.
+# Masks are stored bit-packed, so a 4032x1816 mask costs ~0.9MB instead of ~7MB.
+# Only the in-memory tier is evicted: a read_only cache uses the masks already on disk (e.g. filled by
+# `python -m core.warmup`) without adding to them, so a long-running server doesn't fill the disk.
+class MaskCache:
+    def __init__(self, max_bytes=256 * 1024 * 1024, cache_dir=None, read_only=False):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.read_only = read_only
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        if cache_dir and not read_only:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries or os.path.exists(self._disk_path(key) or "")
+
+    def _disk_path(self, key):
+        if not self.cache_dir:
+            return None
+        return os.path.join(self.cache_dir, key + ".npz")
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None:
+            entry = self._load(key)
+            if entry is None:
+                return None
+            self._remember(key, entry)
+        packed, shape, pixel_count = entry
+        mask = np.unpackbits(packed, count=shape[0] * shape[1]).reshape(shape) * np.uint8(255)
+        return mask, pixel_count
+
+    def put(self, key, mask, pixel_count):
+        entry = (np.packbits(mask.ravel() == 255), mask.shape, int(pixel_count))
+        self._remember(key, entry)
+        path = self._disk_path(key)
+        if path and not self.read_only:
+            tmp_path = path + ".tmp.npz"
+            np.savez_compressed(tmp_path, packed=entry[0], shape=np.array(entry[1]),
+                                pixel_count=np.array(entry[2]))
+            os.replace(tmp_path, path)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _remember(self, key, entry):
+        with self._lock:
+            if key in self._entries:
+                self._size -= self._entries.pop(key)[0].nbytes
+            self._entries[key] = entry
+            self._size += entry[0].nbytes
+            # Evict the least recently used masks until we fit in the budget again
+            while self._size > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= evicted[0].nbytes
+
+    def _load(self, key):
+        path = self._disk_path(key)
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                return data["packed"], tuple(int(n) for n in data["shape"]), int(data["pixel_count"])
+        except (OSError, ValueError, KeyError):
+            # A truncated or foreign file in the cache directory is treated as a miss
+            return None
+
+
+# Compute (or fetch from the cache) the mask, pixel count and area for encoded image bytes.
+# With draft_scale > 1 JPEGs are decoded at reduced size: the mask and pixel count are at that size
+# and the area is scaled back to the full resolution calibration.
+def analyze_image_bytes(image_bytes, cache=None, lower=LOWER_GREEN, upper=UPPER_GREEN,
+                        scaling_factor=SCALING_FACTOR, draft_scale=1):
+    key = cache_key(image_bytes, lower, upper, scaling_factor, draft_scale)
+    cached = cache.get(key) if cache is not None else None
+    if cached is not None:
+        mask, pixel_area = cached
+        area_ratio = 1.0
+        if draft_scale > 1:
+            with Image.open(BytesIO(image_bytes)) as image:  # only reads the header
+                area_ratio = image.width * image.height / mask.size
+    else:
+        with stage('decode'):
+            image_array, area_ratio = decode_rgb(BytesIO(image_bytes), draft_scale)
+        with stage('hsv_threshold'):
+            mask = np.empty(image_array.shape[:2], dtype=np.uint8)
+            pixel_area = count_green_pixels_tiled(image_array, lower, upper, mask_out=mask)
+        if cache is not None:
+            cache.put(key, mask, pixel_area)
+    return mask, pixel_area, pixel_area * area_ratio / scaling_factor
@@ -0,0 +1,220 @@
+# Lagged cross-correlation of per-day music exposure against growth and environment data.
+# The tables are aligned on a regular day grid, then the correlation of every (X column, Y column, lag)
+# triple is computed over the days where both values are present (pairwise complete), for all pairs and
+# lags at once with a few masked matrix products instead of one pandas call per pair and lag.
+#
+# Usage:
+#   python -m core.correlation data/music_for_plants_df.csv data/day_full_df.csv --max-lag 6 -o correlations.csv
+#   python -m core.correlation data/music_for_plants_df.csv --schedule schedule.csv --max-lag 6
+import argparse
+import os
+import sys
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from core.feature_files import FEATURES_DIR, SUMMARY_COLUMNS, iter_summaries
+from core.fitting import numeric_columns
+
+DAY_COLUMN = 'Day'
+MIN_SAMPLES = 5  # days with both values present below which a correlation isn't reported
+EXPOSURE_MINUTES = 'Music Exposure (min)'
+
+# Per-day exposure features: the scalar track features averaged over the day, weighted by minutes played
+EXPOSURE_COLUMNS = {
+    'tempo': 'Music Tempo (bpm)',
+    'spectral_mean': 'Music Spectral Mean (dB)',
+    'spectral_std': 'Music Spectral Std (dB)',
+    'low_freq_mean': 'Music Low Freq Mean (dB)',
+    'low_freq_std': 'Music Low Freq Std (dB)',
+    'mid_freq_mean': 'Music Mid Freq Mean (dB)',
+    'mid_freq_std': 'Music Mid Freq Std (dB)',
+    'high_freq_mean': 'Music High Freq Mean (dB)',
+    'high_freq_std': 'Music High Freq Std (dB)',
+}
+
+
+# Tracks are matched by file name without directory and extension, like the feature store files
+def track_key(track):
+    return os.path.splitext(os.path.basename(str(track)))[0]
+
+
+# Scalar features (SUMMARY_COLUMNS) of every track in the feature store, indexed by track key
+def stored_tracks(features_dir=FEATURES_DIR):
+    rows = {track: values for track, _, values in iter_summaries(features_dir)} if os.path.isdir(features_dir) else {}
+    return pd.DataFrame.from_dict(rows, orient='index', columns=SUMMARY_COLUMNS)
+
+
+# Scalar track features from a `python -m core.feature_store --summary` CSV, indexed by track key
+def read_track_summary(source):
+    tracks = pd.read_csv(source)
+    return tracks.set_index(tracks['track'].map(track_key))[SUMMARY_COLUMNS]
+
+
+# Per-day music exposure from a play schedule with Day and Track columns, and optionally Minutes
+# (each row is one full play of the track otherwise). Days without plays are absent.
+def exposure_table(schedule, tracks):
+    keys = schedule['Track'].map(track_key)
+    missing = sorted(set(keys) - set(tracks.index))
+    if missing:
+        raise ValueError(f"No stored features for {', '.join(missing)}, build them with `python -m core.feature_store`")
+    features = tracks.loc[keys]
+    if 'Minutes' in schedule:
+        minutes = pd.to_numeric(schedule['Minutes'], errors='coerce').fillna(0).to_numpy()
+    else:
+        minutes = features['duration'].to_numpy() / 60
+    days = schedule[DAY_COLUMN].to_numpy()
+
+    weighted = pd.DataFrame(features[list(EXPOSURE_COLUMNS)].to_numpy() * minutes[:, None],
+                            columns=list(EXPOSURE_COLUMNS.values()))
+    weighted.insert(0, EXPOSURE_MINUTES, minutes)
+    totals = weighted.groupby(days).sum()
+    exposure = totals.iloc[:, 1:].div(totals[EXPOSURE_MINUTES].where(totals[EXPOSURE_MINUTES] > 0), axis=0)
+    exposure.insert(0, EXPOSURE_MINUTES, totals[EXPOSURE_MINUTES])
+    exposure.index.name = DAY_COLUMN
+    return exposure.reset_index()
+
+
+# Regular grid covering the days, with the largest step that hits every one of them
+def day_grid(days):
+    days = np.unique(np.asarray(days, dtype=np.float64).round().astype(np.int64))
+    if len(days) < 2:
+        return days
+    step = int(np.gcd.reduce(np.diff(days)))
+    return np.arange(days[0], days[-1] + step, step)
+
+
+# Join the numeric columns of several tables ({source name: frame}, each with a Day column) into one
+# frame indexed by the day grid. Days missing from a table are NaN, repeated days are averaged, and
+# column names present in more than one table get the source name appended.
+def align_days(tables):
+    per_day = {}
+    for source, df in tables.items():
+        if DAY_COLUMN not in df:
+            raise ValueError(f"{source} has no {DAY_COLUMN} column")
+        numeric = numeric_columns(df)
+        numeric = numeric[numeric[DAY_COLUMN].notna()]
+        per_day[source] = numeric.groupby(numeric[DAY_COLUMN].round().astype(np.int64)).mean() \
+            .drop(columns=DAY_COLUMN)
+
+    counts = pd.Series([column for frame in per_day.values() for column in frame.columns]).value_counts()
+    frames = [frame.rename(columns={column: f"{column} ({source})" for column in frame.columns if counts[column] > 1})
+              for source, frame in per_day.items()]
+    joined = pd.concat(frames, axis=1) if frames else pd.DataFrame()
+    grid = day_grid(joined.index)
+    aligned = joined.reindex(grid)
+    aligned.index.name = DAY_COLUMN
+    return aligned
+
+
+# Pearson correlation of X[t] with Y[t + lag] for every column pair and lag, using the rows where both
+# values are finite. X is (T, p), Y is (T, q) on the same (regular) time grid, lags are in grid steps.
+# Returns r and the number of rows used, both (len(lags), p, q).
+def lagged_correlation(X, Y, lags):
+    X, Y = np.asarray(X, dtype=np.float64), np.asarray(Y, dtype=np.float64)
+    lags = np.atleast_1d(np.asarray(lags, dtype=np.int64))
+    # Centering on the column means changes no correlation but keeps the sums below from cancelling
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # all-NaN columns
+        X = X - np.nanmean(X, axis=0)
+        Y = Y - np.nanmean(Y, axis=0)
+
+    # Y shifted by every lag, (L, T, q), with NaN where t + lag falls outside the grid
+    rows = np.arange(len(Y))[None, :] + lags[:, None]
+    inside = (rows >= 0) & (rows < len(Y))
+    Y_lagged = np.where(inside[..., None], Y[np.clip(rows, 0, max(len(Y) - 1, 0))], np.nan)
+
+    x_present, y_present = np.isfinite(X), np.isfinite(Y_lagged)
+    X0, Y0 = np.where(x_present, X, 0).T, np.where(y_present, Y_lagged, 0)
+    x_mask, y_mask = x_present.T.astype(np.float64), y_present.astype(np.float64)
+
+    # Sums over the pairwise complete rows, each a (p, T) @ (L, T, q) product
+    n = x_mask @ y_mask
+    sum_x, sum_y = X0 @ y_mask, x_mask @ Y0
+    sum_xx, sum_yy = np.square(X0) @ y_mask, x_mask @ np.square(Y0)
+    sum_xy = X0 @ Y0
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        covariance = sum_xy - sum_x * sum_y / n
+        variance_x = sum_xx - np.square(sum_x) / n
+        variance_y = sum_yy - np.square(sum_y) / n
+        r = covariance / np.sqrt(variance_x * variance_y)
+    # Constant within the overlapping rows (up to rounding) has no defined correlation
+    degenerate = (variance_x <= 1e-12 * sum_xx) | (variance_y <= 1e-12 * sum_yy) | (n < 2)
+    r[degenerate] = np.nan
+    return np.clip(r, -1.0, 1.0), n.astype(np.int64)
+
+
+# Two-sided p-value of a Pearson r from n samples (t-test with n - 2 degrees of freedom)
+def correlation_p_value(r, n):
+    from scipy.special import stdtr
+    r, df = np.asarray(r, dtype=np.float64), np.asarray(n, dtype=np.float64) - 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.abs(r) * np.sqrt(df / (1 - np.square(r)))
+        return np.where(df > 0, 2 * stdtr(np.maximum(df, 1), -t), np.nan)
+
+
+# Sortable table of the lagged correlations of every (X column, Y column) pair of an aligned frame
+# (see align_days), strongest first. Lag is in days: X on day d against Y on day d + lag.
+def correlation_table(aligned, x_columns=None, y_columns=None, lags=(0,), min_samples=MIN_SAMPLES):
+    x_columns = list(aligned.columns if x_columns is None else x_columns)
+    y_columns = list(aligned.columns if y_columns is None else y_columns)
+    step = int(np.diff(aligned.index[:2])[0]) if len(aligned) > 1 else 1
+    lag_steps = sorted({int(lag) // step for lag in lags if int(lag) % step == 0})
+    r, n = lagged_correlation(aligned[x_columns].to_numpy(), aligned[y_columns].to_numpy(), lag_steps)
+
+    lag_index, x_index, y_index = np.indices(r.shape).reshape(3, -1)
+    lag_days = np.array(lag_steps, dtype=np.int64)[lag_index] * step
+    x_names, y_names = np.array(x_columns, dtype=object)[x_index], np.array(y_columns, dtype=object)[y_index]
+    keep = np.isfinite(r.ravel()) & (n.ravel() >= min_samples)
+    if x_columns == y_columns:
+        # (A, B, lag) is (B, A, -lag): every pair once, and autocorrelations at positive lags
+        keep &= (x_index < y_index) | ((x_index == y_index) & (lag_days > 0))
+    else:
+        keep &= (x_names != y_names) | (lag_days != 0)
+
+    table = pd.DataFrame({
+        'X': x_names[keep],
+        'Y': y_names[keep],
+        'Lag (days)': lag_days[keep],
+        'r': r.ravel()[keep],
+        'Samples': n.ravel()[keep],
+        'p-value': correlation_p_value(r.ravel()[keep], n.ravel()[keep]),
+    })
+    return table.iloc[np.argsort(-table['r'].abs().to_numpy(), kind='stable')].reset_index(drop=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Lagged correlations between music exposure, growth and environment data.")
+    parser.add_argument("tables", nargs="+", help="CSV files with a Day column (growth, sensors, ...)")
+    parser.add_argument("--schedule", help="play schedule CSV with Day, Track and optionally Minutes columns")
+    parser.add_argument("--features", default=FEATURES_DIR,
+                        help="feature store with the scheduled tracks (default: data/music_features)")
+    parser.add_argument("--track-summary", help="use a `core.feature_store --summary` CSV instead of the feature store")
+    parser.add_argument("--max-lag", type=int, default=0, help="largest lag in days, both directions")
+    parser.add_argument("--min-samples", type=int, default=MIN_SAMPLES, help="fewest overlapping days to report")
+    parser.add_argument("-o", "--output", default="-", help="output CSV file (default: stdout)")
+    args = parser.parse_args(argv)
+
+    tables = {os.path.splitext(os.path.basename(path))[0]: pd.read_csv(path) for path in args.tables}
+    x_columns = y_columns = None
+    if args.schedule:
+        tracks = read_track_summary(args.track_summary) if args.track_summary else stored_tracks(args.features)
+        try:
+            exposure = exposure_table(pd.read_csv(args.schedule), tracks)
+        except ValueError as e:
+            parser.error(str(e))
+        tables = {'music exposure': exposure, **tables}
+        x_columns = [EXPOSURE_MINUTES] + list(EXPOSURE_COLUMNS.values())
+
+    aligned = align_days(tables)
+    if x_columns is not None:
+        y_columns = [column for column in aligned.columns if column not in x_columns]
+    table = correlation_table(aligned, x_columns, y_columns, range(-args.max_lag, args.max_lag + 1), args.min_samples)
+    table.to_csv(sys.stdout if args.output == "-" else args.output, index=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
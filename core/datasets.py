@@ -0,0 +1,114 @@
+# Dataset loading for the Data Analysis page: parse once into compact numeric dtypes, then keep the
+# frame, its CSV serialization and per-column statistics together so reruns reuse all of them.
+import hashlib
+import warnings
+from functools import cached_property
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+# Text columns are converted to numbers when at least this share of their values parses as one
+COERCE_MIN_FRACTION = 0.95
+# float64 columns become float32 when their values have at most this many decimals
+FLOAT32_MAX_DECIMALS = 6
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+# Convert mostly numeric text columns (e.g. a sensor log with the odd "n/a") to numbers
+def coerce_numeric(df, min_fraction=COERCE_MIN_FRACTION):
+    for column in df.columns[df.dtypes == object]:
+        values = df[column]
+        present = values.notna().sum()
+        numeric = pd.to_numeric(values, errors='coerce')
+        if present and numeric.notna().sum() >= min_fraction * present:
+            df[column] = numeric
+    return df
+
+
+# Number of decimals that float32 values must be rounded to to give back exactly the original
+# float64 values, or None when float32 would lose information
+def _float32_decimals(values):
+    finite = values[np.isfinite(values)]
+    if not len(finite):
+        return 0
+    if np.abs(finite).max() > np.finfo(np.float32).max:
+        return None
+    restored = finite.astype(np.float32).astype(np.float64)
+    for decimals in range(FLOAT32_MAX_DECIMALS + 1):
+        if np.array_equal(np.round(finite, decimals), finite):
+            return decimals if np.array_equal(np.round(restored, decimals), finite) else None
+    return None
+
+
+# Downcast integer columns to the smallest integer type and float columns to float32 where that is
+# lossless: values with few decimals (like sensor readings) are recovered exactly by rounding, see
+# Dataset.column. The decimals are recorded in df.attrs['decimals'].
+def compact_dtypes(df):
+    decimals = df.attrs.setdefault('decimals', {})
+    for column in df.columns:
+        dtype = df[column].dtype
+        if pd.api.types.is_integer_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype):
+            df[column] = pd.to_numeric(df[column], downcast='integer')
+        elif dtype == np.float64:
+            column_decimals = _float32_decimals(df[column].to_numpy())
+            if column_decimals is not None:
+                df[column] = df[column].astype(np.float32)
+                decimals[column] = column_decimals
+    return df
+
+
+# Parse CSV bytes (or a path) into a compact frame, optionally renaming the columns first
+def read_csv_compact(source, columns=None):
+    df = pd.read_csv(BytesIO(source) if isinstance(source, bytes) else source)
+    if columns is not None:
+        df.columns = columns
+    return compact_dtypes(coerce_numeric(df))
+
+
+# Count, missing values, min, max, mean and std of every numeric column, indexed by column name
+def column_stats(df):
+    numeric = df.select_dtypes('number')
+    values = numeric.to_numpy(dtype=np.float64)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # all-NaN columns
+        stats = pd.DataFrame({
+            'count': numeric.count().to_numpy(),
+            'missing': numeric.isna().sum().to_numpy(),
+            'min': np.nanmin(values, axis=0) if len(values) else np.nan,
+            'max': np.nanmax(values, axis=0) if len(values) else np.nan,
+            'mean': np.nanmean(values, axis=0) if len(values) else np.nan,
+            'std': np.nanstd(values, axis=0, ddof=1) if len(values) else np.nan,
+        }, index=numeric.columns)
+    return stats
+
+
+# A parsed table identified by a content key. Treat the frame as read-only, it is shared by every
+# rerun (and every session) that loads the same content.
+class Dataset:
+    def __init__(self, key, frame):
+        self.key = key
+        self.frame = frame
+
+    @cached_property
+    def csv_bytes(self):
+        return self.frame.to_csv(index=False).encode('utf-8')
+
+    @cached_property
+    def stats(self):
+        return column_stats(self.frame)
+
+    # A column as float64 with the values as parsed, undoing the float32 rounding of compact_dtypes
+    def column(self, name):
+        values = self.frame[name].to_numpy(dtype=np.float64)
+        decimals = self.frame.attrs.get('decimals', {}).get(name)
+        return np.round(values, decimals) if decimals is not None else values
+
+    # (min, max) of a column, from the precomputed statistics when it is numeric
+    def bounds(self, column):
+        if column in self.stats.index:
+            return self.stats.at[column, 'min'], self.stats.at[column, 'max']
+        return self.frame[column].min(), self.frame[column].max()
@@ -0,0 +1,47 @@
+# Stored audio features (see core.feature_store), one .npz file per track. Reading them needs numpy only,
+# so pages that use the stored features don't import the audio stack.
+import os
+
+import numpy as np
+
+FEATURES_DIR = os.path.join('data', 'music_features')
+FEATURES_VERSION = 1
+
+
+# Where the features of a track (given by file name) are stored
+def feature_path(track_name, features_dir=FEATURES_DIR):
+    return os.path.join(features_dir, os.path.splitext(os.path.basename(track_name))[0] + '.npz')
+
+
+def save_features(path, features, source_sha256=''):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    arrays = {key: np.asarray(value) for key, value in features.items() if value is not None}
+    arrays['spectrogram'] = arrays['spectrogram'].astype(np.float16)  # dB values, 0.01 dB is plenty
+    tmp_path = path + '.tmp.npz'
+    np.savez(tmp_path, version=FEATURES_VERSION, source_sha256=source_sha256, **arrays)
+    os.replace(tmp_path, path)
+
+
+# Load stored features, or None when the file is missing or from an older version
+def load_features(path):
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        if int(data['version']) != FEATURES_VERSION:
+            return None
+        features = {key: (data[key].item() if data[key].ndim == 0 else data[key]) for key in data.files}
+    features['spectrogram'] = features['spectrogram'].astype(np.float32)
+    features.setdefault('profile', 'full')  # written before analysis profiles existed
+    return features
+
+
+SUMMARY_COLUMNS = ['tempo', 'duration', 'spectral_mean', 'spectral_std', 'low_freq_mean', 'low_freq_std',
+                   'mid_freq_mean', 'mid_freq_std', 'high_freq_mean', 'high_freq_std']
+
+
+# (track, profile, scalar features in SUMMARY_COLUMNS order) of every stored track
+def iter_summaries(features_dir=FEATURES_DIR):
+    for name in sorted(os.listdir(features_dir)):
+        features = load_features(os.path.join(features_dir, name)) if name.endswith('.npz') else None
+        if features is not None:
+            yield os.path.splitext(name)[0], features['profile'], [features[column] for column in SUMMARY_COLUMNS]
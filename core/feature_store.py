@@ -0,0 +1,196 @@
+# Precomputed audio features for the bundled tracks, stored as one .npz file per track
+#
+# Usage:
+#   python -m core.feature_store data/music_file -o data/music_features
+#   python -m core.feature_store ~/music -o library_features --profile fast --summary library.csv
+import argparse
+import csv
+import hashlib
+import os
+import sys
+
+import librosa
+import numpy as np
+
+from core.audio import DEFAULT_PROFILE, PROFILES, array_blocks, spectral_statistics, stream_analysis, stream_tempo
+from core.feature_files import FEATURES_DIR, SUMMARY_COLUMNS, feature_path, iter_summaries, load_features, \
+    save_features
+from core.metrics import stage
+
+SPECTROGRAM_FRAMES = 1024  # time columns kept in the stored spectrogram
+ENVELOPE_POINTS = 2048  # min/max pairs kept for the waveform plot
+
+
+# Average consecutive spectrogram columns so at most max_frames remain
+def pool_frames(S, max_frames):
+    n_frames = S.shape[1]
+    if max_frames is None or n_frames <= max_frames:
+        return S, np.arange(n_frames)
+    starts = np.linspace(0, n_frames, max_frames, endpoint=False).astype(int)
+    counts = np.diff(np.append(starts, n_frames))
+    pooled = np.add.reduceat(S, starts, axis=1, dtype=np.float64) / counts
+    return pooled.astype(S.dtype), starts + (counts - 1) / 2
+
+
+# Min/max envelope of a waveform, one pair per bucket of samples
+def waveform_envelope(y, points=ENVELOPE_POINTS):
+    points = max(1, min(points, len(y)))
+    starts = np.linspace(0, len(y), points, endpoint=False).astype(int)
+    return np.minimum.reduceat(y, starts), np.maximum.reduceat(y, starts), starts
+
+
+# waveform_envelope of a signal of n_samples samples, accumulated from its consecutive blocks
+class _StreamedEnvelope:
+    def __init__(self, n_samples, points=ENVELOPE_POINTS):
+        points = max(1, min(points, n_samples))
+        self.starts = np.linspace(0, n_samples, points, endpoint=False).astype(int)
+        self.minimum = np.full(points, np.inf, dtype=np.float32)
+        self.maximum = np.full(points, -np.inf, dtype=np.float32)
+        self._offset = 0
+
+    def add(self, block):
+        if not len(block):
+            return
+        end = self._offset + len(block)
+        # Buckets overlapping the block, the first one may have started in an earlier block
+        first = np.searchsorted(self.starts, self._offset, side='right') - 1
+        last = np.searchsorted(self.starts, end, side='left')
+        bounds = np.maximum(self.starts[first:last] - self._offset, 0)
+        np.minimum(self.minimum[first:last], np.minimum.reduceat(block, bounds), out=self.minimum[first:last])
+        np.maximum(self.maximum[first:last], np.maximum.reduceat(block, bounds), out=self.maximum[first:last])
+        self._offset = end
+
+
+# The features of extract_features(streaming=True) from a signal read block by block at the sample
+# rate of the profile: `open_blocks` is called twice and must return a fresh iterator of blocks each
+# time (e.g. lambda: file_blocks(path, sr)), so neither the signal nor its spectrogram is ever held
+# in memory. The tempo comes from an onset envelope built from the same STFT blocks (see stream_tempo).
+def stream_features(open_blocks, sr, profile=DEFAULT_PROFILE):
+    params = PROFILES[profile]
+    hop_length = params['hop_length']
+    envelope = None
+
+    def consume(block, n_samples):
+        nonlocal envelope
+        if envelope is None:
+            envelope = _StreamedEnvelope(n_samples)
+        envelope.add(block)
+
+    with stage('spectral_statistics'):
+        stats, onset_envelope, n_samples = stream_analysis(
+            open_blocks, sr, params['n_fft'], hop_length, onset='stft' if params['onset_tempo'] else 'mel',
+            consume=consume)
+    with stage('beat_track'):
+        tempo = stream_tempo(onset_envelope, sr, hop_length)
+        _, beats = librosa.beat.beat_track(onset_envelope=onset_envelope, sr=sr, hop_length=hop_length, bpm=tempo)
+    return {
+        'sr': sr,
+        'profile': profile,
+        'duration': n_samples / sr,
+        'tempo': float(np.atleast_1d(tempo)[0]),
+        'beat_times': librosa.frames_to_time(beats, sr=sr, hop_length=hop_length),
+        'waveform_min': envelope.minimum,
+        'waveform_max': envelope.maximum,
+        'waveform_times': envelope.starts / sr,
+        **stats,
+        'spectrogram': None,
+    }
+
+
+# Compute everything the Music Analysis page shows for a decoded signal (decoded at the sample rate
+# of the profile, see core.audio.PROFILES).
+# max_frames=None keeps the full resolution spectrogram, streaming=True skips it entirely (see
+# stream_features to analyze a file without decoding it into memory).
+def extract_features(y, sr, max_frames=SPECTROGRAM_FRAMES, streaming=False, profile=DEFAULT_PROFILE):
+    if streaming:
+        return stream_features(lambda: array_blocks(y, sr * 30), sr, profile)
+    params = PROFILES[profile]
+    n_fft, hop_length = params['n_fft'], params['hop_length']
+    S_dB = None
+    if params['onset_tempo']:
+        # One STFT serves both the band statistics and the onset envelope the tempo comes from
+        with stage('stft'):
+            S_dB = librosa.amplitude_to_db(np.abs(librosa.stft(y, n_fft=n_fft, hop_length=hop_length)), ref=np.max)
+        with stage('beat_track'):
+            onset_envelope = librosa.onset.onset_strength(S=S_dB, sr=sr, hop_length=hop_length)
+            tempo, beats = librosa.beat.beat_track(onset_envelope=onset_envelope, sr=sr, hop_length=hop_length)
+    else:
+        with stage('beat_track'):
+            tempo, beats = librosa.beat.beat_track(y=y, sr=sr, hop_length=hop_length)
+    env_min, env_max, env_starts = waveform_envelope(y)
+    features = {
+        'sr': sr,
+        'profile': profile,
+        'duration': len(y) / sr,
+        'tempo': float(np.atleast_1d(tempo)[0]),
+        'beat_times': librosa.frames_to_time(beats, sr=sr, hop_length=hop_length),
+        'waveform_min': env_min,
+        'waveform_max': env_max,
+        'waveform_times': env_starts / sr,
+    }
+    if S_dB is None:
+        with stage('stft'):
+            S_dB = librosa.amplitude_to_db(np.abs(librosa.stft(y, n_fft=n_fft, hop_length=hop_length)), ref=np.max)
+    with stage('spectral_statistics'):
+        features.update(spectral_statistics(S_dB, sr, n_fft))
+    spectrogram, frames = pool_frames(S_dB, max_frames)
+    features['spectrogram'] = spectrogram
+    features['spectrogram_times'] = librosa.frames_to_time(frames, sr=sr, hop_length=hop_length)
+    return features
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Extract and store the features for every audio file in a directory, skipping up to date ones
+def build_store(music_dir, features_dir=FEATURES_DIR, force=False, profile=DEFAULT_PROFILE):
+    built = []
+    for name in sorted(os.listdir(music_dir)):
+        if not name.lower().endswith(('.mp3', '.wav', '.flac', '.ogg')):
+            continue
+        audio_path = os.path.join(music_dir, name)
+        path = feature_path(name, features_dir)
+        source_sha256 = file_sha256(audio_path)
+        stored = load_features(path)
+        if not force and stored is not None and stored['source_sha256'] == source_sha256 \
+                and stored['profile'] == profile:
+            continue
+        y, sr = librosa.load(audio_path, sr=PROFILES[profile]['sr'])
+        save_features(path, extract_features(y, sr, profile=profile), source_sha256)
+        built.append(path)
+        print(f"Stored features for {name}", file=sys.stderr)
+    return built
+
+
+# One CSV row of scalar features per stored track, e.g. to pick tracks for an experiment
+def write_summary(features_dir, output):
+    with open(output, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['track', 'profile'] + SUMMARY_COLUMNS)
+        for track, profile, values in iter_summaries(features_dir):
+            writer.writerow([track, profile] + values)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Precompute the Music Analysis features of audio files.")
+    parser.add_argument("music_dir", nargs="?", default=os.path.join('data', 'music_file'),
+                        help="directory with the audio files (default: data/music_file)")
+    parser.add_argument("-o", "--output", default=FEATURES_DIR, help="feature store directory")
+    parser.add_argument("--force", action="store_true", help="recompute features that are up to date")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default=DEFAULT_PROFILE,
+                        help="analysis profile, 'fast' for scanning large libraries (default: full)")
+    parser.add_argument("--summary", default=None, help="also write the scalar features of all tracks to a CSV file")
+    args = parser.parse_args(argv)
+    build_store(args.music_dir, args.output, args.force, args.profile)
+    if args.summary:
+        write_summary(args.output, args.summary)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,189 @@
+# Polynomial fitting: single fits for the plot and a batched "fit matrix" over every column pair
+#
+# Usage:
+#   python -m core.fitting data/music_for_plants_df.csv -o fit_matrix.csv
+import argparse
+import sys
+
+import numpy as np
+import pandas as pd
+
+MAX_DEGREE = 10
+
+
+# Formatting the polynomial equation
+def format_polynomial(coeffs):
+    terms = []
+    degree = len(coeffs) - 1
+    for i, coeff in enumerate(coeffs):
+        if coeff == 0:
+            continue
+        exponent = degree - i
+        if exponent == 0:
+            terms.append(f"{coeff:.2f}")
+        elif exponent == 1:
+            terms.append(f"{coeff:.2f}x")
+        else:
+            terms.append(f"{coeff:.2f}x^{exponent}")
+    return " + ".join(terms).replace("+ -", "- ")
+
+
+# Coefficient of determination, same definition as sklearn.metrics.r2_score without importing sklearn
+def r2_score(y_true, y_pred):
+    y_true, y_pred = np.asarray(y_true, dtype=np.float64), np.asarray(y_pred, dtype=np.float64)
+    ss_residual = np.square(y_true - y_pred).sum()
+    ss_total = np.square(y_true - y_true.mean()).sum()
+    if ss_total == 0:
+        return 1.0 if ss_residual == 0 else 0.0
+    return 1 - ss_residual / ss_total
+
+
+# Keep the columns that hold numbers, coercing anything unparsable to NaN
+def numeric_columns(df):
+    numeric = df.apply(pd.to_numeric, errors='coerce')
+    return numeric.loc[:, numeric.notna().any()]
+
+
+# Legendre polynomials P_0..P_degree of x in [-1, 1], (kx, n) -> (kx, degree + 1, n).
+# They span the same space as the monomials but stay far better conditioned at high degree.
+def _legendre_basis(x, degree):
+    basis = np.empty(x.shape[:1] + (degree + 1,) + x.shape[1:])
+    basis[:, 0] = 1
+    basis[:, 1] = x
+    for k in range(1, degree):
+        basis[:, k + 1] = ((2 * k + 1) * x * basis[:, k] - k * basis[:, k - 1]) / (k + 1)
+    return basis
+
+
+# Upper triangular R with G = R^T R for a batch of Gram matrices. Columns that are (numerically)
+# in the span of the previous ones get a zero pivot instead of failing the whole factorization.
+def _cholesky_upper(G, tol):
+    R = np.zeros_like(G)
+    for j in range(G.shape[1]):
+        pivot = G[:, j, j] - np.square(R[:, :j, j]).sum(axis=1)
+        independent = pivot > tol * tol * G[:, j, j]
+        diagonal = np.sqrt(np.where(independent, pivot, 1.0))
+        R[:, j, j + 1:] = (G[:, j, j + 1:] - np.einsum('ki,kil->kl', R[:, :j, j], R[:, :j, j + 1:])) \
+            / diagonal[:, None]
+        R[:, j, j + 1:] *= independent[:, None]
+        R[:, j, j] = np.where(independent, diagonal, 0)
+    return R
+
+
+# Above this many rows the Gram matrix route is much faster than a Householder QR of the basis
+QR_MAX_ROWS = 5000
+RANK_TOLERANCE = 1e-6
+
+
+# R² of every (x column, y column) pair for degrees 1..max_degree.
+# X is (n, kx), Y is (n, ky) without missing values; returns (kx, max_degree, ky).
+#
+# Each x column gets one polynomial basis (on x rescaled to [-1, 1]) shared by all y columns and
+# degrees. Its triangular factor R is nested: the leading (d+1)x(d+1) block belongs to the degree d
+# model, so with z = R^-T B^T y the explained sum of squares of every degree is a cumulative sum of z².
+def batched_r2(X, Y, max_degree=MAX_DEGREE):
+    n, kx = X.shape
+    r2 = np.full((kx, max_degree, Y.shape[1]), np.nan)
+    degrees = min(max_degree, n - 1)
+    if degrees < 1:
+        return r2
+
+    low, high = X.min(axis=0), X.max(axis=0)
+    half_range = (high - low) / 2
+    half_range[half_range == 0] = 1  # constant x: the linear column is all zeros and fails the rank check
+    basis = _legendre_basis(((X - (low + high) / 2) / half_range).T, degrees)  # (kx, degrees + 1, n)
+    column_norms = np.sqrt(np.square(basis).sum(axis=2))
+    if n <= QR_MAX_ROWS:
+        R = np.linalg.qr(np.swapaxes(basis, 1, 2), mode='r')
+    else:
+        R = _cholesky_upper(basis @ np.swapaxes(basis, 1, 2), RANK_TOLERANCE)
+    diagonal = np.abs(np.diagonal(R, axis1=1, axis2=2))
+    independent = diagonal > RANK_TOLERANCE * column_norms
+
+    # Forward substitution R^T z = B^T y, one basis row at a time for all pairs at once
+    Y_centered = Y - Y.mean(axis=0)
+    ss_total = np.square(Y_centered).sum(axis=0)
+    projections = basis @ Y_centered  # (kx, degrees + 1, ky)
+    pivots = np.where(independent, np.diagonal(R, axis1=1, axis2=2), 1.0)
+    z = np.zeros_like(projections)
+    for j in range(degrees + 1):
+        residual = projections[:, j] - np.einsum('ki,kiy->ky', R[:, :j, j], z[:, :j])
+        z[:, j] = residual / pivots[:, j, None]
+    explained = np.cumsum(np.square(z[:, 1:, :]), axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r2[:, :degrees, :] = np.clip(explained / ss_total, 0.0, 1.0)
+
+    # Degrees beyond the number of distinct x values are underdetermined
+    full_rank = np.cumprod(independent[:, 1:], axis=1).astype(bool)
+    r2[:, :degrees, :][~full_rank] = np.nan
+    r2[:, :, ss_total == 0] = np.nan
+    return r2
+
+
+# Sortable R² table for every numeric column pair and degree, fitted in one batched pass per
+# missing-value pattern (a single pass when the data has no gaps)
+def fit_matrix(df, max_degree=MAX_DEGREE):
+    numeric = numeric_columns(df)
+    names = list(numeric.columns)
+    values = numeric.to_numpy(dtype=np.float64)
+    finite = np.isfinite(values)
+
+    patterns = {}
+    for column in range(len(names)):
+        patterns.setdefault(finite[:, column].tobytes(), []).append(column)
+    patterns = [(finite[:, columns[0]], columns) for columns in patterns.values()]
+
+    frames = []
+    for x_rows, x_columns in patterns:
+        for y_rows, y_columns in patterns:
+            rows = x_rows & y_rows
+            r2 = batched_r2(values[rows][:, x_columns], values[rows][:, y_columns], max_degree)
+            x_index, degree_index, y_index = np.indices(r2.shape).reshape(3, -1)
+            frames.append(pd.DataFrame({
+                'X': [names[x_columns[i]] for i in x_index],
+                'Y': [names[y_columns[i]] for i in y_index],
+                'Degree': degree_index + 1,
+                'R2': r2.ravel(),
+                'Samples': int(rows.sum()),
+            }))
+
+    if not frames:
+        return pd.DataFrame(columns=['X', 'Y', 'Degree', 'R2', 'Samples'])
+    table = pd.concat(frames, ignore_index=True)
+    table = table[table['X'] != table['Y']].dropna(subset=['R2'])
+    return table.sort_values('R2', ascending=False, ignore_index=True)
+
+
+# Add the fitted equation to (the top rows of) a fit matrix table
+def with_equations(df, table):
+    numeric = numeric_columns(df)
+    equations = []
+    for row in table.itertuples(index=False):
+        pair = numeric[[row.X, row.Y]].dropna()
+        coefficients = np.polyfit(pair[row.X], pair[row.Y], row.Degree)
+        equations.append(format_polynomial(coefficients))
+    return table.assign(Equation=equations)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fit polynomials of degree 1-10 to every numeric column pair.")
+    parser.add_argument("csv", help="input CSV file")
+    parser.add_argument("-o", "--output", default="-", help="output CSV file (default: stdout)")
+    parser.add_argument("--max-degree", type=int, default=MAX_DEGREE, help="highest polynomial degree")
+    parser.add_argument("--x", help="only keep fits with this X column")
+    parser.add_argument("--y", help="only keep fits with this Y column")
+    args = parser.parse_args(argv)
+
+    df = pd.read_csv(args.csv)
+    table = fit_matrix(df, args.max_degree)
+    if args.x:
+        table = table[table['X'] == args.x]
+    if args.y:
+        table = table[table['Y'] == args.y]
+    table = with_equations(df, table)
+    table.to_csv(sys.stdout if args.output == "-" else args.output, index=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,184 @@
+# Append-only local store of canopy measurements and sensor readings per day (SQLite).
+# Images are keyed by the SHA-256 of their bytes, so re-ingesting a folder only processes new photos.
+#
+# Usage:
+#   python -m core.growth_store ingest-images images/
+#   python -m core.growth_store ingest-sensors data/day_full_df.csv
+#   python -m core.growth_store export -o day_full_df.csv --from-day 10 --to-day 20
+import argparse
+import hashlib
+import os
+import sqlite3
+import sys
+import time
+from contextlib import closing
+
+import pandas as pd
+
+from core.canopy import SCALING_FACTOR, parse_day
+
+DEFAULT_PATH = os.environ.get("PLANTAMUSICA_GROWTH_DB", os.path.join('data', 'growth.sqlite'))
+
+CANOPY_COLUMN = 'Canopy Coverage (cm²)'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS canopy (
+    image_sha256 TEXT PRIMARY KEY,
+    day INTEGER,
+    image_name TEXT NOT NULL,
+    pixel_count INTEGER NOT NULL,
+    canopy_cm2 REAL NOT NULL,
+    ingested_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS canopy_day ON canopy (day);
+CREATE TABLE IF NOT EXISTS sensor (
+    day INTEGER NOT NULL,
+    variable TEXT NOT NULL,
+    value REAL,
+    ingested_at REAL NOT NULL,
+    PRIMARY KEY (day, variable)
+);
+"""
+
+
+def _day_filter(day_min, day_max):
+    clauses, params = [], []
+    if day_min is not None:
+        clauses.append("day >= ?")
+        params.append(day_min)
+    if day_max is not None:
+        clauses.append("day <= ?")
+        params.append(day_max)
+    return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+
+class GrowthStore:
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with closing(self._connect()) as connection, connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+
+    # One short-lived connection per operation, so the store can be shared by Streamlit sessions
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def has_image(self, image_sha256):
+        with closing(self._connect()) as connection:
+            row = connection.execute("SELECT 1 FROM canopy WHERE image_sha256 = ?", (image_sha256,)).fetchone()
+        return row is not None
+
+    # Record the canopy measurement of an image, keeping the first record of identical content
+    def add_canopy(self, image_sha256, image_name, pixel_count, day=None, scaling_factor=SCALING_FACTOR):
+        if day is None:
+            day = parse_day(image_name)
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                "INSERT OR IGNORE INTO canopy VALUES (?, ?, ?, ?, ?, ?)",
+                (image_sha256, day, image_name, int(pixel_count), pixel_count / scaling_factor, time.time()))
+
+    # Measure and record an image unless identical content is already in the store, returns True if new
+    def ingest_image(self, image_bytes, image_name, day=None, cache=None):
+        image_sha256 = hashlib.sha256(image_bytes).hexdigest()
+        if self.has_image(image_sha256):
+            return False
+        from core.canopy import analyze_image_bytes
+        _, pixel_count, _ = analyze_image_bytes(image_bytes, cache)
+        self.add_canopy(image_sha256, image_name, pixel_count, day)
+        return True
+
+    # Record sensor readings from a table with one row per day (like data/day_full_df.csv).
+    # Readings of a day that is already stored are updated.
+    def ingest_sensors(self, df, day_column='Day'):
+        numeric = df.apply(pd.to_numeric, errors='coerce').dropna(subset=[day_column])
+        long = numeric.melt(id_vars=[day_column], var_name='variable', value_name='value').dropna(subset=['value'])
+        now = time.time()
+        rows = [(int(day), variable, float(value), now)
+                for day, variable, value in long[[day_column, 'variable', 'value']].itertuples(index=False)]
+        with closing(self._connect()) as connection, connection:
+            connection.executemany("INSERT OR REPLACE INTO sensor VALUES (?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def day_range(self):
+        with closing(self._connect()) as connection:
+            low, high = connection.execute(
+                "SELECT MIN(day), MAX(day) FROM (SELECT day FROM sensor UNION ALL SELECT day FROM canopy)").fetchone()
+        return low, high
+
+    # Canopy measurements of the images taken between day_min and day_max (inclusive)
+    def canopy(self, day_min=None, day_max=None):
+        where, params = _day_filter(day_min, day_max)
+        with closing(self._connect()) as connection:
+            return pd.read_sql_query(
+                "SELECT day AS Day, image_name AS 'Image Name', canopy_cm2 AS 'Canopy Coverage (cm²)', image_sha256"
+                f" FROM canopy{where} ORDER BY day, image_name", connection, params=params)
+
+    # Sensor readings between day_min and day_max, one row per day and one column per variable
+    def sensors(self, day_min=None, day_max=None):
+        where, params = _day_filter(day_min, day_max)
+        with closing(self._connect()) as connection:
+            long = pd.read_sql_query(f"SELECT day, variable, value FROM sensor{where} ORDER BY rowid",
+                                     connection, params=params)
+        # Keep the columns in the order they were ingested in
+        wide = long.pivot(index='day', columns='variable', values='value')[long['variable'].unique()]
+        wide.columns.name = None
+        return wide.rename_axis('Day').reset_index()
+
+    # Per-day table in the layout of data/day_full_df.csv: sensor readings plus the mean canopy
+    # coverage of the day's images (which takes precedence over a recorded canopy reading).
+    # The merge is an outer join, so days with only images or only readings are kept with NaN in
+    # the missing columns; the Data Analysis page drops those rows per column pair before fitting.
+    def daily_table(self, day_min=None, day_max=None):
+        table = self.sensors(day_min, day_max)
+        daily_canopy = self.canopy(day_min, day_max).dropna(subset=['Day']).groupby('Day')[CANOPY_COLUMN].mean()
+        if daily_canopy.empty:
+            return table
+        table = table.merge(daily_canopy.rename('_measured').reset_index(), on='Day', how='outer')
+        if CANOPY_COLUMN in table:
+            table[CANOPY_COLUMN] = table['_measured'].combine_first(table[CANOPY_COLUMN])
+        else:
+            table[CANOPY_COLUMN] = table['_measured']
+        return table.drop(columns='_measured').sort_values('Day', ignore_index=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ingest and export the growth timeseries store.")
+    parser.add_argument("--db", default=DEFAULT_PATH, help="SQLite file of the store")
+    commands = parser.add_subparsers(dest="command", required=True)
+    images = commands.add_parser("ingest-images", help="measure and record new images")
+    images.add_argument("sources", nargs="+", help="image directories, files or glob patterns")
+    sensors = commands.add_parser("ingest-sensors", help="record per-day sensor readings from a CSV file")
+    sensors.add_argument("csv", help="CSV file with a Day column")
+    sensors.add_argument("--day-column", default="Day")
+    export = commands.add_parser("export", help="write the per-day table as CSV")
+    export.add_argument("-o", "--output", default="-", help="output CSV file (default: stdout)")
+    export.add_argument("--from-day", type=int)
+    export.add_argument("--to-day", type=int)
+    args = parser.parse_args(argv)
+
+    store = GrowthStore(args.db)
+    if args.command == "ingest-images":
+        from core.batch import collect_images
+        from core.canopy import count_green_pixels_in_file
+        added = skipped = 0
+        for path in collect_images(args.sources):
+            with open(path, 'rb') as f:
+                image_sha256 = hashlib.sha256(f.read()).hexdigest()
+            if store.has_image(image_sha256):
+                skipped += 1
+                continue
+            store.add_canopy(image_sha256, os.path.basename(path), count_green_pixels_in_file(path))
+            added += 1
+        print(f"Added {added} images, {skipped} already in the store", file=sys.stderr)
+    elif args.command == "ingest-sensors":
+        rows = store.ingest_sensors(pd.read_csv(args.csv), args.day_column)
+        print(f"Recorded {rows} sensor readings", file=sys.stderr)
+    else:
+        table = store.daily_table(args.from_day, args.to_day)
+        table.to_csv(sys.stdout if args.output == "-" else args.output, index=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
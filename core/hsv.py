@@ -0,0 +1,98 @@
+# Fused HSV threshold kernel: RGB -> HSV conversion, range test and counting in a single pass over
+# the pixels, without the full-frame HSV copy and mask of cv2.cvtColor + cv2.inRange (the mask is only
+# written when asked for).
+# The conversion reproduces OpenCV's 8-bit RGB2HSV bit for bit (fixed point with hsv_shift = 12 and
+# the same division tables), so counts and masks are identical to the OpenCV path. It is evaluated
+# once per HSV range for all 2^24 RGB colors into a 2MB bit table; the per-image pass is then a
+# table lookup per pixel.
+from functools import lru_cache
+
+import numba
+import numpy as np
+
+HSV_SHIFT = 12
+
+
+def _division_tables():
+    i = np.arange(256, dtype=np.float64)
+    with np.errstate(divide='ignore'):
+        sdiv = np.where(i > 0, np.round((255 << HSV_SHIFT) / i), 0).astype(np.int32)
+        hdiv = np.where(i > 0, np.round((180 << HSV_SHIFT) / (6 * i)), 0).astype(np.int32)
+    return sdiv, hdiv
+
+
+SDIV_TABLE, HDIV_TABLE180 = _division_tables()
+
+
+# For every V = max(R, G, B), the interval of chroma (max - min) whose pixels pass both the V and the
+# S bounds. S = (chroma * sdiv[V] + 2^11) >> 12 grows with the chroma, so the passing values are an
+# interval and the V and S tests become one table lookup. Empty intervals are (256, -1).
+@lru_cache(maxsize=16)
+def chroma_bounds(lower, upper):
+    low = np.full(256, 256, dtype=np.int32)
+    high = np.full(256, -1, dtype=np.int32)
+    for v in range(lower[2], min(upper[2], 255) + 1):
+        chroma = np.arange(v + 1)
+        s = (chroma * SDIV_TABLE[v] + (1 << (HSV_SHIFT - 1))) >> HSV_SHIFT
+        passing = np.flatnonzero((s >= lower[1]) & (s <= upper[1]))
+        if len(passing):
+            low[v], high[v] = passing[0], passing[-1]
+    return low, high
+
+
+@numba.njit(cache=True, nogil=True)
+def _fill_table(chroma_low, chroma_high, h_low, h_high, hdiv, table):
+    for color in range(1 << 24):
+        r = color >> 16
+        g = (color >> 8) & 255
+        b = color & 255
+        v = max(r, max(g, b))
+        chroma = v - min(r, min(g, b))
+        if not chroma_low[v] <= chroma <= chroma_high[v]:
+            continue
+        if v == r:
+            h = g - b
+        elif v == g:
+            h = b - r + 2 * chroma
+        else:
+            h = r - g + 4 * chroma
+        h = (h * hdiv[chroma] + (1 << (HSV_SHIFT - 1))) >> HSV_SHIFT
+        if h < 0:
+            h += 180
+        if h_low <= h <= h_high:
+            table[color >> 3] |= np.uint8(1 << (color & 7))
+
+
+@numba.njit(cache=True, nogil=True)
+def _lookup(image, table, mask_out, write_mask):
+    count = 0
+    for y in range(image.shape[0]):
+        row = image[y]
+        for x in range(row.shape[0]):
+            color = (np.int32(row[x, 0]) << 16) | (np.int32(row[x, 1]) << 8) | np.int32(row[x, 2])
+            inside = (table[color >> 3] >> (color & 7)) & 1
+            count += inside
+            if write_mask:
+                mask_out[y, x] = 255 * inside
+    return count
+
+
+_NO_MASK = np.empty((0, 0), dtype=np.uint8)
+
+
+# Bit table of all 2^24 RGB colors (little-endian bit order, color = R << 16 | G << 8 | B) telling
+# whether the color's HSV value lies within [lower, upper]
+@lru_cache(maxsize=4)
+def range_table(lower, upper):
+    chroma_low, chroma_high = chroma_bounds(lower, upper)
+    table = np.zeros(1 << 21, dtype=np.uint8)
+    _fill_table(chroma_low, chroma_high, lower[0], upper[0], HDIV_TABLE180, table)
+    return table
+
+
+# Number of pixels of an (H, W, >=3) uint8 RGB array whose HSV value lies within [lower, upper].
+# Pass mask_out (an (H, W) uint8 array) to also get the 0/255 mask cv2.inRange would produce.
+def count_in_range(image_array, lower, upper, mask_out=None):
+    table = range_table(tuple(int(n) for n in lower), tuple(int(n) for n in upper))
+    write_mask = mask_out is not None
+    return int(_lookup(image_array, table, mask_out if write_mask else _NO_MASK, write_mask))
@@ -0,0 +1,54 @@
+# Background analysis queue for uploaded images.
+# Jobs run on a thread pool outside the Streamlit script thread (OpenCV and PIL release the GIL while
+# they work, and threads share the process-wide mask cache), and are keyed by content so a rerun
+# re-attaches to jobs that are still running or already finished instead of starting over.
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+class AnalysisQueue:
+    def __init__(self, analyze, workers=None, max_results=128):
+        self._analyze = analyze
+        self._executor = ThreadPoolExecutor(max_workers=workers or min(4, os.cpu_count() or 1),
+                                            thread_name_prefix="canopy-analysis")
+        self._futures = OrderedDict()
+        self._max_results = max_results
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._futures)
+
+    # Queue analyze(image_bytes, *args), or return the job already queued for the same content and arguments
+    def submit(self, image_bytes, *args):
+        key = (hashlib.sha256(image_bytes).hexdigest(),) + args
+        with self._lock:
+            future = self._futures.get(key)
+            # Failed jobs are retried on the next submit
+            if future is None or (future.done() and future.exception() is not None):
+                future = self._executor.submit(self._analyze, image_bytes, *args)
+                self._futures[key] = future
+            self._futures.move_to_end(key)
+            self._evict()
+        return future
+
+    # Forget the least recently submitted finished jobs above max_results, pending ones are kept
+    def _evict(self):
+        excess = len(self._futures) - self._max_results
+        for key in [key for key, future in self._futures.items() if future.done()][:max(0, excess)]:
+            del self._futures[key]
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Yield (index, future) for the futures in the order they finish
+def iter_completed(futures):
+    indices = {}
+    for index, future in enumerate(futures):
+        indices.setdefault(future, []).append(index)
+    for future in as_completed(indices):
+        for index in indices[future]:
+            yield index, future
@@ -0,0 +1,368 @@
+# Per-stage timing and peak memory of page runs, aggregated into histograms.
+#
+# Pages call profile_controls(st, page) at the top and render_profile(st) at the end (start_run and
+# finish_run outside of Streamlit), and wrap their steps in `with stage('decode'):` (library code
+# does the same for its own hot spots, e.g. the HSV threshold or the STFT). Every stage records its
+# wall time and its peak resident memory above the level at its start, sampled from a background
+# thread while stages are open. Memory is per process, so stages of concurrent sessions see each
+# other's allocations.
+#
+# Set PLANTAMUSICA_METRICS_PORT to serve the histograms in the Prometheus text format on
+# http://127.0.0.1:<port>/metrics (JSON on /metrics.json), and PLANTAMUSICA_METRICS_LOG to append one
+# JSON line per finished run to a file. Runs ended by st.stop() or an exception are not recorded.
+#
+# Usage:
+#   python -m core.metrics summary metrics.jsonl
+import argparse
+import bisect
+import cProfile
+import io
+import json
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_PORT = os.environ.get("PLANTAMUSICA_METRICS_PORT")
+METRICS_LOG = os.environ.get("PLANTAMUSICA_METRICS_LOG")
+# Show the "Profile this run" button on the pages
+PROFILING = os.environ.get("PLANTAMUSICA_PROFILING", "") not in ("", "0")
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)  # seconds
+MEMORY_BUCKETS = tuple(2 ** power for power in range(20, 33))  # 1MB .. 4GB
+SAMPLE_INTERVAL = 0.005  # seconds between resident memory samples while a stage is open
+BACKGROUND_PAGE = "background"  # stages run outside of a page run, e.g. on a worker thread
+
+
+# Resident set size of this process in bytes, or None where it can't be read
+def current_rss():
+    try:
+        with open('/proc/self/statm', 'rb') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, IndexError, ValueError, AttributeError):
+        return None
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    # Cumulative counts per upper bound, as Prometheus expects them
+    def cumulative(self):
+        total, bounds = 0, []
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            bounds.append((bound, total))
+        return bounds
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self._memory = defaultdict(lambda: Histogram(MEMORY_BUCKETS))
+
+    def observe(self, page, name, seconds, peak_bytes=None):
+        with self._lock:
+            self._latency[page, name].observe(seconds)
+            if peak_bytes is not None:
+                self._memory[page, name].observe(peak_bytes)
+
+    def prometheus_text(self):
+        lines = []
+        with self._lock:
+            for metric, histograms, help_text in (
+                    ('plantamusica_stage_seconds', self._latency, 'Wall time of a page stage'),
+                    ('plantamusica_stage_peak_memory_bytes', self._memory,
+                     'Peak resident memory of a page stage above its starting level')):
+                lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} histogram"]
+                for (page, name), histogram in sorted(histograms.items()):
+                    labels = f'page="{_escape(page)}",stage="{_escape(name)}"'
+                    for bound, count in histogram.cumulative():
+                        le = '+Inf' if bound == float('inf') else repr(bound)
+                        lines.append(f'{metric}_bucket{{{labels},le="{le}"}} {count}')
+                    lines.append(f"{metric}_sum{{{labels}}} {histogram.sum!r}")
+                    lines.append(f"{metric}_count{{{labels}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    # The histograms as JSON-serializable dicts, bucket counts cumulative and without +Inf
+    def snapshot(self):
+        def dump(histogram):
+            return {'count': histogram.count, 'sum': histogram.sum, 'buckets': histogram.cumulative()[:-1]}
+        with self._lock:
+            return [{'page': page, 'stage': name, 'seconds': dump(histogram),
+                     'peak_memory_bytes': dump(self._memory[page, name]) if (page, name) in self._memory else None}
+                    for (page, name), histogram in sorted(self._latency.items())]
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+REGISTRY = Registry()
+
+
+# Tracks the highest resident memory seen by every open stage, sampling only while any is open
+class _MemorySampler:
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self._interval = interval
+        self._open = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def open(self):
+        rss = current_rss()
+        if rss is None:
+            return None
+        token = object()
+        with self._lock:
+            self._open[token] = [rss, rss]
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="metrics-memory-sampler", daemon=True)
+                self._thread.start()
+        self._wake.set()
+        return token
+
+    # Peak above the starting level in bytes
+    def close(self, token):
+        if token is None:
+            return None
+        self._sample()
+        with self._lock:
+            start, peak = self._open.pop(token)
+        return max(0, peak - start)
+
+    def _sample(self):
+        rss = current_rss()
+        with self._lock:
+            for levels in self._open.values():
+                levels[1] = max(levels[1], rss)
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            self._sample()
+            time.sleep(self._interval)
+            with self._lock:
+                if not self._open:
+                    self._wake.clear()
+
+
+_sampler = _MemorySampler()
+_local = threading.local()
+
+
+# Time a named stage of the current page run (or of BACKGROUND_PAGE outside of one)
+@contextmanager
+def stage(name):
+    run = getattr(_local, 'run', None)
+    token = _sampler.open()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        peak_bytes = _sampler.close(token)
+        REGISTRY.observe(run['page'] if run else BACKGROUND_PAGE, name, seconds, peak_bytes)
+        if run is not None:
+            run['stages'].append({'stage': name, 'seconds': seconds, 'peak_memory_bytes': peak_bytes})
+
+
+# Begin recording a page run on this thread. With profile=True the run is also profiled, with
+# pyinstrument when it is installed and cProfile otherwise (this thread only).
+def start_run(page, profile=False):
+    _start_exporters()
+    previous = getattr(_local, 'run', None)
+    if previous is not None:
+        abandon_run(previous)
+    profiler = _start_profiler() if profile else None
+    _local.run = {'page': page, 'run_id': uuid.uuid4().hex, 'started_at': time.time(),
+                  'start': time.perf_counter(), 'stages': [], 'profiler': profiler}
+
+
+# Finish the run of this thread: record its total time as the "run" stage, append it to the JSON log
+# and return it, or None. Profiled runs also get a 'profile' text report and the 'profile_data' to
+# download as a file with the 'profile_extension'.
+def finish_run():
+    run = getattr(_local, 'run', None)
+    if run is None:
+        return None
+    _local.run = None
+    seconds = time.perf_counter() - run.pop('start')
+    profiler = run.pop('profiler')
+    REGISTRY.observe(run['page'], 'run', seconds)
+    run['seconds'] = seconds
+    if METRICS_LOG:
+        _append_log(run)
+    if profiler is not None:
+        run['profile'], run['profile_data'], run['profile_extension'] = _stop_profiler(profiler)
+    return run
+
+
+# Stop the profiler of a run that never reached finish_run
+def abandon_run(run):
+    profiler, run['profiler'] = run['profiler'], None
+    if profiler is not None:
+        _stop_profiler(profiler)
+
+
+# Page helpers: begin the run of a Streamlit page, with a "Profile this run" sidebar button when
+# PROFILING is on, and finish it, showing the profile in the sidebar when one was asked for.
+# The open run is also kept in the session state: a run ended by st.stop(), an exception or a rerun
+# never reaches render_profile, and the session's next run may be on another thread.
+def profile_controls(st, page):
+    leaked = st.session_state.pop('_metrics_run', None)
+    if leaked is not None:
+        abandon_run(leaked)
+    start_run(page, profile=PROFILING and st.sidebar.button("Profile this run"))
+    st.session_state['_metrics_run'] = _local.run
+
+
+def render_profile(st):
+    st.session_state.pop('_metrics_run', None)
+    run = finish_run()
+    if run is not None and 'profile' in run:
+        with st.sidebar.expander("Profile of this run"):
+            st.text(run['profile'])
+            st.download_button("Download profile", run['profile_data'],
+                               file_name=f"{run['page']}.{run['profile_extension']}")
+    return run
+
+
+def _start_profiler():
+    try:
+        from pyinstrument import Profiler
+    except ImportError:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+    profiler = Profiler(async_mode='disabled')
+    profiler.start()
+    return profiler
+
+
+# (text report, raw profile, its file extension): a pstats dump or the pyinstrument HTML page
+def _stop_profiler(profiler):
+    if isinstance(profiler, cProfile.Profile):
+        profiler.disable()
+        profiler.create_stats()
+        data = marshal.dumps(profiler.stats)  # the format of Profile.dump_stats, pstats.Stats takes the stats away
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(40)
+        return report.getvalue(), data, 'prof'
+    profiler.stop()
+    return profiler.output_text(unicode=True), profiler.output_html().encode('utf-8'), 'html'
+
+
+_log_lock = threading.Lock()
+
+
+def _append_log(run):
+    line = json.dumps({key: run[key] for key in ('run_id', 'page', 'started_at', 'seconds', 'stages')})
+    with _log_lock, open(METRICS_LOG, 'a', encoding='utf-8') as f:
+        f.write(line + "\n")
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == '/metrics':
+            body, content_type = REGISTRY.prometheus_text().encode('utf-8'), 'text/plain; version=0.0.4'
+        elif self.path == '/metrics.json':
+            body, content_type = json.dumps(REGISTRY.snapshot()).encode('utf-8'), 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_exporters_lock = threading.Lock()
+_server = None
+_serve_failed = False
+
+
+# Serve the registry on 127.0.0.1:port from a daemon thread, once per process
+def serve(port):
+    global _server
+    with _exporters_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer(('127.0.0.1', int(port)), _MetricsHandler)
+            threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+    return _server
+
+
+def _start_exporters():
+    global _serve_failed
+    if METRICS_PORT and _server is None and not _serve_failed:
+        try:
+            serve(METRICS_PORT)
+        except OSError as e:  # e.g. another server process already has the port
+            _serve_failed = True
+            print(f"Metrics endpoint not started on port {METRICS_PORT}: {e}", file=sys.stderr)
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+# Count, p50, p90, p99 and max wall time and the largest peak memory of every (page, stage) in a log
+def summarize(lines):
+    seconds, memory = defaultdict(list), defaultdict(list)
+    for line in lines:
+        if not line.strip():
+            continue
+        run = json.loads(line)
+        seconds[run['page'], 'run'].append(run['seconds'])
+        for record in run['stages']:
+            seconds[run['page'], record['stage']].append(record['seconds'])
+            if record.get('peak_memory_bytes') is not None:
+                memory[run['page'], record['stage']].append(record['peak_memory_bytes'])
+    return [{'page': page, 'stage': name, 'count': len(values),
+             'p50_ms': 1000 * _percentile(values, 0.5), 'p90_ms': 1000 * _percentile(values, 0.9),
+             'p99_ms': 1000 * _percentile(values, 0.99), 'max_ms': 1000 * max(values),
+             'peak_memory_mb': max(memory[page, name]) / 2 ** 20 if memory[page, name] else None}
+            for (page, name), values in sorted(seconds.items())]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarize the per-stage metrics of page runs.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    summary = subparsers.add_parser("summary", help="percentiles per page and stage from a PLANTAMUSICA_METRICS_LOG file")
+    summary.add_argument("log", help="JSON lines log")
+    args = parser.parse_args(argv)
+
+    with open(args.log, encoding='utf-8') as f:
+        rows = summarize(f)
+    print("| page | stage | runs | p50 (ms) | p90 (ms) | p99 (ms) | max (ms) | peak memory (MB) |")
+    print("|---|---|---|---|---|---|---|---|")
+    for row in rows:
+        memory = "" if row['peak_memory_mb'] is None else f"{row['peak_memory_mb']:.1f}"
+        print(f"| {row['page']} | {row['stage']} | {row['count']} | {row['p50_ms']:.1f} | {row['p90_ms']:.1f} "
+              f"| {row['p99_ms']:.1f} | {row['max_ms']:.1f} | {memory} |")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
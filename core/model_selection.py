@@ -0,0 +1,230 @@
+# Out-of-sample error and confidence bands of the polynomial fits of the Data Analysis page.
+# Every degree is scored by repeated k-fold cross-validation and by the out-of-bag error of bootstrap
+# resamples, and the bootstrap fits give percentile bands around the fitted curve.
+#
+# Both resampling schemes are weighted least squares on the same basis: a bootstrap resample weights
+# each row by how often it was drawn and a fold weights the held-out rows with 0. With a Legendre basis
+# (see core.fitting) one Gram matrix per resample serves all degrees. The resamples are split into
+# fixed-size, independently seeded tasks spread over a process pool, so the results only depend on the
+# seed and not on the number of workers.
+#
+# Usage:
+#   python -m core.model_selection data/day_full_df.csv --x "Air Temp Mean (°C)" --y "Canopy Coverage (cm²)"
+import argparse
+import sys
+import multiprocessing
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from core.fitting import MAX_DEGREE, QR_MAX_ROWS, RANK_TOLERANCE, _cholesky_upper, _legendre_basis, r2_score
+
+CV_FOLDS = 5
+CV_REPEATS = 20
+BOOTSTRAP_REPLICATES = 1000
+CONFIDENCE = 0.95
+TASK_RESAMPLES = 100  # resamples per pool task
+GRID_POINTS = 100
+
+
+# Legendre basis (n, max_degree + 1) of x mapped from [low, high] onto [-1, 1]
+def _basis(x, low, high, max_degree):
+    half_range = (high - low) / 2 or 1.0
+    return _legendre_basis(((np.asarray(x, dtype=np.float64) - (low + high) / 2) / half_range)[None],
+                           max_degree)[0].T
+
+
+# Weighted least-squares coefficients of every degree for a batch of row weights (R, n).
+# Returns a list indexed by degree - 1 of (R, degree + 1) arrays, NaN where the weighted rows have
+# fewer distinct x values than coefficients.
+#
+# The triangular factor of the weighted basis is nested like in core.fitting.batched_r2: its leading
+# (d+1)x(d+1) block and projections solve the degree d fit. Above QR_MAX_ROWS rows the factor comes
+# from the Gram matrix instead (pivoted like core.fitting.batched_r2), which is less accurate for
+# resamples with few distinct x values.
+def _weighted_fits(basis, codes, y, weights, max_degree):
+    if len(y) <= QR_MAX_ROWS:
+        root = np.sqrt(weights)
+        Q, R = np.linalg.qr(root[..., None] * basis)
+        z = np.einsum('rni,rn->ri', Q, root * y)
+    else:
+        # Dependent columns (x with few distinct values) get a zero pivot instead of failing the batch
+        R = _cholesky_upper(np.einsum('rn,ni,nj->rij', weights, basis, basis), RANK_TOLERANCE)
+        projections = (weights * y) @ basis
+        pivots = np.diagonal(R, axis1=1, axis2=2)
+        z = np.zeros_like(projections)
+        for j in range(basis.shape[1]):
+            residual = projections[:, j] - np.einsum('ri,ri->r', R[:, :j, j], z[:, :j])
+            z[:, j] = residual / np.where(pivots[:, j] > 0, pivots[:, j], 1.0)
+    distinct = np.array([np.unique(codes[row > 0]).size for row in weights])
+    independent = np.cumprod(np.diagonal(R, axis1=1, axis2=2) != 0, axis=1).astype(bool)
+    fits = []
+    for degree in range(1, max_degree + 1):
+        size = degree + 1
+        solvable = (distinct >= size) & independent[:, degree]
+        coefficients = np.full((len(weights), size), np.nan)
+        if solvable.any():
+            coefficients[solvable] = np.linalg.solve(R[solvable, :size, :size], z[solvable, :size, None])[..., 0]
+        fits.append(coefficients)
+    return fits
+
+
+def _bootstrap_weights(rng, n, count):
+    return rng.multinomial(n, np.full(n, 1 / n), size=count).astype(np.float64)
+
+
+# One row of 0/1 weights per (repeat, fold), the fold's rows held out
+def _kfold_weights(rng, n, folds, repeats):
+    weights = np.ones((repeats * folds, n))
+    for repeat in range(repeats):
+        fold_of_row = np.empty(n, dtype=np.int64)
+        fold_of_row[rng.permutation(n)] = np.arange(n) % folds
+        weights[repeat * folds + fold_of_row, np.arange(n)] = 0
+    return weights
+
+
+# One pool task: `count` resamples of one kind from its own seed. Returns the held-out squared error
+# sums and row counts per resample and degree, plus the predictions on the grid for bootstraps.
+def _resample_task(task):
+    kind, seed, count, x, y, grid, max_degree, folds = task
+    rng = np.random.default_rng(seed)
+    low, high = x.min(), x.max()
+    basis = _basis(x, low, high, max_degree)
+    codes = np.unique(x, return_inverse=True)[1]
+    if kind == 'bootstrap':
+        weights = _bootstrap_weights(rng, len(x), count)
+    else:
+        weights = _kfold_weights(rng, len(x), folds, count)
+    held_out = weights == 0
+
+    fits = _weighted_fits(basis, codes, y, weights, max_degree)
+    squared_errors = np.full((len(weights), max_degree), np.nan)
+    predictions = None
+    if kind == 'bootstrap':
+        grid_basis = _basis(grid, low, high, max_degree)
+        predictions = np.full((len(weights), max_degree, len(grid)), np.nan, dtype=np.float32)
+    for degree, coefficients in enumerate(fits, start=1):
+        residuals = y - coefficients @ basis[:, :degree + 1].T
+        squared_errors[:, degree - 1] = np.where(held_out, np.square(residuals), 0).sum(axis=1)
+        if predictions is not None:
+            predictions[:, degree - 1] = coefficients @ grid_basis[:, :degree + 1].T
+    return kind, squared_errors, held_out.sum(axis=1), predictions
+
+
+# Process pool for the resampling tasks. The workers are started by a forkserver (spawn where that is
+# not available) rather than forked, so they are safe to create from a multithreaded server such as
+# Streamlit; they only import this module to run _resample_task.
+def resampling_executor(workers=None):
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+    return ProcessPoolExecutor(max_workers=workers, mp_context=context)
+
+
+# Cross-validated and bootstrap (out-of-bag) RMSE of the polynomial fits of y on x for degrees
+# 1..max_degree, and the bootstrap confidence band of each fit on `grid` (default: 100 points over
+# the x range). Pass an executor or pool with a map method to reuse it (see resampling_executor),
+# workers=1 runs everything in this process.
+#
+# Returns (table, grid, bands): table has one row per degree, bands is (max_degree, 2, len(grid)) with
+# the lower and upper percentiles at the given confidence.
+def model_selection(x, y, max_degree=MAX_DEGREE, grid=None, folds=CV_FOLDS, repeats=CV_REPEATS,
+                    replicates=BOOTSTRAP_REPLICATES, confidence=CONFIDENCE, seed=0, pool=None, workers=None):
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    finite = np.isfinite(x) & np.isfinite(y)
+    x, y = x[finite], y[finite]
+    if len(x) < 3:
+        raise ValueError("At least 3 rows with both values are needed")
+    folds = min(folds, len(x))
+    grid = np.linspace(x.min(), x.max(), GRID_POINTS) if grid is None else np.asarray(grid, dtype=np.float64)
+
+    # Fixed-size tasks with seeds spawned in a fixed order: same results for any number of workers
+    cv_chunk = max(1, TASK_RESAMPLES // folds)
+    sizes = {'bootstrap': [min(TASK_RESAMPLES, replicates - start) for start in range(0, replicates, TASK_RESAMPLES)],
+             'cv': [min(cv_chunk, repeats - start) for start in range(0, repeats, cv_chunk)]}
+    seeds = iter(np.random.SeedSequence(seed).spawn(len(sizes['bootstrap']) + len(sizes['cv'])))
+    tasks = [(kind, next(seeds), count, x, y, grid, max_degree, folds) for kind in sizes for count in sizes[kind]]
+
+    if pool is not None:
+        results = list(pool.map(_resample_task, tasks))
+    elif workers == 1:
+        results = list(map(_resample_task, tasks))
+    else:
+        with resampling_executor(workers) as executor:
+            results = list(executor.map(_resample_task, tasks))
+
+    def collect(kind, index):
+        return np.concatenate([result[index] for result in results if result[0] == kind])
+
+    # Cross-validation: pooled held-out MSE per repeat, then the mean and spread over the repeats
+    cv_squared_errors = collect('cv', 1).reshape(-1, folds, max_degree)
+    cv_rows = collect('cv', 2).reshape(-1, folds).sum(axis=1)
+    cv_rmse = np.sqrt(cv_squared_errors.sum(axis=1) / cv_rows[:, None])
+    # Out-of-bag error of the bootstrap fits, over the resamples that could fit the degree
+    bootstrap_squared_errors, out_of_bag = collect('bootstrap', 1), collect('bootstrap', 2)
+    usable = np.isfinite(bootstrap_squared_errors) & (out_of_bag[:, None] > 0)
+    predictions = collect('bootstrap', 3)
+    tail = 100 * (1 - confidence) / 2
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # degrees no resample could fit
+        bootstrap_rmse = np.sqrt(np.where(usable, bootstrap_squared_errors, 0).sum(axis=0)
+                                 / np.where(usable, out_of_bag[:, None], 0).sum(axis=0))
+        bands = np.nanpercentile(predictions, [tail, 100 - tail], axis=0).transpose(1, 0, 2)
+        cv_mean = np.nanmean(cv_rmse, axis=0)
+        cv_spread = np.nanstd(cv_rmse, axis=0, ddof=1) if len(cv_rmse) > 1 else np.full(max_degree, np.nan)
+
+    basis = _basis(x, x.min(), x.max(), max_degree)
+    full_fits = _weighted_fits(basis, np.unique(x, return_inverse=True)[1], y, np.ones((1, len(x))), max_degree)
+    in_sample = [r2_score(y, basis[:, :degree + 1] @ coefficients[0]) if np.isfinite(coefficients).all() else np.nan
+                 for degree, coefficients in enumerate(full_fits, start=1)]
+
+    table = pd.DataFrame({
+        'Degree': np.arange(1, max_degree + 1),
+        'CV RMSE': cv_mean,
+        'CV RMSE SD': cv_spread,
+        'Bootstrap RMSE': bootstrap_rmse,
+        'Bootstrap fits': usable.sum(axis=0),
+        'In-sample R2': in_sample,
+    })
+    return table, grid, bands
+
+
+# Degree with the lowest cross-validated error, or None when no degree could be scored
+def best_degree(table):
+    scored = table.dropna(subset=['CV RMSE'])
+    return None if scored.empty else int(scored.loc[scored['CV RMSE'].idxmin(), 'Degree'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cross-validate and bootstrap polynomial fits of degree 1-10.")
+    parser.add_argument("csv", help="input CSV file")
+    parser.add_argument("--x", required=True, help="X column")
+    parser.add_argument("--y", required=True, help="Y column")
+    parser.add_argument("--max-degree", type=int, default=MAX_DEGREE, help="highest polynomial degree")
+    parser.add_argument("--folds", type=int, default=CV_FOLDS, help="cross-validation folds")
+    parser.add_argument("--repeats", type=int, default=CV_REPEATS, help="cross-validation repeats")
+    parser.add_argument("--replicates", type=int, default=BOOTSTRAP_REPLICATES, help="bootstrap resamples")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("-w", "--workers", type=int, default=None,
+                        help="number of worker processes (default: one per CPU)")
+    parser.add_argument("-o", "--output", default="-", help="output CSV file (default: stdout)")
+    args = parser.parse_args(argv)
+
+    df = pd.read_csv(args.csv)
+    for column in (args.x, args.y):
+        if column not in df:
+            parser.error(f"no column {column!r} in {args.csv}")
+    x, y = (pd.to_numeric(df[column], errors='coerce') for column in (args.x, args.y))
+    try:
+        table, _, _ = model_selection(x, y, args.max_degree, folds=args.folds, repeats=args.repeats,
+                                      replicates=args.replicates, seed=args.seed, workers=args.workers)
+    except ValueError as e:
+        parser.error(str(e))
+    table.to_csv(sys.stdout if args.output == "-" else args.output, index=False)
+    print(f"Lowest cross-validated error: degree {best_degree(table)}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,168 @@
+# Per-plant canopy coverage from the COCO polygon annotations in data/annotate_labels
+#
+# The polygons are rasterized once into a label image (0 = background, i = i-th plant), then the
+# green pixels of every plant are counted in a single bincount over the HSV mask, so a tray of
+# dozens of heads costs one pass per image instead of one pass per plant.
+#
+# Usage:
+#   python -m core.plants images/plant.jpg
+#   python -m core.plants "timelapse/*.jpg" --labels data/annotate_labels/labels.json --file-name plant.jpg
+import argparse
+import csv
+import glob
+import json
+import os
+import sys
+from functools import lru_cache
+
+import numpy as np
+
+from core.canopy import LOWER_GREEN, UPPER_GREEN, SCALING_FACTOR, TILE_PIXELS, _count_tile, open_rgb_array, \
+    parse_day, strip_rows
+
+LABELS_DIR = os.path.join('data', 'annotate_labels')
+
+COLUMNS = ["Image Name", "Day", "Plant", "Plant Area (cm²)", "Canopy Coverage (cm²)", "Coverage (%)"]
+
+
+# Parse a COCO file into {file name: (width, height, [(annotation id, category, [polygons])])}
+def load_annotations(path):
+    with open(path, encoding='utf-8') as f:
+        coco = json.load(f)
+    categories = {category['id']: category['name'] for category in coco.get('categories', [])}
+    images = {image['id']: (image['file_name'], image['width'], image['height']) for image in coco['images']}
+    annotations = {file_name: (width, height, []) for file_name, width, height in images.values()}
+    for annotation in coco['annotations']:
+        # Run-length encoded (crowd) masks aren't produced by our labelling tool
+        if not isinstance(annotation.get('segmentation'), list):
+            continue
+        file_name, _, _ = images[annotation['image_id']]
+        polygons = [np.array(polygon, dtype=np.float64).reshape(-1, 2)
+                    for polygon in annotation['segmentation'] if len(polygon) >= 6]
+        annotations[file_name][2].append(
+            (annotation['id'], categories.get(annotation['category_id'], ''), polygons))
+    return annotations
+
+
+# Find the annotation file in labels_dir that labels image_name, or None
+def find_labels(image_name, labels_dir=LABELS_DIR):
+    for path in sorted(glob.glob(os.path.join(labels_dir, '*.json'))):
+        if os.path.basename(image_name) in _annotations(path, os.path.getmtime(path)):
+            return path
+    return None
+
+
+@lru_cache(maxsize=8)
+def _annotations(path, mtime):
+    return load_annotations(path)
+
+
+@lru_cache(maxsize=16)
+def _label_image(path, mtime, file_name, height, width):
+    import cv2
+    annotated_width, annotated_height, plants = _annotations(path, mtime)[file_name]
+    # Polygons are scaled to the image, so downscaled copies of the annotated photo share the labels
+    scale = np.array([width / annotated_width, height / annotated_height])
+    labels = np.zeros((height, width), dtype=np.uint8 if len(plants) < 255 else np.int32)
+    for index, (_, _, polygons) in enumerate(plants, start=1):
+        cv2.fillPoly(labels, [np.round(polygon * scale).astype(np.int32) for polygon in polygons], index)
+    # Pixels per plant, overlapping polygons go to the plant listed last
+    plant_pixels = np.bincount(labels.ravel(), minlength=len(plants) + 1)
+    labels.flags.writeable = False
+    return labels, plant_pixels, [(annotation_id, category) for annotation_id, category, _ in plants]
+
+
+# Rasterized label image of file_name for an image of the given (height, width), cached per
+# annotation file version. Returns (labels, pixels per label, [(annotation id, category)]).
+def label_image(path, file_name, shape):
+    return _label_image(path, os.path.getmtime(path), os.path.basename(file_name), shape[0], shape[1])
+
+
+# Green pixels of every plant (index 0 is the background) from a full mask in a single pass
+def count_plant_pixels(mask, labels, n_plants):
+    return np.bincount(labels[mask != 0], minlength=n_plants + 1)
+
+
+# Same as count_plant_pixels but thresholds the image strip by strip, without a full-frame mask
+def count_plant_pixels_tiled(image_array, labels, n_plants, lower=LOWER_GREEN, upper=UPPER_GREEN,
+                             tile_pixels=TILE_PIXELS):
+    lower, upper = np.array(lower), np.array(upper)
+    rows = strip_rows(image_array.shape[1], tile_pixels)
+    counts = np.zeros(n_plants + 1, dtype=np.int64)
+    for top in range(0, image_array.shape[0], rows):
+        _, strip_mask = _count_tile(image_array[top:top + rows], lower, upper)
+        counts += count_plant_pixels(strip_mask, labels[top:top + rows], n_plants)
+    return counts
+
+
+# Result rows (see COLUMNS) from the per-label green pixel counts
+def plant_rows(image_name, green_pixels, plant_pixels, plants, scaling_factor=SCALING_FACTOR):
+    day = parse_day(image_name)
+    rows = []
+    for index, (annotation_id, _) in enumerate(plants, start=1):
+        coverage = 100 * green_pixels[index] / plant_pixels[index] if plant_pixels[index] else 0.0
+        rows.append((image_name, day, annotation_id, plant_pixels[index] / scaling_factor,
+                     green_pixels[index] / scaling_factor, coverage))
+    return rows
+
+
+# Per-plant rows for an already computed (e.g. cached) green mask
+def measure_plants_from_mask(mask, image_name, labels_path, file_name=None, scaling_factor=SCALING_FACTOR):
+    labels, plant_pixels, plants = label_image(labels_path, file_name or image_name, mask.shape)
+    green_pixels = count_plant_pixels(mask, labels, len(plants))
+    return plant_rows(image_name, green_pixels, plant_pixels, plants, scaling_factor)
+
+
+# Per-plant rows for an image file, thresholded tile by tile
+def measure_plants(path, labels_path, file_name=None, lower=LOWER_GREEN, upper=UPPER_GREEN,
+                   scaling_factor=SCALING_FACTOR, tile_pixels=TILE_PIXELS):
+    image_array = open_rgb_array(path)
+    image_name = os.path.basename(path)
+    labels, plant_pixels, plants = label_image(labels_path, file_name or image_name, image_array.shape)
+    green_pixels = count_plant_pixels_tiled(image_array, labels, len(plants), lower, upper, tile_pixels)
+    return plant_rows(image_name, green_pixels, plant_pixels, plants, scaling_factor)
+
+
+def main(argv=None):
+    from core.batch import collect_images
+
+    parser = argparse.ArgumentParser(description="Estimate the canopy coverage of every annotated plant.")
+    parser.add_argument("sources", nargs="+", help="image directories, files or glob patterns")
+    parser.add_argument("-o", "--output", default="-", help="output CSV file (default: stdout)")
+    parser.add_argument("--labels", default=None,
+                        help="COCO annotation file (default: the file in data/annotate_labels naming each image)")
+    parser.add_argument("--file-name", default=None,
+                        help="annotated image whose polygons apply to all images, e.g. a fixed tray camera")
+    parser.add_argument("--scaling-factor", type=float, default=SCALING_FACTOR,
+                        help="pixels per cm² obtained from calibration")
+    args = parser.parse_args(argv)
+
+    paths = collect_images(args.sources)
+    if not paths:
+        parser.error("no images found")
+
+    output = open(args.output, "w", newline="", encoding="utf-8") if args.output != "-" else sys.stdout
+    writer = csv.writer(output)
+    writer.writerow(COLUMNS)
+    measured = 0
+    try:
+        for path in paths:
+            labels_path = args.labels or find_labels(args.file_name or path)
+            if labels_path is None:
+                print(f"Skipping {path}: no annotations", file=sys.stderr)
+                continue
+            try:
+                rows = measure_plants(path, labels_path, args.file_name, scaling_factor=args.scaling_factor)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Skipping {path}: {e!r}", file=sys.stderr)
+                continue
+            writer.writerows(rows)
+            measured += 1
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    return 0 if measured else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
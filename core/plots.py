@@ -0,0 +1,59 @@
+# Music Analysis plots rendered as PNG images sized to the page. The waveform is drawn as a min/max
+# envelope with one pair per pixel column and the spectrogram is pooled to one frame per pixel
+# column, so render time no longer grows with the track length. Figures are built with the
+# object-oriented API and never enter pyplot's global figure registry, so nothing lingers after a run.
+from io import BytesIO
+
+import numpy as np
+
+from core.feature_store import pool_frames
+
+DISPLAY_WIDTH = 704  # px, the main column of Streamlit's centered layout
+PLOT_HEIGHT = 320
+DPI = 100
+
+
+# Reduce a min/max envelope to at most `points` pairs, keeping the extremes of every bucket
+def decimate_envelope(env_min, env_max, times, points):
+    if len(env_min) <= points:
+        return env_min, env_max, times
+    starts = np.linspace(0, len(env_min), points, endpoint=False).astype(int)
+    return np.minimum.reduceat(env_min, starts), np.maximum.reduceat(env_max, starts), times[starts]
+
+
+def _new_axes(width, height):
+    from matplotlib.figure import Figure
+    fig = Figure(figsize=(width / DPI, height / DPI), dpi=DPI)
+    return fig, fig.add_subplot()
+
+
+def _to_png(fig):
+    buf = BytesIO()
+    fig.savefig(buf, format='png', dpi=DPI)
+    fig.clear()
+    return buf.getvalue()
+
+
+# PNG of the waveform envelope (see core.feature_store.waveform_envelope)
+def render_waveform(env_min, env_max, times, width=DISPLAY_WIDTH, height=PLOT_HEIGHT):
+    env_min, env_max, times = decimate_envelope(env_min, env_max, times, width)
+    fig, ax = _new_axes(width, height)
+    ax.fill_between(times, env_min, env_max, color='purple', step='post')
+    ax.set_xlabel('Time (s)')
+    ax.set_title('Waveform')
+    fig.tight_layout()
+    return _to_png(fig)
+
+
+# PNG of a dB spectrogram pooled to the display width, `times` are the frame times in seconds
+def render_spectrogram(S_dB, times, sr, width=DISPLAY_WIDTH, height=PLOT_HEIGHT):
+    import librosa.display
+    S_dB, frames = pool_frames(S_dB, width)
+    # pool_frames returns fractional frame positions, map them onto the original frame times
+    times = np.interp(frames, np.arange(len(times)), times)
+    fig, ax = _new_axes(width, height)
+    img = librosa.display.specshow(S_dB, sr=sr, x_coords=times, y_axis='log', x_axis='time', ax=ax)
+    ax.set_title('Spectrogram')
+    fig.colorbar(img, ax=ax, format="%+2.0f dB")
+    fig.tight_layout()
+    return _to_png(fig)
@@ -0,0 +1,37 @@
+# Downscaled previews for the browser, the full resolution images are only encoded on demand
+from io import BytesIO
+
+from PIL import Image
+
+PREVIEW_WIDTH = 800
+PREVIEW_QUALITY = 80
+
+
+def _preview_size(size, max_width):
+    width, height = size
+    if width <= max_width:
+        return width, height
+    return max_width, max(1, round(height * max_width / width))
+
+
+# Downscaled JPEG (or WebP) of encoded image bytes. For JPEGs the decoder itself skips to the
+# nearest 1/2, 1/4 or 1/8 scale above the preview size, so the full frame is never decoded.
+def image_preview(image_bytes, max_width=PREVIEW_WIDTH, format='JPEG', quality=PREVIEW_QUALITY):
+    image = Image.open(BytesIO(image_bytes))
+    size = _preview_size(image.size, max_width)
+    image.draft('RGB', size)
+    image = image.convert('RGB')
+    image.thumbnail(size, Image.Resampling.LANCZOS)
+    buf = BytesIO()
+    image.save(buf, format=format, quality=quality, optimize=True)
+    return buf.getvalue()
+
+
+# Downscaled mask as a 1 bit per pixel PNG
+def mask_preview(mask, max_width=PREVIEW_WIDTH):
+    image = Image.fromarray(mask)
+    image.thumbnail(_preview_size(image.size, max_width), Image.Resampling.BOX)
+    image = image.point(lambda value: 255 if value >= 128 else 0).convert('1', dither=Image.Dither.NONE)
+    buf = BytesIO()
+    image.save(buf, format='PNG', optimize=True)
+    return buf.getvalue()
@@ -0,0 +1,90 @@
+# Warm up the slow first calls ahead of time: numba compilation of librosa's kernels and of the fused
+# HSV kernel, the mask cache of the default images and the music feature store.
+#
+# Usage (done at image build time, see Dockerfile):
+#   NUMBA_CACHE_DIR=.cache/numba PLANTAMUSICA_MASK_CACHE_DIR=.cache/masks python -m core.warmup
+import argparse
+import os
+import sys
+import threading
+import time
+
+DEFAULT_IMAGES = ["images/Day20.jpg", "images/Day22.jpg", "images/Day24.jpg", "images/Day26.jpg", "images/Day28.jpg"]
+
+
+# Run the librosa calls of the Music Analysis page on a short synthetic signal. librosa's numba
+# kernels are compiled with cache=True, so with NUMBA_CACHE_DIR set this also fills the disk cache.
+def warm_librosa():
+    import numpy as np
+    import librosa
+    import librosa.display  # noqa: F401 (slow import, done here instead of on the first page view)
+
+    sr = 22050
+    t = np.arange(sr * 5) / sr
+    y = (0.3 * np.sin(2 * np.pi * 220 * t) + 0.5 * (np.mod(t, 0.5) < 0.02)).astype(np.float32)
+    librosa.beat.beat_track(y=y, sr=sr)
+    librosa.amplitude_to_db(np.abs(librosa.stft(y)), ref=np.max)
+
+
+# Compile the fused HSV kernel (core/hsv.py) for the array layouts the pages and the batch CLI pass
+# in; with NUMBA_CACHE_DIR set the machine code is kept on disk
+def warm_hsv_kernel():
+    import numpy as np
+    from core.canopy import LOWER_GREEN, UPPER_GREEN, _fused_kernel
+    count_in_range = _fused_kernel()
+    if count_in_range is None:
+        return
+    image = np.zeros((2, 2, 3), dtype=np.uint8)
+    read_only = image.copy()
+    read_only.flags.writeable = False
+    mask = np.empty((2, 2), dtype=np.uint8)
+    for array in (image, read_only, np.zeros((2, 2, 4), dtype=np.uint8)[..., :3]):
+        count_in_range(array, LOWER_GREEN, UPPER_GREEN)
+        count_in_range(array, LOWER_GREEN, UPPER_GREEN, mask)
+
+
+# Compute the masks of the default images into the on-disk mask cache
+def warm_mask_cache(cache_dir, paths=DEFAULT_IMAGES):
+    from core.canopy import MaskCache, analyze_image_bytes
+    cache = MaskCache(cache_dir=cache_dir)
+    for path in paths:
+        with open(path, 'rb') as f:
+            analyze_image_bytes(f.read(), cache)
+
+
+# Warm librosa up in a daemon thread so the first visit of the Music Analysis page doesn't pay for it
+def start_background_warmup():
+    thread = threading.Thread(target=warm_librosa, name="plantamusica-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Warm up numba kernels, the mask cache and the feature store.")
+    parser.add_argument("--mask-cache-dir", default=os.environ.get("PLANTAMUSICA_MASK_CACHE_DIR"),
+                        help="mask cache directory to fill (default: $PLANTAMUSICA_MASK_CACHE_DIR)")
+    parser.add_argument("--music-dir", default=os.path.join('data', 'music_file'),
+                        help="audio files to build the feature store from, skipped when missing")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    warm_librosa()
+    print(f"Warmed up librosa in {time.perf_counter() - start:.1f}s "
+          f"(numba cache: {os.environ.get('NUMBA_CACHE_DIR', 'next to the librosa sources')})", file=sys.stderr)
+
+    start = time.perf_counter()
+    warm_hsv_kernel()
+    print(f"Compiled the HSV kernel in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+    if args.mask_cache_dir:
+        warm_mask_cache(args.mask_cache_dir)
+        print(f"Cached the default image masks in {args.mask_cache_dir}", file=sys.stderr)
+
+    if os.path.isdir(args.music_dir):
+        from core.feature_store import build_store
+        build_store(args.music_dir)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,5 @@
-from collections import namedtuple
 import altair as alt
-import math
+import numpy as np
 import pandas as pd
 import streamlit as st
 
@@ -16,22 +15,25 @@ In the meantime, below is an example of what you can do with the current Planta
 """
 
 with st.echo(code_location='below'):
-   total_points = st.slider("Number of points in spiral", 1, 5000, 2000)
-   num_turns = st.slider("Number of turns in spiral", 1, 100, 9)
-
-   Point = namedtuple('Point', 'x y')
-   data = []
+   # Altair embeds every row in the page, so larger spirals are downsampled before charting. Only the
+   # charted points are computed and cached, never the full spiral.
+   MAX_CHART_POINTS = 5000
+
+   @st.cache_data(max_entries=32)
+   def spiral(total_points, num_turns):
+      step = -(-total_points // MAX_CHART_POINTS)  # ceiling division
+      curr_point_num = np.arange(0, total_points, step)
+      points_per_turn = total_points / num_turns
+      curr_turn, i = np.divmod(curr_point_num, points_per_turn)
+      angle = (curr_turn + 1) * 2 * np.pi * i / points_per_turn
+      radius = curr_point_num / total_points
+      return pd.DataFrame({'x': radius * np.cos(angle), 'y': radius * np.sin(angle)})
 
-   points_per_turn = total_points / num_turns
+   total_points = st.slider("Number of points in spiral", 1, 2_000_000, 2000)
+   num_turns = st.slider("Number of turns in spiral", 1, 100, 9)
 
-   for curr_point_num in range(total_points):
-      curr_turn, i = divmod(curr_point_num, points_per_turn)
-      angle = (curr_turn + 1) * 2 * math.pi * i / points_per_turn
-      radius = curr_point_num / total_points
-      x = radius * math.cos(angle)
-      y = radius * math.sin(angle)
-      data.append(Point(x, y))
+   chart_data = spiral(total_points, num_turns)
 
-   st.altair_chart(alt.Chart(pd.DataFrame(data), height=500, width=500)
+   st.altair_chart(alt.Chart(chart_data, height=500, width=500)
       .mark_circle(color='#0068c9', opacity=0.5)
       .encode(x='x:Q', y='y:Q'))
@@ -1,13 +1,17 @@
 import streamlit as st
-import numpy as np
-import cv2
-from PIL import Image
+import os
 from io import BytesIO
-import pandas as pd
-import matplotlib.pyplot as plt
+from PIL import Image
+from core.canopy import DRAFT_SCALES, MaskCache, analyze_image_bytes
+from core.jobs import AnalysisQueue, iter_completed
+from core.metrics import profile_controls, render_profile, stage
+from core.plants import COLUMNS as PLANT_COLUMNS, find_labels, measure_plants_from_mask
+from core.previews import image_preview, mask_preview
 
 st.set_page_config(layout="wide", page_title="Planta Musica [alpha-version v0.2]")
 
+profile_controls(st, "canopy")
+
 st.write("## Analyze Plant Canopy Coverage and Environment Conditions")
 st.write("""
          Try uploading images to preprocess, and obtain your picked color (using ad-hoc HSV range for now) color-picker will be added later. 
@@ -29,50 +33,103 @@ MAX_FILE_SIZE = 5 * 1024 * 1024  # 5MB
 # Helper function to convert and save image
 def convert_image(img):
     buf = BytesIO()
-    img.save(buf, format=img.format)
+    img.save(buf, format=img.format or 'PNG')
     byte_im = buf.getvalue()
     return byte_im
 
-# Image processing function
-def process_image(image):
-    col1, col2 = st.columns(2)
-    col1.write("Original Image :camera:")
-    col1.image(image)
-
-    # Convert image to array and then to HSV
-    image_array = np.array(image.convert('RGB'))  # Ensure image is in RGB
-    hsv_image = cv2.cvtColor(image_array, cv2.COLOR_RGB2HSV)
-
-    # Define the range for green color in HSV and create a mask
-    lower_green = np.array([35, 50, 50])
-    upper_green = np.array([85, 255, 255])
-    mask = cv2.inRange(hsv_image, lower_green, upper_green)
+# Process-wide cache of masks and areas, keyed by image content, HSV bounds and scaling factor
+# Masks prebuilt by `python -m core.warmup` are read from PLANTAMUSICA_MASK_CACHE_DIR, new ones stay in memory
+@st.cache_resource
+def get_mask_cache():
+    return MaskCache(cache_dir=os.environ.get("PLANTAMUSICA_MASK_CACHE_DIR"), read_only=True)
+
+# Reduced resolution decoding of JPEGs, the area is scaled back to the full resolution calibration
+# (error below 1% at 1/8 on the Day images, see `python -m benchmarks.draft`)
+draft_scale = st.sidebar.selectbox("Decode resolution", DRAFT_SCALES,
+                                   format_func=lambda scale: "Full" if scale == 1 else f"1/{scale} (faster)")
+
+# Threshold the image in HSV (or reuse the cached result for identical content) and encode downscaled previews
+def compute_previews(image_bytes, draft_scale, mask_cache):
+    mask, pixel_area, green_area_cm2 = analyze_image_bytes(image_bytes, cache=mask_cache, draft_scale=draft_scale)
+    with stage('preview_encode'):
+        return image_preview(image_bytes), mask_preview(mask), green_area_cm2
+
+# Cached by content so a rerun neither recomputes nor re-encodes anything
+@st.cache_data(max_entries=64, show_spinner=False)
+def analyze_with_previews(image_bytes, draft_scale):
+    return compute_previews(image_bytes, draft_scale, get_mask_cache())
+
+# Uploads are analyzed on a background thread pool; jobs outlive reruns, so interacting with the
+# page while a batch is running doesn't start it over
+@st.cache_resource
+def get_analysis_queue():
+    mask_cache = get_mask_cache()
+    return AnalysisQueue(lambda image_bytes, draft_scale: compute_previews(image_bytes, draft_scale, mask_cache))
+
+# Full resolution masks are only encoded when downloads are asked for
+full_quality_downloads = st.sidebar.checkbox("Prepare full quality downloads")
+
+# Record each day's canopy coverage in the growth timeseries store (read by the Data Analysis page).
+# Images are keyed by content, so only photos that are not in the store yet get added.
+save_to_growth_store = st.sidebar.checkbox("Save results to the growth store")
+
+@st.cache_resource
+def get_growth_store():
+    from core.growth_store import GrowthStore  # imports pandas, only when saving is asked for
+    return GrowthStore()
+
+# Per-plant coverage for images annotated in data/annotate_labels (e.g. plant.jpg)
+per_plant_coverage = st.sidebar.checkbox("Per-plant coverage (annotated images)")
+
+# Count the green pixels of every annotated plant in one pass over the cached mask
+@st.cache_data(max_entries=64, show_spinner=False)
+def analyze_plants(image_bytes, image_name, labels_path):
+    mask, _, _ = analyze_image_bytes(image_bytes, cache=get_mask_cache())
+    return measure_plants_from_mask(mask, image_name, labels_path)
 
-    # Convert mask back to an image for display
-    mask_image = Image.fromarray(mask)
-    processed_image = mask_image
-
-    col2.write("Processed Image :wrench:")
-    col2.image(processed_image, use_column_width=True)
-    return processed_image, image_array  # Return both processed mask and original RGB array
+# Image processing function
+def process_image(image_bytes, image_name, index, result=None):
+    with stage('analyze'):
+        original_preview, processed_preview, green_area_cm2 = result or analyze_with_previews(image_bytes, draft_scale)
 
-# Function to calculate Canopy Coverage in pixels
-def get_area_in_pixels(mask):
-    # Calculate the Canopy Coverage pixels directly from the mask
-    green_area_pixels = np.sum(mask == 255)
-    return green_area_pixels
+    col1, col2 = st.columns(2)
+    with stage('st_image'):
+        col1.write("Original Image :camera:")
+        col1.image(original_preview)
+        col2.write("Processed Image :wrench:")
+        col2.image(processed_preview, use_column_width=True)
+
+    if full_quality_downloads:
+        # Always the full resolution mask, whatever the decode resolution of the previews
+        mask, _, _ = analyze_image_bytes(image_bytes, cache=get_mask_cache())
+        with stage('download_encode'):
+            mask_png = convert_image(Image.fromarray(mask))
+        st.sidebar.download_button(
+            label=f"Download processed {image_name}",
+            data=mask_png,
+            file_name=f"{os.path.splitext(image_name)[0]}_mask.png",
+            mime='image/png',
+            key=f"download_{image_name}_{index}")
+    labels_path = find_labels(image_name) if per_plant_coverage else None
+    if labels_path is not None:
+        import pandas as pd
+        with stage('per_plant'):
+            plants_df = pd.DataFrame(analyze_plants(image_bytes, image_name, labels_path), columns=PLANT_COLUMNS)
+        st.write(f"Per-plant coverage of {image_name}", plants_df.drop(columns=["Image Name", "Day"]))
+    if save_to_growth_store:
+        with stage('growth_store'):
+            get_growth_store().ingest_image(image_bytes, image_name, cache=get_mask_cache())
+    return green_area_cm2  # Return the Canopy Coverage in cm²
 
 # Automatically analyze the default images at the beginning
 default_images_paths = ["images/Day20.jpg", "images/Day22.jpg", "images/Day24.jpg","images/Day26.jpg","images/Day28.jpg"]
 canopy_areas = []
 image_names = []
 
-for image_path in default_images_paths:
-    image = Image.open(image_path)
-    processed_image, original_image = process_image(image)
-    pixel_area = get_area_in_pixels(np.array(processed_image))
-    scaling_factor = 4096  # obtained from calibration
-    green_area_cm2 = pixel_area / scaling_factor
+for index, image_path in enumerate(default_images_paths):
+    with open(image_path, 'rb') as f:
+        image_bytes = f.read()
+    green_area_cm2 = process_image(image_bytes, image_path.split('/')[-1], index)
     canopy_areas.append(green_area_cm2)
     image_names.append(image_path.split('/')[-1])
 
@@ -84,26 +141,45 @@ for image_path in default_images_paths:
 uploaded_files = st.sidebar.file_uploader("Upload images", type=["png", "jpg", "jpeg"], accept_multiple_files=True)
 
 if uploaded_files:
+    # Queue every upload first, then show each one as soon as its job finishes
+    queue = get_analysis_queue()
+    uploads = []
     for uploaded_file in uploaded_files:
         if uploaded_file.size > MAX_FILE_SIZE:
             st.error(f"The file {uploaded_file.name} is too large. Please upload an image smaller than 5MB.")
         else:
-            # Process each image and display
-            image = Image.open(uploaded_file)
-            processed_image, original_image = process_image(image)
-            pixel_area = get_area_in_pixels(np.array(processed_image))
-            scaling_factor = 4096  # obtained from calibration
-            green_area_cm2 = pixel_area / scaling_factor
+            image_bytes = uploaded_file.getvalue()
+            uploads.append((uploaded_file.name, image_bytes, queue.submit(image_bytes, draft_scale)))
+
+    progress = st.progress(0.0)
+    slots = [st.container() for _ in uploads]
+    upload_areas = [None] * len(uploads)
+    for done, (i, future) in enumerate(iter_completed([job for _, _, job in uploads]), start=1):
+        name, image_bytes, _ = uploads[i]
+        progress.progress(done / len(uploads), text=f"Processed {done} of {len(uploads)} uploads")
+        with slots[i]:
+            try:
+                result = future.result()
+            except Exception as e:
+                st.error(f"Could not process {name}: {e}")
+                continue
+            # Display each image and its green area
+            upload_areas[i] = process_image(image_bytes, name, len(default_images_paths) + i, result)
+            st.write(f"The Canopy Coverage for {name} is {upload_areas[i]} cm²")
+
+    for (name, _, _), green_area_cm2 in zip(uploads, upload_areas):
+        if green_area_cm2 is not None:
             canopy_areas.append(green_area_cm2)
-            image_names.append(uploaded_file.name)
-
-            # Display the green area for each image
-            st.write(f"The Canopy Coverage for {uploaded_file.name} is {green_area_cm2} cm²")
+            image_names.append(name)
 else:
     st.warning("Please upload an image or images to continue.")
 
 # If there are results, display them in a table and plot
 if canopy_areas:
+    # pandas and matplotlib are only imported here so the images above render before they load
+    import pandas as pd
+    import matplotlib.pyplot as plt
+
     # Create a DataFrame for displaying results in a table
     results_df = pd.DataFrame({
         "Image Name": image_names,
@@ -114,14 +190,18 @@ if canopy_areas:
     st.write("### Canopy Coverage Results", results_df)
     
     # Plot the results
-    fig, ax = plt.subplots()
-    ax.bar(image_names, canopy_areas, color='green')
-    ax.set_xlabel('Image Name')
-    ax.set_ylabel('Canopy Coverage (cm²)')
-    ax.set_title('Canopy Coverage of Plants')
-    ax.set_xticklabels(image_names, rotation=45, ha='right')
-    plt.tight_layout()
-    st.pyplot(fig)
+    with stage('plot'):
+        fig, ax = plt.subplots()
+        ax.bar(image_names, canopy_areas, color='green')
+        ax.set_xlabel('Image Name')
+        ax.set_ylabel('Canopy Coverage (cm²)')
+        ax.set_title('Canopy Coverage of Plants')
+        ax.set_xticklabels(image_names, rotation=45, ha='right')
+        plt.tight_layout()
+        st.pyplot(fig)
+        plt.close(fig)  # pyplot keeps every figure alive until it is closed
 
 # Button to rerun the app (triggers a rerun of the script)
-st.button("Re-run")
\ No newline at end of file
+st.button("Re-run")
+
+render_profile(st)
@@ -1,12 +1,17 @@
 import streamlit as st
 import pandas as pd
 import altair as alt
-from sklearn.metrics import r2_score
 import numpy as np
 import os
-from io import StringIO
+from core.datasets import Dataset, compact_dtypes, content_hash, read_csv_compact
+from core.fitting import MAX_DEGREE, fit_matrix, format_polynomial, r2_score
+from core.growth_store import DEFAULT_PATH as GROWTH_STORE_PATH, GrowthStore
+from core.metrics import profile_controls, render_profile, stage
+from core.model_selection import best_degree, model_selection, resampling_executor
 
 st.set_page_config(page_title="Extract Environment Condition", page_icon="🌍")
+
+profile_controls(st, "data_analysis")
 st.markdown("# Environment Condition")
 st.sidebar.header("Environment Related Data")
 st.write(
@@ -16,40 +21,68 @@ st.write(
 # Define the relative path to the file
 data_file_path = os.path.join('data', 'day_full_df.csv')
 
-if not os.path.exists(data_file_path):
+# Growth timeseries store filled from the Estimate Canopy Coverage page or `python -m core.growth_store`.
+# It may only hold canopy rows, so it is an explicit choice and the bundled CSV stays the default.
+first_day = last_day = None
+if os.path.exists(GROWTH_STORE_PATH):
+    growth_store = GrowthStore(GROWTH_STORE_PATH)
+    first_day, last_day = growth_store.day_range()
+data_sources = [name for name, available in (('Bundled CSV', os.path.exists(data_file_path)),
+                                             ('Growth store', first_day is not None)) if available]
+if not data_sources:
     st.error("File not found. Please check the file path.")
     st.stop()
+data_source = st.sidebar.radio("Data source", data_sources) if len(data_sources) > 1 else data_sources[0]
+
+# Parsed datasets (frame, CSV bytes and column statistics) are shared by content key, so changing the
+# axes or the degree never parses or serializes the data again. Never modify dataset.frame.
+@st.cache_resource(max_entries=8, show_spinner="Loading data...")
+def load_dataset(key, _read):
+    with stage('load_dataset'):
+        return Dataset(key, _read())
+
+def read_default_csv():
+    return read_csv_compact(data_file_path, columns=[
+        'Day', 'Air Temp Low (°C)', 'Air Temp Mean (°C)', 'Air Temp High (°C)', 'Air Humid Low (%)',
+        'Air Humid Mean (%)', 'Air Humid High (%)', 'Water Temp Low (°C)', 'Water Temp Mean (°C)',
+        'Water Temp High (°C)', 'Water Humid Low (°C)', 'Water Humid Mean (°C)',
+        'Water Humid High (%)', 'Canopy Coverage (cm²)', 'Water Consumption (mL)', 'Seed Count'])
+
+# Hash each upload once per session instead of on every rerun
+def upload_key(uploaded_file):
+    upload_hashes = st.session_state.setdefault('upload_hashes', {})
+    upload_id = getattr(uploaded_file, 'file_id', None) or getattr(uploaded_file, 'id', None)
+    if upload_id not in upload_hashes:
+        upload_hashes[upload_id] = content_hash(uploaded_file.getvalue())
+    return 'upload', upload_hashes[upload_id]
 
 # Upload .csv file or use default
 uploaded_file = st.sidebar.file_uploader("Upload your CSV file", type=["csv"])
 if uploaded_file is not None:
-    df = pd.read_csv(uploaded_file)
+    dataset = load_dataset(upload_key(uploaded_file), lambda: read_csv_compact(uploaded_file.getvalue()))
+elif data_source == 'Growth store':
+    # Indexed range query by day instead of parsing a whole CSV
+    day_min, day_max = first_day, last_day
+    if first_day < last_day:
+        day_min, day_max = st.sidebar.slider("Days", first_day, last_day, (first_day, last_day))
+    dataset = load_dataset(('growth_store', os.path.getmtime(GROWTH_STORE_PATH), day_min, day_max),
+                           lambda: compact_dtypes(growth_store.daily_table(day_min, day_max)))
 else:
-    df = pd.read_csv(data_file_path)
-    df.columns = ['Day', 'Air Temp Low (°C)', 'Air Temp Mean (°C)', 'Air Temp High (°C)', 'Air Humid Low (%)',
-                  'Air Humid Mean (%)', 'Air Humid High (%)', 'Water Temp Low (°C)', 'Water Temp Mean (°C)',
-                  'Water Temp High (°C)', 'Water Humid Low (°C)', 'Water Humid Mean (°C)',
-                  'Water Humid High (%)', 'Canopy Coverage (cm²)', 'Water Consumption (mL)', 'Seed Count']
-    # Convert columns to numeric and handle NaNs
-    # df['Air Temp Mean (°C)'] = pd.to_numeric(df['Air Temp Mean (°C)'], errors='coerce')
-    # df['Canopy Coverage (cm²)'] = pd.to_numeric(df['Canopy Coverage (cm²)'], errors='coerce')
-    # df.dropna(inplace=True)
-
-
+    dataset = load_dataset(('file', data_file_path, os.path.getmtime(data_file_path)), read_default_csv)
 
 # Option for manual data entry
 st.sidebar.header("Or enter data manually:")
 data_string = st.sidebar.text_area("Enter CSV data (expand the space as needed for visibility):", "Property_1,Property_2\n20,10\n25,15")
 if st.sidebar.button('Load Data & Plot'):
     
-    data_io = StringIO(data_string)
-    df = pd.read_csv(data_io)
-    
-# Convert DataFrame to CSV string for download
-csv = df.to_csv(index=False)
+    data_bytes = data_string.encode('utf-8')
+    dataset = load_dataset(('text', content_hash(data_bytes)), lambda: read_csv_compact(data_bytes))
+df = dataset.frame
+
+# CSV for download, serialized once per dataset
 st.sidebar.download_button(
    label="Download CSV",
-   data=csv,
+   data=dataset.csv_bytes,
    file_name='environment_data.csv',
    mime='text/csv')
 
@@ -66,50 +99,43 @@ y_column = st.sidebar.selectbox('Select Y axis column:', df.columns, index=defau
 
 
 # Sidebar configuration for polynomial degree
-degree = st.sidebar.slider('Select the polynomial degree:', 1, 10, 3)
+degree = st.sidebar.slider('Select the polynomial degree:', 1, MAX_DEGREE, 3)
 
-# Formatting the polynomial equation
-def format_polynomial(coeffs):
-    terms = []
-    degree = len(coeffs) - 1
-    for i, coeff in enumerate(coeffs):
-        if coeff == 0:
-            continue
-        exponent = degree - i
-        if exponent == 0:
-            terms.append(f"{coeff:.2f}")
-        elif exponent == 1:
-            terms.append(f"{coeff:.2f}x")
-        else:
-            terms.append(f"{coeff:.2f}x^{exponent}")
-    return " + ".join(terms).replace("+ -", "- ")
-
-
-
-# Perform polynomial fitting
+# Perform polynomial fitting on the values as parsed, in float64. Rows where either value is missing
+# or was not a number (coerce_numeric turns "n/a" into NaN) are left out: with a single NaN,
+# np.polyfit silently returns NaN coefficients.
 try:
-    coefficients = np.polyfit(df[x_column], df[y_column], degree)
-    polynomial = np.poly1d(coefficients)
+    with stage('polyfit'):
+        x_values = dataset.column(x_column)
+        y_values = dataset.column(y_column)
+        finite = np.isfinite(x_values) & np.isfinite(y_values)
+        x_values, y_values = x_values[finite], y_values[finite]
+        if len(x_values) == 0:
+            raise ValueError(f"no rows with numeric values in both {x_column} and {y_column}")
+        coefficients = np.polyfit(x_values, y_values, degree)
+        polynomial = np.poly1d(coefficients)
 except Exception as e:
     st.error(f"Failed to fit polynomial: {str(e)}")
     st.stop()
 
 # Generate x values for plotting the fit curve
-min_x = df[x_column].min()
-max_x = df[x_column].max()
+min_x, max_x = dataset.bounds(x_column)
 x_fit = np.linspace(min_x, max_x, 100)
 y_fit = polynomial(x_fit)
 
+# Evaluate the fit once, it is used for the plot and the R-squared value
+fitted = polynomial(x_values)
+
 # Prepare data for plotting
 plot_df = pd.DataFrame({
-    'X': df[x_column],
-    'Y': df[y_column],
-    'Fit': polynomial(df[x_column])
+    'X': x_values,
+    'Y': y_values,
+    'Fit': fitted
 })
 
 # Adjust domain dynamically based on the data
-x_min, x_max = plot_df['X'].min(), plot_df['X'].max()
-y_min, y_max = plot_df['Y'].min(), plot_df['Y'].max()
+x_min, x_max = min_x, max_x
+y_min, y_max = dataset.bounds(y_column)
 
 # Apply this new domain to the chart
 points = alt.Chart(plot_df).mark_point(color='green', opacity=0.5, size=100).encode(
@@ -125,17 +151,76 @@ fit_line = alt.Chart(plot_df).mark_line(color='blue', size=3).encode(
 
 
 
-# Combine charts
+# Resampling workers shared by all sessions. They are started by a forkserver (or spawned), never
+# forked from the server's threads, and only import core.model_selection.
+@st.cache_resource
+def get_resampling_pool():
+    return resampling_executor(min(4, os.cpu_count() or 1))
+
+# Cross-validation and bootstrap of every degree for a column pair, computed once per dataset
+@st.cache_data(max_entries=32, show_spinner="Cross-validating and bootstrapping degrees 1-10...")
+def cached_model_selection(dataset_key, x_column, y_column, _x, _y, _grid):
+    pool = get_resampling_pool()
+    return model_selection(_x, _y, grid=_grid, pool=pool)
+
+selection = None
+if st.sidebar.checkbox("Model selection (cross-validation and bootstrap)"):
+    try:
+        with stage('model_selection'):
+            selection = cached_model_selection(dataset.key, x_column, y_column, x_values, y_values, x_fit)
+    except ValueError as e:
+        st.warning(f"Model selection skipped: {e}")
+
+# Combine charts, with the 95% bootstrap band of the selected degree when model selection is on
 chart = points + fit_line
-st.altair_chart(chart, use_container_width=True)
+if selection is not None:
+    selection_table, grid, bands = selection
+    band_df = pd.DataFrame({'X': grid, 'Lower': bands[degree - 1, 0], 'Upper': bands[degree - 1, 1]})
+    band = alt.Chart(band_df.dropna()).mark_area(color='blue', opacity=0.2, clip=True).encode(
+        x='X:Q',
+        y='Lower:Q',
+        y2='Upper:Q'
+    )
+    chart = band + chart
+with stage('chart'):
+    st.altair_chart(chart, use_container_width=True)
 
 # Calculate the R-squared value
-r_squared = r2_score(df[y_column], polynomial(df[x_column]))
+r_squared = r2_score(y_values, fitted)
 
 # Formatting the polynomial equation
 polynomial_str = format_polynomial(polynomial.coefficients)
 st.write(f"Polynomial equation: {polynomial_str}")
 st.write(f"$R^2$: {r_squared:.3f}")
+
+if selection is not None:
+    st.markdown("## Model Selection")
+    best = best_degree(selection_table)
+    if best is not None:
+        st.write(f"Lowest cross-validated error: degree {best}. The selected degree {degree} has a "
+                 f"cross-validated RMSE of {selection_table.at[degree - 1, 'CV RMSE']:.3g}.")
+    st.caption("RMSE on held-out rows over 20 repeats of 5-fold cross-validation and on the out-of-bag rows of "
+               "1000 bootstrap resamples. The band on the plot is the 95% percentile band of the bootstrap fits.")
+    st.dataframe(selection_table, use_container_width=True, hide_index=True)
+
+# Fit matrix: every numeric column pair for every degree in one batched least-squares pass
+@st.cache_data(max_entries=8)
+def cached_fit_matrix(dataset_key, _df):
+    return fit_matrix(_df)
+
+if st.sidebar.checkbox("Show fit matrix (all column pairs and degrees)"):
+    st.markdown("## Fit Matrix")
+    with stage('fit_matrix'):
+        fit_table = cached_fit_matrix(dataset.key, df)
+    only_selected_y = st.checkbox(f"Only fits of {y_column}", value=True)
+    if only_selected_y:
+        fit_table = fit_table[fit_table['Y'] == y_column]
+    st.dataframe(fit_table, use_container_width=True)
+    st.download_button(
+        label="Download fit matrix",
+        data=fit_table.to_csv(index=False),
+        file_name='fit_matrix.csv',
+        mime='text/csv')
 # # For Debug
 # st.write(df[x_column][:3])
 # st.write(df[y_column][:3])
@@ -148,6 +233,8 @@ st.write(f"$R^2$: {r_squared:.3f}")
 
 
 
+render_profile(st)
+
 # Button to rerun the app (triggers a rerun of the script)
 if st.button("Re-run"):
     st.experimental_rerun()
@@ -1,11 +1,18 @@
 import streamlit as st
+import hashlib
 import os
-import librosa
-import librosa.display
-import matplotlib.pyplot as plt
 import numpy as np
+from io import BytesIO
+from core.assets import AssetStore, load_audio
+from core.audio import PROFILES, audio_duration, file_blocks, load_audio_bytes
+from core.feature_files import feature_path, load_features
+from core.feature_store import extract_features, stream_features
+from core.metrics import profile_controls, render_profile, stage
+from core.plots import DISPLAY_WIDTH, render_spectrogram, render_waveform
 
 st.set_page_config(page_title="Music Analysis", page_icon="🎵")
+
+profile_controls(st, "music_analysis")
 st.markdown("# Music Analysis")
 st.sidebar.header("Music Analysis")
 
@@ -47,37 +54,98 @@ uploaded_file = st.sidebar.file_uploader("Or upload your MP3 file", type=["mp3"]
 
 data_file_path = os.path.join('data/music_file')
 
-# Path for the selected or uploaded file
+# Uploads are read once and decoded from memory, the same bytes feed the audio player
 if uploaded_file is not None:
-    audio_path = uploaded_file.name
-    with open(audio_path, 'wb') as f:
-        f.write(uploaded_file.getbuffer())  # Save file to disk for librosa
+    audio_bytes = uploaded_file.getvalue()
 else:
     audio_path = os.path.join(data_file_path, selected_file)
     st.write(f"Using sample file: {selected_file}")
+    with open(audio_path, 'rb') as f:
+        audio_bytes = f.read()
 
-# Load audio file
-y, sr = librosa.load(audio_path)
+# "fast" analyzes at a lower sample rate and time resolution, "full" at librosa's defaults
+profile = st.sidebar.selectbox("Analysis profile", ["full", "fast"],
+                               help="The fast profile decodes at 11025 Hz with a larger hop (high band up to 5.5 kHz)")
+profile_sr = PROFILES[profile]['sr']
+
+# Decoded bundled tracks are shared read-only by all sessions (see core/assets.py)
+@st.cache_resource
+def get_asset_store():
+    return AssetStore()
+
+# Decoded uploads are cached by content, so reruns don't decode them again
+@st.cache_data(max_entries=2, show_spinner="Decoding the upload...")
+def decode_upload(audio_bytes, sr):
+    return load_audio_bytes(audio_bytes, sr=sr)
+
+# Stored features are loaded once per process and shared by all sessions, never modify them
+@st.cache_resource(max_entries=16)
+def shared_features(path):
+    return load_features(path)
+
+# Precomputed features of the bundled tracks (see core/feature_store.py), decode only as a fallback
+features = None
+feature_source = 'stored'
+if uploaded_file is None:
+    features = shared_features(feature_path(selected_file))
+    if features is not None and features['profile'] != profile:
+        features = None
+
+# Long recordings are analyzed block by block straight from the file, so neither the decoded signal nor
+# its spectrogram is held in memory
+STREAMING_MIN_SECONDS = 10 * 60
+track_key = (hashlib.sha256(audio_bytes).hexdigest(), profile)
+
+@st.cache_data(max_entries=8, show_spinner="Analyzing the audio block by block...")
+def streamed_features(track_key, _open_source, sr, profile):
+    return stream_features(lambda: file_blocks(_open_source(), sr=sr), sr, profile)
+
+if features is None:
+    open_source = (lambda: BytesIO(audio_bytes)) if uploaded_file is not None else (lambda: audio_path)
+    duration = audio_duration(open_source())
+    streaming = st.sidebar.checkbox("Streaming analysis (low memory)",
+                                    value=duration is not None and duration > STREAMING_MIN_SECONDS,
+                                    help="Reads the audio in 30 s blocks instead of decoding it at once, "
+                                         "the spectrogram plot is skipped")
+    feature_source = 'streamed' if streaming else 'decoded'
+    if streaming:
+        with stage('extract_features'):
+            features = streamed_features(track_key, open_source, profile_sr, profile)
+    else:
+        # Load audio file, uploads are private to the session
+        with stage('load_audio'):
+            if uploaded_file is not None:
+                y, sr = decode_upload(audio_bytes, profile_sr)
+            else:
+                y, sr = load_audio(get_asset_store(), audio_path, sr=profile_sr)
+        with stage('extract_features'):
+            features = extract_features(y, sr, max_frames=DISPLAY_WIDTH, profile=profile)
+sr = features['sr']
+
+# Plots are rendered once per track, profile, feature source and width; the features themselves are
+# excluded from the cache key. Stored, decoded and streamed features of a track differ slightly (the
+# stored ones may come from an older extraction, the streamed ones have no spectrogram).
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def waveform_image(track_key, feature_source, width, _features):
+    return render_waveform(_features['waveform_min'], _features['waveform_max'], _features['waveform_times'], width)
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def spectrogram_image(track_key, feature_source, width, _features):
+    return render_spectrogram(_features['spectrogram'], _features['spectrogram_times'], _features['sr'], width)
 
 # Play music component
 st.markdown("## Play Selected Music")
-if uploaded_file is not None:
-    audio_bytes = uploaded_file.read()
-else:
-    with open(audio_path, 'rb') as f:
-        audio_bytes = f.read()
 st.audio(audio_bytes, format='audio/mp3')
 
 
 # Display waveform
-fig, ax = plt.subplots()
-librosa.display.waveshow(y, sr=sr, ax=ax, color='purple')
-ax.set_title('Waveform')
-st.pyplot(fig)
+with stage('waveform_plot'):
+    st.image(waveform_image(track_key, feature_source, DISPLAY_WIDTH, features))
 
 # Beat tracking
-tempo, beats = librosa.beat.beat_track(y=y, sr=sr)
-beat_times = librosa.frames_to_time(beats, sr=sr)
+tempo = features['tempo']
+beat_times = features['beat_times']
 
 # Calculate intervals between beats and statistics
 beat_intervals = np.diff(beat_times)
@@ -85,50 +153,29 @@ interval_mean = np.mean(beat_intervals)
 interval_std = np.std(beat_intervals)
 
 # Display tempo and beat interval statistics
-st.write(f"Estimated Tempo: {tempo} beats per minute (bpm)")
+st.write(f"Estimated Tempo: {tempo:.2f} beats per minute (bpm)")
 st.write(f"Average Beat Interval: {interval_mean:.2f} seconds, Std Dev: {interval_std:.2f} seconds")
 
 
-# Spectral Analysis # Perform STFT
-S = np.abs(librosa.stft(y))
-S_dB = librosa.amplitude_to_db(S, ref=np.max)
-fig, ax = plt.subplots()
-img = librosa.display.specshow(S_dB, y_axis='log', x_axis='time', ax=ax)
-ax.set_title('Spectrogram')
-fig.colorbar(img, ax=ax, format="%+2.0f dB")
-st.pyplot(fig)
+# Spectral Analysis
+if features['spectrogram'] is not None:
+    with stage('spectrogram_plot'):
+        st.image(spectrogram_image(track_key, feature_source, DISPLAY_WIDTH, features))
+else:
+    st.info("Streaming analysis is on: the audio was read block by block and the spectrogram plot is skipped.")
 
 # Spectrogram analysis
-spectral_mean = np.mean(S_dB)
-spectral_std = np.std(S_dB)
-st.write(f"Mean of Spectral Magnitude (dB): {spectral_mean:.2f}")
-st.write(f"Standard Deviation of Spectral Magnitude (dB): {spectral_std:.2f}")
-
+st.write(f"Mean of Spectral Magnitude (dB): {features['spectral_mean']:.2f}")
+st.write(f"Standard Deviation of Spectral Magnitude (dB): {features['spectral_std']:.2f}")
 
-
-
-# Get frequencies and match the length to that of S
-freqs = librosa.fft_frequencies(sr=sr, n_fft=S.shape[0] * 2 - 2)  # This adjustment ensures consistency
-
-
-# Define frequency ranges
-low_freq_range = (freqs >= 20) & (freqs <= 250)
-mid_freq_range = (freqs >= 250) & (freqs <= 2000)
-high_freq_range = (freqs >= 2000) & (freqs <= 10000)
-
-# Calculate statistics for each frequency range
-low_freq_mean = np.mean(S_dB[low_freq_range, :], axis=0).mean()
-mid_freq_mean = np.mean(S_dB[mid_freq_range, :], axis=0).mean()
-high_freq_mean = np.mean(S_dB[high_freq_range, :], axis=0).mean()
-
-low_freq_std = np.std(S_dB[low_freq_range, :], axis=0).mean()
-mid_freq_std = np.std(S_dB[mid_freq_range, :], axis=0).mean()
-high_freq_std = np.std(S_dB[high_freq_range, :], axis=0).mean()
+# Statistics for each frequency range
+low_freq_mean, low_freq_std = features['low_freq_mean'], features['low_freq_std']
+mid_freq_mean, mid_freq_std = features['mid_freq_mean'], features['mid_freq_std']
+high_freq_mean, high_freq_std = features['high_freq_mean'], features['high_freq_std']
 
 # Display frequency range statistics
 st.write(f"Low Frequency Mean (dB): {low_freq_mean:.2f}, Std Dev: {low_freq_std:.2f}")
 st.write(f"Mid Frequency Mean (dB): {mid_freq_mean:.2f}, Std Dev: {mid_freq_std:.2f}")
 st.write(f"High Frequency Mean (dB): {high_freq_mean:.2f}, Std Dev: {high_freq_std:.2f}")
 
-
-
+render_profile(st)
@@ -0,0 +1,149 @@
+import streamlit as st
+import pandas as pd
+import altair as alt
+import os
+from io import BytesIO
+from core.correlation import EXPOSURE_COLUMNS, EXPOSURE_MINUTES, MIN_SAMPLES, align_days, correlation_table, \
+    exposure_table, lagged_correlation, read_track_summary, stored_tracks
+from core.datasets import content_hash
+from core.feature_files import FEATURES_DIR
+from core.growth_store import DEFAULT_PATH as GROWTH_STORE_PATH, GrowthStore
+from core.metrics import profile_controls, render_profile, stage
+
+st.set_page_config(page_title="Music Correlations", page_icon="🔗")
+
+profile_controls(st, "music_correlations")
+st.markdown("# Music Correlations")
+st.sidebar.header("Music Correlations")
+st.write(
+    """Relate the music played to the plants with their growth and environment, day by day. Every feature pair
+    is correlated at every lag at once: a lag of 4 days compares the X value of a day with the Y value 4 days later."""
+)
+
+# Growth and environment tables, joined on their Day column
+table_paths = {
+    'music_for_plants_df': os.path.join('data', 'music_for_plants_df.csv'),
+    'day_full_df': os.path.join('data', 'day_full_df.csv'),
+}
+available = [name for name, path in table_paths.items() if os.path.exists(path)]
+if os.path.exists(GROWTH_STORE_PATH):
+    available.append('growth store')
+selected_tables = st.sidebar.multiselect("Growth and environment data", available, default=available)
+uploaded_tables = st.sidebar.file_uploader("Or add CSV files with a Day column", type=["csv"],
+                                           accept_multiple_files=True)
+
+# Play schedule: one row per track played (or minutes of it) per day
+uploaded_schedule = st.sidebar.file_uploader("Play schedule (Day, Track, Minutes)", type=["csv"])
+uploaded_summary = st.sidebar.file_uploader("Track features (`core.feature_store --summary` CSV)", type=["csv"],
+                                            help="Defaults to the feature store of the bundled tracks")
+
+# Every source is identified by a content key, so the screen below is only recomputed when the data changes
+sources = {}
+for name in selected_tables:
+    if name == 'growth store':
+        sources[name] = (('growth_store', os.path.getmtime(GROWTH_STORE_PATH)),
+                         lambda: GrowthStore(GROWTH_STORE_PATH).daily_table())
+    else:
+        path = table_paths[name]
+        sources[name] = (('file', path, os.path.getmtime(path)), lambda path=path: pd.read_csv(path))
+for uploaded_file in uploaded_tables or []:
+    data = uploaded_file.getvalue()
+    sources[os.path.splitext(uploaded_file.name)[0]] = (('upload', content_hash(data)),
+                                                        lambda data=data: pd.read_csv(BytesIO(data)))
+
+# Stored track features are read once per process
+@st.cache_resource(max_entries=4)
+def shared_tracks(features_dir, mtime):
+    return stored_tracks(features_dir)
+
+exposure = None
+if uploaded_schedule is not None:
+    if uploaded_summary is not None:
+        tracks = read_track_summary(BytesIO(uploaded_summary.getvalue()))
+    else:
+        tracks = shared_tracks(FEATURES_DIR, os.path.getmtime(FEATURES_DIR) if os.path.isdir(FEATURES_DIR) else None)
+    try:
+        exposure = exposure_table(pd.read_csv(BytesIO(uploaded_schedule.getvalue())), tracks)
+    except (ValueError, KeyError) as e:
+        st.error(f"Failed to read the play schedule: {e}")
+        st.stop()
+    sources['music exposure'] = (('schedule', content_hash(uploaded_schedule.getvalue()),
+                                  content_hash(uploaded_summary.getvalue()) if uploaded_summary else FEATURES_DIR),
+                                 lambda: exposure)
+else:
+    st.info("Upload a play schedule to add the music exposure features. Until then the growth and environment "
+            "columns are screened against each other.")
+
+if not sources:
+    st.error("Pick or upload at least one table.")
+    st.stop()
+
+max_lag = st.sidebar.slider("Largest lag (days)", 0, 14, 6)
+min_samples = st.sidebar.slider("Fewest overlapping days", 3, 15, MIN_SAMPLES)
+
+# Align the tables on the day grid and screen every pair at every lag in one vectorized pass
+@st.cache_data(max_entries=8, show_spinner="Screening correlations...")
+def screen(source_keys, _sources, with_exposure, max_lag, min_samples):
+    aligned = align_days({name: load() for name, (_, load) in _sources.items()})
+    x_columns = y_columns = list(aligned.columns)
+    if with_exposure:
+        x_columns = [EXPOSURE_MINUTES] + list(EXPOSURE_COLUMNS.values())
+        y_columns = [column for column in aligned.columns if column not in x_columns]
+    table = correlation_table(aligned, x_columns, y_columns, range(-max_lag, max_lag + 1), min_samples)
+    return aligned, x_columns, y_columns, table
+
+source_keys = tuple((name, key) for name, (key, _) in sources.items())
+try:
+    with stage('screen'):
+        aligned, x_columns, y_columns, table = screen(source_keys, sources, exposure is not None, max_lag, min_samples)
+except ValueError as e:
+    st.error(f"Failed to align the tables: {e}")
+    st.stop()
+
+step = int(aligned.index[1] - aligned.index[0]) if len(aligned) > 1 else 1
+st.write(f"{len(aligned)} days from day {aligned.index[0]} every {step} day(s), "
+         f"{len(x_columns)} × {len(y_columns)} features, lags up to {max_lag} days.")
+
+# Correlation matrix at one lag
+lags = list(range(-(max_lag // step) * step, max_lag + 1, step))
+lag = st.select_slider("Lag (days)", options=lags, value=0) if len(lags) > 1 else 0
+with stage('heatmap'):
+    r, n = lagged_correlation(aligned[x_columns].to_numpy(), aligned[y_columns].to_numpy(), [lag // step])
+    matrix = pd.DataFrame({
+        'X': [x for x in x_columns for _ in y_columns],
+        'Y': [y for _ in x_columns for y in y_columns],
+        'r': r[0].ravel(),
+        'Samples': n[0].ravel(),
+    })
+    matrix.loc[matrix['Samples'] < min_samples, 'r'] = float('nan')
+    heatmap = alt.Chart(matrix.dropna(subset=['r'])).mark_rect().encode(
+        x=alt.X('X:N', sort=x_columns, title=None),
+        y=alt.Y('Y:N', sort=y_columns, title=None),
+        color=alt.Color('r:Q', scale=alt.Scale(scheme='redblue', domain=[-1, 1])),
+        tooltip=['X', 'Y', alt.Tooltip('r:Q', format='.3f'), 'Samples']
+    )
+    st.altair_chart(heatmap, use_container_width=True)
+
+# Strongest correlations over all pairs and lags
+st.markdown("## Strongest Correlations")
+st.caption("p-values are not corrected for the number of pairs and lags screened.")
+st.dataframe(table.head(200), use_container_width=True)
+st.download_button(
+    label="Download all correlations",
+    data=table.to_csv(index=False),
+    file_name='correlations.csv',
+    mime='text/csv')
+
+# Cross-correlogram of one pair
+if not table.empty:
+    pairs = {f"{x} → {y}": (x, y) for x, y in zip(table['X'], table['Y'])}
+    x_column, y_column = pairs[st.selectbox("Pair", list(pairs))]
+    correlogram = table[(table['X'] == x_column) & (table['Y'] == y_column)]
+    bars = alt.Chart(correlogram).mark_bar(color='green').encode(
+        x=alt.X('Lag (days):O'),
+        y=alt.Y('r:Q', scale=alt.Scale(domain=[-1, 1])),
+        tooltip=['Lag (days)', alt.Tooltip('r:Q', format='.3f'), 'Samples', alt.Tooltip('p-value:Q', format='.3g')]
+    )
+    st.altair_chart(bars, use_container_width=True)
+
+render_profile(st)
@@ -1,13 +1,16 @@
 import streamlit as st
-import numpy as np
-import cv2
-from PIL import Image
+import os
 from io import BytesIO
-import pandas as pd
-import matplotlib.pyplot as plt
+from PIL import Image
+from core.canopy import MaskCache, analyze_image_bytes
+from core.metrics import profile_controls, render_profile, stage
+from core.previews import image_preview, mask_preview
+from core.warmup import start_background_warmup
 
 st.set_page_config(layout="wide", page_title="Planta Musica [alpha-version v0.1.3]")
 
+profile_controls(st, "home")
+
 st.write("## THIS WILL NEED TO BE MODIFIED FOR NEW HOMEPAGE")
 st.write("""
          Try uploading images to preprocess, and obtain your picked color (using ad-hoc HSV range for now) color-picker will be added later. 
@@ -30,38 +33,50 @@ MAX_FILE_SIZE = 5 * 1024 * 1024  # 5MB
 # Helper function to convert and save image
 def convert_image(img):
     buf = BytesIO()
-    img.save(buf, format=img.format)
+    img.save(buf, format=img.format or 'PNG')
     byte_im = buf.getvalue()
     return byte_im
 
-# Image processing function
-def process_image(image):
-    col1, col2 = st.columns(2)
-    col1.write("Original Image :camera:")
-    col1.image(image)
-
-    # Convert image to array and then to HSV
-    image_array = np.array(image.convert('RGB'))  # Ensure image is in RGB
-    hsv_image = cv2.cvtColor(image_array, cv2.COLOR_RGB2HSV)
+# Process-wide cache of masks and areas, keyed by image content, HSV bounds and scaling factor
+# Masks prebuilt by `python -m core.warmup` are read from PLANTAMUSICA_MASK_CACHE_DIR, new ones stay in memory
+@st.cache_resource
+def get_mask_cache():
+    return MaskCache(cache_dir=os.environ.get("PLANTAMUSICA_MASK_CACHE_DIR"), read_only=True)
 
-    # Define the range for green color in HSV and create a mask
-    lower_green = np.array([35, 50, 50])
-    upper_green = np.array([85, 255, 255])
-    mask = cv2.inRange(hsv_image, lower_green, upper_green)
+# Threshold the image in HSV (or reuse the cached result for identical content) and encode
+# downscaled previews, cached by content so a rerun neither recomputes nor re-encodes anything
+@st.cache_data(max_entries=64, show_spinner=False)
+def analyze_with_previews(image_bytes):
+    mask, pixel_area, green_area_cm2 = analyze_image_bytes(image_bytes, cache=get_mask_cache())
+    with stage('preview_encode'):
+        return image_preview(image_bytes), mask_preview(mask), green_area_cm2
 
-    # Convert mask back to an image for display
-    mask_image = Image.fromarray(mask)
-    processed_image = mask_image
+# Full resolution masks are only encoded when downloads are asked for
+full_quality_downloads = st.sidebar.checkbox("Prepare full quality downloads")
 
-    col2.write("Processed Image :wrench:")
-    col2.image(processed_image, use_column_width=True)
-    return processed_image, image_array  # Return both processed mask and original RGB array
+# Image processing function
+def process_image(image_bytes, image_name):
+    with stage('analyze'):
+        original_preview, processed_preview, green_area_cm2 = analyze_with_previews(image_bytes)
 
-# Function to calculate Canopy Coverage in pixels
-def get_area_in_pixels(mask):
-    # Calculate the Canopy Coverage pixels directly from the mask
-    green_area_pixels = np.sum(mask == 255)
-    return green_area_pixels
+    col1, col2 = st.columns(2)
+    with stage('st_image'):
+        col1.write("Original Image :camera:")
+        col1.image(original_preview)
+        col2.write("Processed Image :wrench:")
+        col2.image(processed_preview, use_column_width=True)
+
+    if full_quality_downloads:
+        mask, _, _ = analyze_image_bytes(image_bytes, cache=get_mask_cache())
+        with stage('download_encode'):
+            mask_png = convert_image(Image.fromarray(mask))
+        st.sidebar.download_button(
+            label=f"Download processed {image_name}",
+            data=mask_png,
+            file_name=f"{os.path.splitext(image_name)[0]}_mask.png",
+            mime='image/png',
+            key=f"download_{image_name}_{len(canopy_areas)}")
+    return green_area_cm2  # Return the Canopy Coverage in cm²
 
 # Automatically analyze the default images at the beginning
 default_images_paths = ["images/Day20.jpg", "images/Day22.jpg", "images/Day24.jpg","images/Day26.jpg","images/Day28.jpg"]
@@ -69,11 +84,9 @@ canopy_areas = []
 image_names = []
 
 for image_path in default_images_paths:
-    image = Image.open(image_path)
-    processed_image, original_image = process_image(image)
-    pixel_area = get_area_in_pixels(np.array(processed_image))
-    scaling_factor = 4096  # obtained from calibration
-    green_area_cm2 = pixel_area / scaling_factor
+    with open(image_path, 'rb') as f:
+        image_bytes = f.read()
+    green_area_cm2 = process_image(image_bytes, image_path.split('/')[-1])
     canopy_areas.append(green_area_cm2)
     image_names.append(image_path.split('/')[-1])
 
@@ -90,11 +103,7 @@ if uploaded_files:
             st.error(f"The file {uploaded_file.name} is too large. Please upload an image smaller than 5MB.")
         else:
             # Process each image and display
-            image = Image.open(uploaded_file)
-            processed_image, original_image = process_image(image)
-            pixel_area = get_area_in_pixels(np.array(processed_image))
-            scaling_factor = 4096  # obtained from calibration
-            green_area_cm2 = pixel_area / scaling_factor
+            green_area_cm2 = process_image(uploaded_file.getvalue(), uploaded_file.name)
             canopy_areas.append(green_area_cm2)
             image_names.append(uploaded_file.name)
 
@@ -105,6 +114,10 @@ else:
 
 # If there are results, display them in a table and plot
 if canopy_areas:
+    # pandas and matplotlib are only imported here so the images above render before they load
+    import pandas as pd
+    import matplotlib.pyplot as plt
+
     # Create a DataFrame for displaying results in a table
     results_df = pd.DataFrame({
         "Image Name": image_names,
@@ -115,14 +128,27 @@ if canopy_areas:
     st.write("### Canopy Coverage Results", results_df)
     
     # Plot the results
-    fig, ax = plt.subplots()
-    ax.bar(image_names, canopy_areas, color='green')
-    ax.set_xlabel('Image Name')
-    ax.set_ylabel('Canopy Coverage (cm²)')
-    ax.set_title('Canopy Coverage of Plants')
-    ax.set_xticklabels(image_names, rotation=45, ha='right')
-    plt.tight_layout()
-    st.pyplot(fig)
+    with stage('plot'):
+        fig, ax = plt.subplots()
+        ax.bar(image_names, canopy_areas, color='green')
+        ax.set_xlabel('Image Name')
+        ax.set_ylabel('Canopy Coverage (cm²)')
+        ax.set_title('Canopy Coverage of Plants')
+        ax.set_xticklabels(image_names, rotation=45, ha='right')
+        plt.tight_layout()
+        st.pyplot(fig)
+        plt.close(fig)  # pyplot keeps every figure alive until it is closed
 
 # Button to rerun the app (triggers a rerun of the script)
-st.button("Re-run")
\ No newline at end of file
+st.button("Re-run")
+
+# Import librosa and compile its numba kernels in the background once per server process (after
+# this page has rendered), so the first visit of the Music Analysis page doesn't have to wait for it
+@st.cache_resource
+def warm_up_music_analysis():
+    return start_background_warmup()
+
+warm_up_music_analysis()
+
+render_profile(st)
+
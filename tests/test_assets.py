@@ -0,0 +1,43 @@
+# Shared assets stay on disk while any array derived from them is alive, and are evicted after
+import gc
+
+import numpy as np
+
+from core.assets import AssetStore
+
+
+def _decode():
+    return np.arange(1000, dtype=np.float64)  # 8000 bytes
+
+
+def test_derived_arrays_keep_the_asset(tmp_path):
+    store = AssetStore(max_bytes=10000, directory=str(tmp_path))
+    y = store.get('a', _decode)
+    # A memmap-typed view of y has the mapping, not y, as its base
+    kept = y.view(np.memmap)[5:]
+    del y
+    gc.collect()
+    store.get('b', _decode)  # over the budget, but 'a' is still in use
+    assert (tmp_path / 'a.npy').exists()
+    assert kept[0] == 5
+
+
+def test_released_assets_are_evicted(tmp_path):
+    store = AssetStore(max_bytes=10000, directory=str(tmp_path))
+    y = store.get('a', _decode)[::3]
+    del y
+    gc.collect()
+    store.get('b', _decode)
+    assert not (tmp_path / 'a.npy').exists()
+    assert len(store) == 1
+
+
+def test_stored_file_is_reused(tmp_path):
+    calls = []
+
+    def decode():
+        calls.append(1)
+        return _decode()
+    np.testing.assert_array_equal(AssetStore(directory=str(tmp_path)).get('a', decode), _decode())
+    np.testing.assert_array_equal(AssetStore(directory=str(tmp_path)).get('a', decode), _decode())
+    assert len(calls) == 1
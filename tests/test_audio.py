@@ -0,0 +1,53 @@
+# Streamed analysis (block by block) must give the numbers of the in-memory librosa path
+import numpy as np
+import pytest
+
+librosa = pytest.importorskip("librosa")
+
+from core.audio import PROFILES, SAMPLE_RATE, array_blocks, spectral_statistics, stream_analysis, \
+    stream_spectral_statistics, stream_tempo
+from core.feature_store import extract_features, stream_features
+
+BLOCK_SIZES = [SAMPLE_RATE * 30, 7777]  # the page's blocks, and blocks not aligned with the hop
+
+
+# 40 s of a slowly modulated tone with noise and a click every 0.45 s
+@pytest.fixture(scope="module")
+def signal():
+    rng = np.random.default_rng(0)
+    t = np.arange(SAMPLE_RATE * 40) / SAMPLE_RATE
+    y = (0.3 * np.sin(2 * np.pi * 220 * t) * (1 + np.sin(2 * np.pi * 0.1 * t))
+         + 0.05 * rng.standard_normal(len(t))).astype(np.float32)
+    return y + librosa.clicks(times=np.arange(0, 40, 0.45), sr=SAMPLE_RATE, length=len(y))
+
+
+@pytest.mark.parametrize("block_size", BLOCK_SIZES)
+def test_spectral_statistics(signal, block_size):
+    expected = spectral_statistics(librosa.amplitude_to_db(np.abs(librosa.stft(signal)), ref=np.max), SAMPLE_RATE)
+    streamed = stream_spectral_statistics(lambda: array_blocks(signal, block_size))
+    assert streamed.keys() == expected.keys()
+    for name, value in expected.items():
+        assert abs(streamed[name] - value) < 1e-4, name
+
+
+@pytest.mark.parametrize("block_size", BLOCK_SIZES)
+def test_mel_onset_envelope_and_tempo(signal, block_size):
+    expected = librosa.onset.onset_strength(y=signal, sr=SAMPLE_RATE, aggregate=np.median)
+    _, envelope, n_samples = stream_analysis(lambda: array_blocks(signal, block_size), onset='mel')
+    assert n_samples == len(signal)
+    np.testing.assert_allclose(envelope, expected, rtol=1e-5, atol=1e-5)
+    assert stream_tempo(envelope) == librosa.feature.tempo(onset_envelope=expected, sr=SAMPLE_RATE)
+
+
+@pytest.mark.parametrize("profile", sorted(PROFILES))
+def test_stream_features_match_extract_features(signal, profile):
+    sr = PROFILES[profile]['sr']
+    y = signal if sr == SAMPLE_RATE else librosa.resample(signal, orig_sr=SAMPLE_RATE, target_sr=sr)
+    expected = extract_features(y, sr, profile=profile)
+    streamed = stream_features(lambda: array_blocks(y, 7777), sr, profile)
+    assert streamed['tempo'] == expected['tempo']
+    np.testing.assert_array_equal(streamed['beat_times'], expected['beat_times'])
+    for name in ('waveform_min', 'waveform_max', 'waveform_times'):
+        np.testing.assert_array_equal(streamed[name], expected[name])
+    for name in ('duration', 'spectral_mean', 'spectral_std', 'low_freq_mean', 'high_freq_std'):
+        assert abs(streamed[name] - expected[name]) < 1e-4, name
@@ -0,0 +1,43 @@
+# The batched R² of every column pair and degree must match separate np.polyfit fits
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from core.fitting import batched_r2, fit_matrix, r2_score
+
+
+def _polyfit_r2(x, y, degree):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # RankWarning at high degrees
+        return r2_score(y, np.polyval(np.polyfit(x, y, degree), x))
+
+
+def test_batched_r2_matches_polyfit():
+    rng = np.random.default_rng(0)
+    X = rng.uniform(10, 30, size=(40, 3))
+    Y = np.column_stack([np.sin(X[:, 0] / 3), X[:, 1] ** 2 + rng.normal(size=40), rng.normal(size=40)])
+    r2 = batched_r2(X, Y, max_degree=6)
+    for i in range(X.shape[1]):
+        for j in range(Y.shape[1]):
+            for degree in range(1, 7):
+                assert abs(r2[i, degree - 1, j] - _polyfit_r2(X[:, i], Y[:, j], degree)) < 1e-8
+
+
+# Degrees with fewer distinct x values than coefficients have no R²
+def test_underdetermined_degrees_are_nan():
+    x = np.repeat([1.0, 2.0, 3.0], 5)
+    r2 = batched_r2(x[:, None], (x ** 2 + np.arange(15) % 2)[:, None], max_degree=4)
+    assert np.isfinite(r2[0, :2, 0]).all()
+    assert np.isnan(r2[0, 2:, 0]).all()
+
+
+# Columns with missing values are fitted on the rows where both values are present
+def test_fit_matrix_with_gaps():
+    rng = np.random.default_rng(1)
+    df = pd.DataFrame(rng.normal(size=(30, 3)), columns=["a", "b", "c"])
+    df.loc[[2, 5, 11], "b"] = np.nan
+    table = fit_matrix(df, max_degree=3)
+    row = table[(table["X"] == "a") & (table["Y"] == "b") & (table["Degree"] == 2)].iloc[0]
+    present = df[["a", "b"]].dropna()
+    assert abs(row["R2"] - _polyfit_r2(present["a"], present["b"], 2)) < 1e-8
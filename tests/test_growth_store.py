@@ -0,0 +1,43 @@
+# The per-day table of the growth store: canopy measurements merged into the sensor readings
+import numpy as np
+import pandas as pd
+
+from core.growth_store import CANOPY_COLUMN, GrowthStore
+
+
+def _store(tmp_path):
+    store = GrowthStore(str(tmp_path / 'growth.sqlite'))
+    store.ingest_sensors(pd.DataFrame({'Day': [1, 2, 3, 4],
+                                       'Air Temp Mean (°C)': [20.0, 21.0, 22.0, 23.0],
+                                       CANOPY_COLUMN: [10.0, 11.0, 12.0, 13.0]}))
+    # Two images on day 3, one on day 4 and one on day 5, which has no sensor readings
+    for sha, day, pixels in (('a', 3, 100), ('b', 3, 300), ('c', 4, 500), ('d', 5, 700)):
+        store.add_canopy(sha, f'day{day}_{sha}.jpg', pixels, day=day, scaling_factor=10)
+    return store
+
+
+def test_daily_table_merges_canopy_into_sensor_days(tmp_path):
+    table = _store(tmp_path).daily_table()
+    assert list(table['Day']) == [1, 2, 3, 4, 5]
+    assert list(table.columns) == ['Day', 'Air Temp Mean (°C)', CANOPY_COLUMN]
+    # Measured images take precedence over the recorded reading, days without images keep it
+    assert list(table[CANOPY_COLUMN]) == [10.0, 11.0, 20.0, 50.0, 70.0]
+    # Days that only have images are kept, without sensor readings
+    assert np.isnan(table['Air Temp Mean (°C)'].iloc[-1])
+
+
+def test_daily_table_day_range(tmp_path):
+    store = _store(tmp_path)
+    assert store.day_range() == (1, 5)
+    table = store.daily_table(2, 4)
+    assert list(table['Day']) == [2, 3, 4]
+    assert list(table[CANOPY_COLUMN]) == [11.0, 20.0, 50.0]
+    assert list(store.daily_table(5, None)['Day']) == [5]
+
+
+def test_daily_table_without_sensor_readings(tmp_path):
+    store = GrowthStore(str(tmp_path / 'growth.sqlite'))
+    store.add_canopy('a', 'day7.jpg', 100, day=7, scaling_factor=10)
+    table = store.daily_table()
+    assert list(table.columns) == ['Day', CANOPY_COLUMN]
+    assert list(table[CANOPY_COLUMN]) == [10.0]
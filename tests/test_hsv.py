@@ -0,0 +1,39 @@
+# The fused HSV kernel must give the counts and masks of cv2.cvtColor + cv2.inRange for every 8-bit color
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip("cv2")
+pytest.importorskip("numba")
+
+from core.canopy import LOWER_GREEN, UPPER_GREEN
+from core.hsv import count_in_range
+
+
+# All 2^24 RGB colors in one 4096x4096 image
+@pytest.fixture(scope="module")
+def all_colors():
+    colors = np.arange(1 << 24, dtype=np.uint32)
+    return np.stack([(colors >> 16) & 255, (colors >> 8) & 255, colors & 255], axis=-1) \
+        .astype(np.uint8).reshape(4096, 4096, 3)
+
+
+@pytest.mark.parametrize("lower, upper", [
+    (LOWER_GREEN, UPPER_GREEN),
+    ((0, 0, 0), (179, 255, 255)),
+    ((0, 1, 1), (0, 255, 255)),
+    ((90, 30, 200), (130, 31, 255)),
+    ((170, 0, 0), (179, 254, 254)),
+])
+def test_matches_opencv_for_every_color(all_colors, lower, upper):
+    expected = cv2.inRange(cv2.cvtColor(all_colors, cv2.COLOR_RGB2HSV), np.array(lower), np.array(upper))
+    mask = np.empty(all_colors.shape[:2], dtype=np.uint8)
+    assert count_in_range(all_colors, lower, upper, mask_out=mask) == cv2.countNonZero(expected)
+    assert np.array_equal(mask, expected)
+
+
+# Non-contiguous views (image tiles, RGBA arrays) are read the same way
+def test_strided_input(all_colors):
+    rgba = np.concatenate([all_colors[:512, :512], np.full((512, 512, 1), 255, np.uint8)], axis=2)[::2, 1::3]
+    expected = cv2.inRange(cv2.cvtColor(np.ascontiguousarray(rgba[..., :3]), cv2.COLOR_RGB2HSV),
+                           np.array(LOWER_GREEN), np.array(UPPER_GREEN))
+    assert count_in_range(rgba, LOWER_GREEN, UPPER_GREEN) == cv2.countNonZero(expected)
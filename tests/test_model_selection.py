@@ -0,0 +1,27 @@
+# Both factorizations of the resampled fits (QR and, above QR_MAX_ROWS rows, the pivoted Gram
+# matrix) must score the same degrees and leave only the unsolvable ones empty
+import numpy as np
+import pytest
+
+from core.fitting import QR_MAX_ROWS
+from core.model_selection import model_selection
+
+
+@pytest.mark.parametrize("n", [60, QR_MAX_ROWS + 1000])
+def test_few_distinct_x_values(n):
+    rng = np.random.default_rng(0)
+    x = rng.integers(0, 5, n).astype(float)
+    y = x ** 2 + rng.normal(size=n)
+    table, _, bands = model_selection(x, y, replicates=100, repeats=4, workers=1)
+    assert table.loc[:3, 'CV RMSE'].notna().all() and table.loc[4:, 'CV RMSE'].isna().all()
+    assert np.isfinite(bands[:4]).all()
+
+
+def test_gram_route_matches_qr(monkeypatch):
+    rng = np.random.default_rng(1)
+    x = rng.uniform(0, 10, QR_MAX_ROWS + 1000)
+    y = np.sin(x) + rng.normal(scale=0.1, size=len(x))
+    gram, _, _ = model_selection(x, y, max_degree=6, replicates=50, repeats=2, workers=1)
+    monkeypatch.setattr('core.model_selection.QR_MAX_ROWS', len(x))
+    qr, _, _ = model_selection(x, y, max_degree=6, replicates=50, repeats=2, workers=1)
+    np.testing.assert_allclose(gram['CV RMSE'], qr['CV RMSE'], rtol=1e-6)